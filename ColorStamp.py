@@ -1,27 +1,68 @@
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image
 import os
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from datetime import datetime
-import cv2
 import numpy as np
-import exifread
-from sklearn.mixture import GaussianMixture
+
+from jobs import BackgroundJob
+from stampcore.assets import DEFAULT_MEMORY_BUDGET, INTEGRAL_BYTES_PER_PIXEL, open_asset
+from stampcore.cache import get_default_cache
+from stampcore.export import DEFAULT_PRESET, EXPORT_PRESETS, export_canvas
+from stampcore.fonts import FontIndex
+from stampcore.integral import IntegralImage
+from stampcore.palette import DEFAULT_BACKEND, PALETTE_BACKENDS
+from stampcore.render import LayeredComposer
+from stampcore.spec import make_spec, render_spec
+from stampcore.timing import recorder, span, write_chrome_trace, write_span_log
 
 class MetadataPaletteGenerator:
+    # Upper bound on hover color updates per second; motion events in between are coalesced
+    hover_max_rate = 60
+    # Number of most recent timing spans listed in the timings panel
+    timing_panel_rows = 50
+    # Largest size of the preview window
+    preview_max_size = (800, 900)
+
     def __init__(self, root):
         self.root = root
         self.root.title("Metadata and Palette Generator")
         self.root.geometry("1200x800")
         
         self.image_path = None
-        self.image = None
+        self.asset = None
         self.display_image = None
+        self.display_integral = None
+        self.composer = LayeredComposer()
         self.palette_colors = []
         self.selected_colors = []
         self.shadow_var = tk.BooleanVar(value=True)
         self.font_var = tk.StringVar(value="default")
         self.font_size_var = tk.IntVar(value=24)  # Default font size is 24
+        self.palette_backend_var = tk.StringVar(value=DEFAULT_BACKEND)
+        self.num_colors_var = tk.IntVar(value=10)
+        self.last_num_colors = 10
+        self.full_res_sampling_var = tk.BooleanVar(value=False)
+        self.low_memory_var = tk.BooleanVar(value=False)
+        self.export_preset_var = tk.StringVar(value=DEFAULT_PRESET)
+        self.pending_hover_event = None
+        self.hover_update_scheduled = False
+        self.last_hover_update = 0.0
+        self.hover_label_state = None
+        self.load_job = None
+        self.palette_job = None
+        self.pending_palette_action = None
+        self.save_job = None
+        self.preview_job = None
+        self.preview_job_spec = None
+        self.preview_spec = None
+        self.preview_window = None
+        self.preview_canvas = None
+        self.timing_window = None
+        self.timing_tree = None
+        self.track_memory_var = tk.BooleanVar(value=recorder.track_memory)
+        self.timing_panel_started_recording = False
+        self.timing_panel_last_span = None
 
         # Create frames
         self.top_frame = tk.Frame(root)
@@ -50,10 +91,16 @@ class MetadataPaletteGenerator:
         self.setup_options_frame()
         self.setup_bottom_frame()
 
+        # An open preview window follows option changes
+        for variable in (self.shadow_var, self.font_var, self.font_size_var):
+            variable.trace_add("write", lambda *args: self.refresh_preview())
+
         
-        # Detect available fonts
+        # Fill the font list from the saved index, then pick up font changes in the background
+        self.font_index = FontIndex()
         self.available_fonts = self.get_available_fonts()
         self.update_font_dropdown()
+        self.refresh_fonts()
 
 
     
@@ -73,6 +120,10 @@ class MetadataPaletteGenerator:
         self.rectangle_tool_button = tk.Button(self.top_frame, text="Rectangle Tool", command=self.activate_rectangle_tool)
         self.rectangle_tool_button.pack(side=tk.LEFT, padx=5)
 
+        # Progress indicator for decoding and palette extraction running in the background
+        self.progress_bar = ttk.Progressbar(self.top_frame, mode="indeterminate", length=120)
+        self.status_label = tk.Label(self.top_frame, text="")
+
     def activate_rectangle_tool(self):
         """Activate the rectangle tool for selecting regions"""
         if not self.image_path:
@@ -143,14 +194,10 @@ class MetadataPaletteGenerator:
             # Only proceed if we have a valid rectangle
             if img_x1 < img_x2 and img_y1 < img_y2:
                 try:
-                    # Crop the region from the displayed image
-                    cropped_region = self.display_image.crop((img_x1, img_y1, img_x2, img_y2))
-                    
-                    # Calculate the average color of the cropped region
-                    pixels = np.array(cropped_region)
-                    if pixels.size > 0:  # Make sure there are pixels to analyze
-                        avg_color = tuple(np.mean(pixels, axis=(0, 1)).astype(int))
-                        
+                    # Calculate the average color of the selected region
+                    avg_color = self.average_color(img_x1, img_y1, img_x2, img_y2,
+                                                   full_resolution=self.full_res_sampling_var.get())
+                    if avg_color is not None:  # Make sure there are pixels to analyze
                         # Add the average color to the selected colors
                         self.select_color(avg_color)
                 except Exception as e:
@@ -181,19 +228,71 @@ class MetadataPaletteGenerator:
             y_start = max(0, img_y - range_size)
             y_end = min(self.display_image.height, img_y + range_size)
             
-            # Crop the region around the cursor
-            cropped_region = self.display_image.crop((x_start, y_start, x_end, y_end))
-            
-            # Calculate the average color of the cropped region
-            pixels = np.array(cropped_region)
-            avg_color = tuple(np.mean(pixels, axis=(0, 1)).astype(int))
+            # Calculate the average color of the region around the cursor
+            avg_color = self.average_color(x_start, y_start, x_end, y_end)
             
             # Update the color preview label
             hex_color = f'#{avg_color[0]:02x}{avg_color[1]:02x}{avg_color[2]:02x}'
-            self.color_preview_label.config(text=f"Hover Color: {hex_color}", bg=hex_color)
+            self.set_hover_label(f"Hover Color: {hex_color}", hex_color)
         else:
             # Reset the label if the cursor is outside the image
-            self.color_preview_label.config(text="Hover Color: None", bg="white")
+            self.set_hover_label("Hover Color: None", "white")
+
+    def set_hover_label(self, text, background):
+        """Reconfigure the hover label only when its content actually changes"""
+        if self.hover_label_state != (text, background):
+            self.hover_label_state = (text, background)
+            self.color_preview_label.config(text=text, bg=background)
+
+    def queue_hover_color(self, event):
+        """Coalesce motion events: only the latest position is processed, at most hover_max_rate times a second"""
+        self.pending_hover_event = event
+        if self.hover_update_scheduled:
+            return
+        self.hover_update_scheduled = True
+        
+        # Wait out the rest of the minimum interval, then run once Tk has drained its pending events
+        min_interval = 1.0 / self.hover_max_rate
+        wait_ms = int((self.last_hover_update + min_interval - time.monotonic()) * 1000)
+        if wait_ms > 0:
+            self.root.after(wait_ms, lambda: self.root.after_idle(self.process_hover_color))
+        else:
+            self.root.after_idle(self.process_hover_color)
+
+    def process_hover_color(self):
+        event, self.pending_hover_event = self.pending_hover_event, None
+        self.hover_update_scheduled = False
+        self.last_hover_update = time.monotonic()
+        if event is not None:
+            self.show_hover_color(event)
+
+    def average_color(self, x_start, y_start, x_end, y_end, full_resolution=False):
+        """Average color of a box given in display image coordinates, in constant time"""
+        # The full-resolution table is built on a worker (see prepare_full_res_sampling), and
+        # never if it exceeds the memory budget; until it is ready, sample the display copy
+        integral = self.asset.integral_ready if full_resolution else None
+        if integral is None:
+            return self.display_integral.mean(x_start, y_start, x_end, y_end)
+        
+        # Map the box onto the full-resolution image and average the same area there
+        scale_x = self.asset.size[0] / self.display_image.width
+        scale_y = self.asset.size[1] / self.display_image.height
+        return integral.mean(
+            round(x_start * scale_x), round(y_start * scale_y),
+            max(round(x_end * scale_x), round(x_start * scale_x) + 1),
+            max(round(y_end * scale_y), round(y_start * scale_y) + 1),
+        )
+
+    def prepare_full_res_sampling(self):
+        """Build the full-resolution summed-area table in the background so the first pick is instant"""
+        if not (self.full_res_sampling_var.get() and self.asset):
+            return
+        asset = self.asset
+        if not asset.fits_budget(asset.size, INTEGRAL_BYTES_PER_PIXEL):
+            # Low-memory mode keeps sampling the display copy
+            return
+        BackgroundJob(self.root, lambda job: asset.integral,
+                      on_error=lambda e: print(f"Full-resolution sampling unavailable: {e}")).start()
 
     def activate_pipette_tool(self):
         """Activate the pipette tool for selecting colors"""
@@ -227,12 +326,9 @@ class MetadataPaletteGenerator:
             y_start = max(0, img_y - range_size)
             y_end = min(self.display_image.height, img_y + range_size)
             
-            # Crop the region around the clicked point
-            cropped_region = self.display_image.crop((x_start, y_start, x_end, y_end))
-            
-            # Calculate the average color of the cropped region
-            pixels = np.array(cropped_region)
-            avg_color = tuple(np.mean(pixels, axis=(0, 1)).astype(int))
+            # Calculate the average color of the region around the clicked point
+            avg_color = self.average_color(x_start, y_start, x_end, y_end,
+                                           full_resolution=self.full_res_sampling_var.get())
             
             # Add the picked color to the selected colors
             self.select_color(avg_color)
@@ -274,48 +370,76 @@ class MetadataPaletteGenerator:
 
         self.font_size_spinbox = tk.Spinbox(self.options_frame, from_=8, to=72, textvariable=self.font_size_var, width=5)
         self.font_size_spinbox.pack(side=tk.LEFT, padx=5)
+
+        # Palette backend selection
+        self.palette_backend_label = tk.Label(self.options_frame, text="Palette:")
+        self.palette_backend_label.pack(side=tk.LEFT, padx=5)
+
+        self.palette_backend_dropdown = ttk.Combobox(self.options_frame, textvariable=self.palette_backend_var,
+                                                     values=list(PALETTE_BACKENDS), state="readonly", width=10)
+        self.palette_backend_dropdown.pack(side=tk.LEFT, padx=5)
+        self.palette_backend_dropdown.bind("<<ComboboxSelected>>", lambda event: self.extract_colors())
+
+        # Number of palette colors; changing it refits from the previous fit instead of starting over
+        self.num_colors_label = tk.Label(self.options_frame, text="Colors:")
+        self.num_colors_label.pack(side=tk.LEFT, padx=5)
+
+        self.num_colors_spinbox = tk.Spinbox(self.options_frame, from_=2, to=24, textvariable=self.num_colors_var,
+                                             width=4, command=self.change_num_colors)
+        self.num_colors_spinbox.pack(side=tk.LEFT, padx=5)
+        self.num_colors_spinbox.bind("<Return>", lambda event: self.change_num_colors())
+        self.num_colors_spinbox.bind("<FocusOut>", lambda event: self.change_num_colors())
+
+        # Average pipette and rectangle picks over the original pixels instead of the display copy
+        self.full_res_sampling_check = tk.Checkbutton(self.options_frame, text="Full-Res Sampling",
+                                                      variable=self.full_res_sampling_var,
+                                                      command=self.prepare_full_res_sampling)
+        self.full_res_sampling_check.pack(side=tk.LEFT, padx=5)
+
+        # Keep only reduced copies of very large images in memory
+        self.low_memory_check = tk.Checkbutton(self.options_frame, text="Low Memory",
+                                               variable=self.low_memory_var, command=self.reopen_image)
+        self.low_memory_check.pack(side=tk.LEFT, padx=5)
     
     def setup_bottom_frame(self):
         self.save_button = tk.Button(self.bottom_frame, text="Save Image", command=self.save_image)
         self.save_button.pack(side=tk.RIGHT, padx=5)
         
+        # Export preset: which formats and encoder settings "Save Image" writes
+        self.export_preset_dropdown = ttk.Combobox(self.bottom_frame, textvariable=self.export_preset_var,
+                                                   values=list(EXPORT_PRESETS), state="readonly", width=10)
+        self.export_preset_dropdown.pack(side=tk.RIGHT, padx=5)
+
+        self.export_preset_label = tk.Label(self.bottom_frame, text="Export:")
+        self.export_preset_label.pack(side=tk.RIGHT, padx=5)
+
         self.clear_selected_button = tk.Button(self.bottom_frame, text="Clear Selected", command=self.clear_selected_colors)
         self.clear_selected_button.pack(side=tk.RIGHT, padx=5)
+
+        self.timings_button = tk.Button(self.bottom_frame, text="Timings", command=self.show_timing_panel)
+        self.timings_button.pack(side=tk.LEFT, padx=5)
     
     def get_available_fonts(self):
-        """Detect available fonts on the system"""
-        fonts = ["default"]
-        
-        # Common font directories
-        font_dirs = [
-            # Windows
-            r"C:\Windows\Fonts",
-            # MacOS
-            "/Library/Fonts",
-            "/System/Library/Fonts",
-            os.path.expanduser("~/Library/Fonts"),
-            # Linux
-            "/usr/share/fonts",
-            "/usr/local/share/fonts",
-            os.path.expanduser("~/.fonts")
-        ]
-        
-        # Look for common font file extensions
-        font_extensions = ['.ttf', '.otf', '.ttc']
-        
-        for font_dir in font_dirs:
-            if os.path.exists(font_dir):
-                for root, dirs, files in os.walk(font_dir):
-                    for file in files:
-                        if any(file.lower().endswith(ext) for ext in font_extensions):
-                            fonts.append(os.path.join(root, file))
-        
-        return fonts
+        """List the available fonts from the font index"""
+        return ["default"] + self.font_index.paths()
+    
+    def refresh_fonts(self):
+        """Rescan changed font directories on a worker thread and update the dropdown if needed"""
+        def on_done(fonts_changed):
+            if fonts_changed:
+                self.available_fonts = self.get_available_fonts()
+                self.update_font_dropdown()
+        
+        BackgroundJob(self.root, lambda job: self.font_index.refresh(), on_done=on_done).start()
     
     def update_font_dropdown(self):
         """Update font dropdown with available fonts"""
-        self.font_dropdown['values'] = ["default"] + [os.path.basename(f) for f in self.available_fonts if f != "default"]
-        self.font_dropdown.current(0)
+        values = ["default"] + [os.path.basename(f) for f in self.available_fonts if f != "default"]
+        self.font_dropdown['values'] = values
+        
+        # Keep the user's choice when the list is refreshed in the background
+        if self.font_var.get() not in values:
+            self.font_dropdown.current(0)
     
     def open_image(self):
         file_path = filedialog.askopenfilename(
@@ -335,17 +459,72 @@ class MetadataPaletteGenerator:
             self.extract_colors()
         
     def load_image(self):
+        """Decode the image and build its display copy on a worker thread"""
+        # A newer image supersedes one that is still loading
+        if self.load_job:
+            self.load_job.cancel()
+        self.cancel_preview()
+        self.pending_palette_action = None
+        
         try:
-            self.image = Image.open(self.image_path)
-            self.resize_image_for_display()
-            self.display_image_on_canvas()
-
-            # Automatically enable live color preview
-            self.canvas.bind("<Motion>", self.show_hover_color)
+            memory_budget = DEFAULT_MEMORY_BUDGET if self.low_memory_var.get() else None
+            self.asset = open_asset(self.image_path, cache=get_default_cache(), memory_budget=memory_budget)
         except Exception as e:
             messagebox.showerror("Error", f"Could not open image: {str(e)}")
+            return
+        
+        asset = self.asset
+        canvas_size = self.get_canvas_size()
+        
+        def work(job):
+            with span("open_image", path=os.path.basename(asset.path)):
+                # Decode only as much of the image as the canvas needs
+                image_size = asset.size
+                job.check_cancelled()
+                job.post(self.update_progress, "Decoding image...")
+                return asset.proxy(self.get_display_size(image_size, canvas_size), check_cancelled=job.check_cancelled)
+        
+        self.load_job = BackgroundJob(self.root, work, on_done=self.on_image_loaded,
+                                      on_error=self.on_image_load_failed).start()
+        self.update_progress("Opening image...")
+    
+    def reopen_image(self):
+        """Open the current image again, e.g. after switching the low-memory mode"""
+        if self.image_path:
+            self.load_image()
+            self.extract_colors()
+
+    def on_image_loaded(self, result):
+        """Show a freshly decoded image (runs on the Tk main thread)"""
+        self.display_image = result
+        self.display_integral = IntegralImage(np.asarray(self.display_image))
+        self.display_image_on_canvas()
+        
+        # Automatically enable live color preview
+        self.canvas.bind("<Motion>", self.queue_hover_color)
+        self.prepare_full_res_sampling()
+        self.update_progress()
+    
+    def on_image_load_failed(self, error):
+        self.update_progress()
+        messagebox.showerror("Error", f"Could not open image: {str(error)}")
     
-    def resize_image_for_display(self):
+    def update_progress(self, status=None):
+        """Show the progress indicator while a background job runs, hide it otherwise"""
+        busy = any(job and job.running for job in (self.load_job, self.palette_job, self.save_job, self.preview_job))
+        if busy:
+            if status:
+                self.status_label.config(text=status)
+            if not self.progress_bar.winfo_ismapped():
+                self.progress_bar.pack(side=tk.LEFT, padx=5)
+                self.status_label.pack(side=tk.LEFT, padx=5)
+                self.progress_bar.start(15)
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.pack_forget()
+            self.status_label.pack_forget()
+    
+    def get_canvas_size(self):
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
         
@@ -354,31 +533,30 @@ class MetadataPaletteGenerator:
             canvas_width = 800
             canvas_height = 600
         
-        img_width, img_height = self.image.size
+        return canvas_width, canvas_height
+    
+    def get_display_size(self, image_size, canvas_size):
+        """Fit the image into the canvas while preserving its aspect ratio"""
+        img_width, img_height = image_size
+        canvas_width, canvas_height = canvas_size
         
         # Calculate new dimensions
         ratio = min(canvas_width / img_width, canvas_height / img_height)
         new_width = int(img_width * ratio)
         new_height = int(img_height * ratio)
         
-        self.display_image = self.image.resize((new_width, new_height), Image.LANCZOS)
+        return new_width, new_height
     
     def display_image_on_canvas(self):
         if self.display_image:
             # Convert to PhotoImage
-            self.tk_image = tk.PhotoImage(data=self.pil_to_data(self.display_image))
+            self.tk_image = tk.PhotoImage(data=self.pil_to_data(self.display_image), format="PPM")
             
             # Clear canvas
             self.canvas.delete("all")
             
             # Calculate position to center the image
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
-            
-            if canvas_width <= 1 or canvas_height <= 1:
-                # Canvas not ready yet, use default size
-                canvas_width = 800
-                canvas_height = 600
+            canvas_width, canvas_height = self.get_canvas_size()
             
             x = (canvas_width - self.display_image.width) // 2
             y = (canvas_height - self.display_image.height) // 2
@@ -409,51 +587,84 @@ class MetadataPaletteGenerator:
         
     def pil_to_data(self, image):
         """Convert PIL image to format suitable for tkinter PhotoImage"""
-        # Save image to a temporary file
-        temp_file = "temp_image.png"
-        image.save(temp_file)
+        # Build a binary PPM in memory: a short header followed by the raw RGB buffer,
+        # which Tk parses without any compression or temporary file
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        header = f"P6 {image.width} {image.height} 255\n".encode('ascii')
+        return header + image.tobytes()
+    
+    def extract_colors(self):
+        """Extract dominant colors with the selected palette backend on a worker thread"""
+        if not self.asset:
+            return
         
-        # Read the file data
-        with open(temp_file, "rb") as file:
-            data = file.read()
+        # Drop the result of an extraction that is still running for an older image or backend
+        if self.palette_job:
+            self.palette_job.cancel()
         
-        # Clean up
+        self.palette_colors = []
+        self.update_color_selection()
+        
+        asset = self.asset
+        backend = self.palette_backend_var.get()
+        num_colors = self.get_num_colors()
+        
+        def work(job):
+            with span("extract_colors", backend=backend, num_colors=num_colors):
+                # Reopened images are served from the persistent cache without a fit,
+                # other color counts are refitted from the previous fit of this image
+                return asset.palette(num_colors=num_colors, backend=backend, check_cancelled=job.check_cancelled)
+        
+        self.palette_job = BackgroundJob(self.root, work, on_done=self.on_colors_extracted,
+                                         on_error=self.on_color_extraction_failed).start()
+        self.update_progress("Extracting colors...")
+    
+    def get_num_colors(self):
+        """The palette color count from the spinbox, reset to the last valid value if it is not a number"""
         try:
-            os.remove(temp_file)
-        except:
+            self.last_num_colors = min(24, max(2, self.num_colors_var.get()))
+        except tk.TclError:
             pass
-        
-        return data
+        self.num_colors_var.set(self.last_num_colors)
+        return self.last_num_colors
+
+    def change_num_colors(self):
+        """Refit the palette if the color count was changed"""
+        previous = self.last_num_colors
+        if self.get_num_colors() != previous:
+            self.extract_colors()
+
+    def on_colors_extracted(self, palette_colors):
+        """Show the extracted palette (runs on the Tk main thread)"""
+        self.palette_colors = palette_colors
+        
+        # Update the color selection UI
+        self.update_color_selection()
+        self.update_progress()
+        self.refresh_preview()
+        
+        # A preview or save that was waiting for the palette can go ahead now
+        action, self.pending_palette_action = self.pending_palette_action, None
+        if action:
+            action()
     
-    def extract_colors(self):
-        """Extract dominant colors using Gaussian Mixture Models"""
-        if self.image_path:
-            num_colors = 10  # Fixed number of colors
-            
-            # Read image with OpenCV
-            img = cv2.imread(self.image_path)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Reshape the image to be a list of pixels
-            pixels = img.reshape(-1, 3)
-            
-            # Reduce the size of the pixel list for faster processing
-            sample_size = min(10000, len(pixels))
-            indices = np.random.choice(len(pixels), size=sample_size, replace=False)
-            sample_pixels = pixels[indices]
-            
-            # Apply Gaussian Mixture Model
-            gmm = GaussianMixture(n_components=num_colors, random_state=42)
-            gmm.fit(sample_pixels)
-            
-            # Get the cluster centers
-            cluster_colors = gmm.means_
-            
-            # Convert to integer RGB tuples
-            self.palette_colors = [tuple(map(int, color)) for color in cluster_colors]
-            
-            # Update the color selection UI
-            self.update_color_selection()
+    def on_color_extraction_failed(self, error):
+        self.pending_palette_action = None
+        self.update_progress()
+        messagebox.showerror("Error", f"Could not extract colors: {str(error)}")
+    
+    def ensure_palette(self, then):
+        """Call then() once palette colors are available, extracting them in the background if needed"""
+        if self.palette_colors:
+            then()
+            return
+        
+        # Run the action when the extraction in progress (or a new one, if it failed or
+        # never ran) delivers its colors; the fit never runs on the Tk main thread
+        self.pending_palette_action = then
+        if not (self.palette_job and self.palette_job.running):
+            self.extract_colors()
 
 
     def update_color_selection(self):
@@ -516,6 +727,8 @@ class MetadataPaletteGenerator:
             label_text = f"{i+1}: {color[0]},{color[1]},{color[2]}"
             rgb_label = tk.Label(color_frame, text=label_text)
             rgb_label.pack()
+        
+        self.refresh_preview()
     
     def remove_selected_color(self, color):
         """Remove a color from the selected colors list"""
@@ -528,123 +741,14 @@ class MetadataPaletteGenerator:
         self.selected_colors = []
         self.update_selected_colors_display()
     
-    def extract_metadata(self):
-        """Extract metadata from the image"""
-        # Initialize metadata variables
-        camera_make = ""
-        camera_model = ""
-        lens_make = ""
-        lens_info = ""
-        aperture = ""
-        shutter = ""
-        iso = ""
-        date_taken = ""
-        
-        # Use exifread to extract metadata
-        try:
-            with open(self.image_path, 'rb') as f:
-                tags = exifread.process_file(f, details=False)
-                
-                # Camera make and model
-                if 'Image Make' in tags:
-                    camera_make = str(tags['Image Make'])
-                if 'Image Model' in tags:
-                    camera_model = str(tags['Image Model'])
-                
-                # Lens make and info
-                if 'EXIF LensMake' in tags:
-                    lens_make = str(tags['EXIF LensMake'])
-                if 'EXIF LensModel' in tags:
-                    lens_info = str(tags['EXIF LensModel'])
-                elif 'EXIF LensSpecification' in tags:
-                    lens_info = str(tags['EXIF LensSpecification'])
-                
-                # Aperture
-                if 'EXIF FNumber' in tags:
-                    fnumber = tags['EXIF FNumber'].values[0]
-                    aperture = f"f/{float(fnumber.num)/float(fnumber.den):.1f}"
-                elif 'EXIF ApertureValue' in tags:
-                    av = tags['EXIF ApertureValue'].values[0]
-                    aperture = f"f/{2**(float(av.num)/float(av.den)/2):.1f}"
-                
-                # Shutter speed
-                if 'EXIF ExposureTime' in tags:
-                    et = tags['EXIF ExposureTime'].values[0]
-                    if et.num < et.den:
-                        shutter = f"1/{int(et.den/et.num)}s"
-                    else:
-                        shutter = f"{float(et.num)/float(et.den):.1f}s"
-                elif 'EXIF ShutterSpeedValue' in tags:
-                    ssv = tags['EXIF ShutterSpeedValue'].values[0]
-                    ss = 2**(-(float(ssv.num)/float(ssv.den)))
-                    if ss < 1:
-                        shutter = f"1/{int(1/ss)}s"
-                    else:
-                        shutter = f"{ss:.1f}s"
-                
-                # ISO
-                if 'EXIF ISOSpeedRatings' in tags:
-                    iso = f"ISO{tags['EXIF ISOSpeedRatings']}"
-                
-                # Date
-                if 'EXIF DateTimeOriginal' in tags:
-                    date_taken = str(tags['EXIF DateTimeOriginal'])
-        except Exception as e:
-            print(f"Error extracting EXIF data: {e}")
-        
-        # Format the camera and lens information
-        if camera_make and camera_model and not camera_model.startswith(camera_make):
-            camera_info = f"{camera_make} {camera_model}"
-        else:
-            camera_info = camera_model
-        
-        if lens_make and lens_info and not lens_info.startswith(lens_make):
-            lens_full_info = f"{lens_make} {lens_info}"
-        else:
-            lens_full_info = lens_info
-        
-        # Format date and time
-        if date_taken:
-            try:
-                date_time_obj = datetime.strptime(date_taken, "%Y:%m:%d %H:%M:%S")
-                formatted_date = date_time_obj.strftime("%Y.%m.%d")
-                formatted_time = date_time_obj.strftime("%H:%M:%S")
-            except:
-                formatted_date = date_taken
-                formatted_time = ""
-        else:
-            now = datetime.now()
-            formatted_date = now.strftime("%Y.%m.%d")
-            formatted_time = now.strftime("%H:%M:%S")
-        
-        return {
-            'camera_info': camera_info,
-            'lens_info': lens_full_info,
-            'aperture': aperture,
-            'shutter': shutter,
-            'iso': iso,
-            'date': formatted_date,
-            'time': formatted_time
-        }
-    
-    def get_font(self):
-        """Get the selected font with the selected size"""
+    def current_spec(self):
+        """Snapshot the current colors and options into a RenderSpec (Tk main thread only)"""
+        # Use selected colors if available, otherwise use all palette colors
+        colors_to_use = self.selected_colors if self.selected_colors else self.palette_colors
         font_selection = self.font_var.get()
-        font_size = self.font_size_var.get()  # Get the selected font size
-        
-        if font_selection == "default":
-            return ImageFont.load_default()
-        
-        # Find the actual font path from the available fonts
-        for font_path in self.available_fonts:
-            if os.path.basename(font_path) == font_selection:
-                try:
-                    return ImageFont.truetype(font_path, font_size)
-                except Exception as e:
-                    print(f"Error loading font {font_path}: {e}")
-                    return ImageFont.load_default()
-        
-        return ImageFont.load_default()
+        font_path = None if font_selection == "default" else self.font_index.lookup(font_selection)
+        return make_spec(self.asset.path, colors=colors_to_use, font_path=font_path,
+                         font_size=self.font_size_var.get(), shadow=self.shadow_var.get())
     
     def preview_result(self):
         """Preview the result before saving"""
@@ -652,205 +756,256 @@ class MetadataPaletteGenerator:
             messagebox.showwarning("Warning", "Please open an image first.")
             return
         
+        # Extract colors if they haven't been extracted yet
+        self.ensure_palette(self.start_preview)
+    
+    def start_preview(self):
+        """Render the preview of the current colors and options"""
         try:
-            # Extract colors if they haven't been extracted yet
-            if not self.palette_colors:
-                self.extract_colors()
-            
-            # Create the preview - use selected colors if available, otherwise use all palette colors
-            colors_to_use = self.selected_colors if self.selected_colors else self.palette_colors
-            preview_image = self.create_image_with_metadata_and_palette(colors_to_use)
-            
-            # Display the preview
-            self.display_preview(preview_image)
+            spec = self.current_spec()
         except Exception as e:
             messagebox.showerror("Error", f"Could not create preview: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            return
+        self.request_preview(spec)
+    
+    def refresh_preview(self):
+        """Re-render the open preview window after a color or option change"""
+        if self.preview_window is None or not self.asset or not (self.selected_colors or self.palette_colors):
+            return
+        try:
+            spec = self.current_spec()
+        except tk.TclError:
+            # The font size field is being edited and holds no number yet
+            return
+        self.request_preview(spec)
+    
+    def request_preview(self, spec):
+        """Render a preview on a worker thread; the newest request supersedes older ones.
+        
+        One preview renders at a time. A request arriving meanwhile replaces any other
+        waiting request and starts as soon as the running render finishes; the result
+        of that render is dropped as stale.
+        """
+        self.preview_spec = spec
+        if not (self.preview_job and self.preview_job.running):
+            self.start_preview_job(spec)
+    
+    def start_preview_job(self, spec):
+        asset = self.asset
+        composer = self.composer
+        
+        def work(job):
+            with span("preview_result"):
+                preview_image = render_spec(spec, asset=asset, composer=composer)
+            job.check_cancelled()
+            
+            # Scale the preview to fit the window
+            width, height = preview_image.size
+            scale = min(self.preview_max_size[0] / width, self.preview_max_size[1] / height)
+            with span("preview_resize"):
+                return preview_image.resize((int(width * scale), int(height * scale)), Image.LANCZOS)
+        
+        self.preview_job_spec = spec
+        self.preview_job = BackgroundJob(self.root, work, on_done=self.on_preview_rendered,
+                                         on_error=self.on_preview_failed).start()
+        self.update_progress("Rendering preview...")
+    
+    def on_preview_rendered(self, preview_image):
+        """Show a finished preview unless a newer request arrived (runs on the Tk main thread)"""
+        if self.preview_spec != self.preview_job_spec:
+            self.start_preview_job(self.preview_spec)
+            return
+        self.update_progress()
+        self.display_preview(preview_image)
+    
+    def on_preview_failed(self, error):
+        if self.preview_spec != self.preview_job_spec:
+            self.start_preview_job(self.preview_spec)
+            return
+        self.update_progress()
+        messagebox.showerror("Error", f"Could not create preview: {str(error)}")
+    
+    def cancel_preview(self):
+        """Drop the running and waiting preview renders"""
+        if self.preview_job and self.preview_job.running:
+            self.preview_job.cancel()
+            self.update_progress()
+        self.preview_spec = None
     
     def display_preview(self, preview_image):
-        """Display the preview image"""
-        # Create a new window for the preview
-        preview_window = tk.Toplevel(self.root)
-        preview_window.title("Preview")
-        
-        # Calculate the size for the preview window
+        """Show the preview image, opening the preview window on first use"""
         width, height = preview_image.size
-        max_width = 800
-        max_height = 900
         
-        scale = min(max_width / width, max_height / height)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        
-        preview_window.geometry(f"{new_width}x{new_height}")
-        
-        # Resize the preview image
-        preview_image_resized = preview_image.resize((new_width, new_height), Image.LANCZOS)
+        if self.preview_window is None:
+            # Create a new window for the preview; it stays open and follows later changes
+            self.preview_window = tk.Toplevel(self.root)
+            self.preview_window.title("Preview")
+            self.preview_window.geometry(f"{width}x{height}")
+            self.preview_window.protocol("WM_DELETE_WINDOW", self.close_preview)
+            
+            # Create a canvas to display the preview
+            self.preview_canvas = tk.Canvas(self.preview_window, width=width, height=height)
+            self.preview_canvas.pack(fill=tk.BOTH, expand=True)
         
         # Convert to PhotoImage
-        preview_tk_image = tk.PhotoImage(data=self.pil_to_data(preview_image_resized))
-        
-        # Create a canvas to display the preview
-        preview_canvas = tk.Canvas(preview_window, width=new_width, height=new_height)
-        preview_canvas.pack(fill=tk.BOTH, expand=True)
+        preview_tk_image = tk.PhotoImage(data=self.pil_to_data(preview_image), format="PPM")
         
         # Display the image
-        preview_canvas.create_image(0, 0, anchor=tk.NW, image=preview_tk_image)
+        self.preview_canvas.delete("all")
+        self.preview_canvas.create_image(0, 0, anchor=tk.NW, image=preview_tk_image)
         
         # Keep a reference to prevent garbage collection
-        preview_window.preview_image = preview_tk_image
-    
-    def create_image_with_metadata_and_palette(self, colors_to_use):
-        """Create a new image with metadata and color palette"""
-        # Get the original image
-        img = Image.open(self.image_path)
-        original_width, original_height = img.size
-        
-        # Extract metadata
-        metadata = self.extract_metadata()
-        
-        # Create Instagram Stories format (9:16 aspect ratio)
-        stories_ratio = 9 / 16
-        
-        # Determine the size of the Instagram Stories canvas
-        stories_width = 1080
-        stories_height = int(stories_width / stories_ratio)  # Should be 1920px
-        
-        # Create the white background canvas
-        canvas = Image.new('RGB', (stories_width, stories_height), color=(255, 255, 255))
-        
-        # Define padding and section heights
-        metadata_height = 180
-        bottom_padding = 180
-        available_height = stories_height - metadata_height - bottom_padding
-        
-        # Scale the original image to fit within the available area while preserving aspect ratio
-        img_ratio = original_width / original_height
-        
-        # Add horizontal padding of 5% on each side
-        horizontal_padding = int(stories_width * 0.05)
-        max_image_width = stories_width - 2 * horizontal_padding
-        
-        if img_ratio > 1:  # Landscape image
-            new_width = max_image_width
-            new_height = int(new_width / img_ratio)
-            if new_height > available_height:
-                new_height = available_height
-                new_width = int(new_height * img_ratio)
-        else:  # Portrait image
-            new_height = available_height
-            new_width = int(new_height * img_ratio)
-            if new_width > max_image_width:
-                new_width = max_image_width
-                new_height = int(new_width / img_ratio)
-        
-        # Resize the image
-        img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-        
-        # Calculate position to center the image
-        x_position = (stories_width - new_width) // 2
-        y_position = metadata_height + (available_height - new_height) // 2
-        
-        # Add shadow if requested
-        if self.shadow_var.get():
-            # Create a slightly larger black image for the shadow
-            shadow_offset = 15
-            shadow_blur = 8
-            shadow = Image.new('RGBA', (new_width + shadow_blur*10, new_height + shadow_blur*10), (0, 0, 0, 0))
-            
-            # Create a mask for the shadow
-            shadow_mask = Image.new('L', (new_width, new_height), 0)
-            shadow_mask_draw = ImageDraw.Draw(shadow_mask)
-            shadow_mask_draw.rectangle([(0, 0), (new_width, new_height)], fill=256)
-            
-            # Apply the mask to create shadow
-            shadow.paste((0, 0, 0, 128), (shadow_blur, shadow_blur, shadow_blur + new_width, shadow_blur + new_height), shadow_mask)
-            
-            # Blur the shadow
-            shadow = shadow.filter(ImageFilter.GaussianBlur(shadow_blur))
-            
-            # Paste the shadow onto the canvas
-            shadow_x = x_position - shadow_blur + shadow_offset
-            shadow_y = y_position - shadow_blur + shadow_offset
-            canvas.paste(shadow, (shadow_x, shadow_y), shadow)
-        
-        # Paste the resized image onto the white canvas
-        canvas.paste(img_resized, (x_position, y_position))
-        
-        draw = ImageDraw.Draw(canvas)
-        
-        # Make the color palette thicker and add horizontal padding
-        palette_height = 80  # Thicker palette
-        palette_padding = horizontal_padding  # Use same padding as image
-        
-        # Calculate available width for palette after padding
-        palette_total_width = stories_width - (2 * palette_padding)
-        palette_box_width = palette_total_width / len(colors_to_use) if colors_to_use else 0
-        
-        # Position palette in the middle between image bottom and canvas bottom
-        image_bottom = y_position + new_height
-        palette_y = image_bottom + ((stories_height - image_bottom) // 2) - (palette_height // 2)
-        
-        # Draw color boxes with padding
-        for i, color in enumerate(colors_to_use):
-            left = palette_padding + (i * palette_box_width)
-            right = palette_padding + ((i + 1) * palette_box_width)
-            draw.rectangle([left, palette_y, right, palette_y + palette_height], fill=color)
-        
-        # Get the selected font
-        font = self.get_font()
-        
-        # Position metadata in the middle between top border and image top
-        metadata_center_y = y_position // 2 - 30  # Center minus offset for text height
-        
-        # Draw the camera and lens information (left side)
-        draw.text((20, metadata_center_y), metadata['camera_info'], fill=(0, 0, 0), font=font)
-        draw.text((20, metadata_center_y + 40), metadata['lens_info'], fill=(0, 0, 0), font=font)
-        
-        # Draw the technical specs (right side)
-        tech_info = f"{metadata['aperture']} {metadata['shutter']} {metadata['iso']}".strip()
-        draw.text((stories_width - 300, metadata_center_y), tech_info, fill=(0, 0, 0), font=font)
-        
-        # Draw the date and time on the same line (right side, below technical specs)
-        date_time_info = f"{metadata['date']} {metadata['time']}"
-        draw.text((stories_width - 300, metadata_center_y + 40), date_time_info, fill=(0, 0, 0), font=font)
-        
-        return canvas
+        self.preview_window.preview_image = preview_tk_image
+    
+    def close_preview(self):
+        self.cancel_preview()
+        self.preview_window.destroy()
+        self.preview_window = None
+        self.preview_canvas = None
     
     def save_image(self):
-        """Save the image with metadata and palette"""
+        """Save the image with metadata and palette in every format of the export preset"""
         if not self.image_path:
             messagebox.showwarning("Warning", "Please open an image first.")
             return
         
+        if self.save_job and self.save_job.running:
+            messagebox.showinfo("Please wait", "The previous export is still being written.")
+            return
+        
         # Open save file dialog
         output_path = filedialog.asksaveasfilename(
             defaultextension=".jpg",
-            filetypes=[("JPEG files", "*.jpg"), ("PNG files", "*.png"), ("All files", "*.*")],
+            filetypes=[("JPEG files", "*.jpg"), ("PNG files", "*.png"), ("WebP files", "*.webp"), ("All files", "*.*")],
             initialfile=os.path.splitext(os.path.basename(self.image_path))[0] + "_with_metadata"
         )
         
         if not output_path:
             return
         
+        # Extract colors if they haven't been extracted yet
+        self.ensure_palette(lambda: self.start_save(output_path))
+    
+    def start_save(self, output_path):
+        """Compose and write the current colors and options on a worker thread"""
         try:
-            # Extract colors if they haven't been extracted yet
-            if not self.palette_colors:
-                self.extract_colors()
-            
-            # Create the image - use selected colors if available, otherwise use all palette colors
-            colors_to_use = self.selected_colors if self.selected_colors else self.palette_colors
-            result_image = self.create_image_with_metadata_and_palette(colors_to_use)
-            
-            # Save with high quality
-            result_image.save(output_path, quality=95, subsampling=0)
-            
-            messagebox.showinfo("Success", f"Image saved to {output_path}")
+            spec = self.current_spec()
         except Exception as e:
             messagebox.showerror("Error", f"Could not save image: {str(e)}")
             import traceback
             traceback.print_exc()
+            return
+        
+        preset = self.export_preset_var.get()
+        asset = self.asset
+        composer = self.composer
+        
+        def work(job):
+            # Compose, then encode all formats of the preset in parallel, off the Tk main thread
+            with span("save_image", preset=preset):
+                result_image = render_spec(spec, asset=asset, composer=composer)
+                job.post(self.update_progress, "Encoding...")
+                return export_canvas(result_image, output_path, EXPORT_PRESETS[preset])
+        
+        self.save_job = BackgroundJob(self.root, work, on_done=self.on_image_saved,
+                                      on_error=self.on_image_save_failed).start()
+        self.update_progress("Composing...")
+    
+    def on_image_saved(self, results):
+        """Report the written files (runs on the Tk main thread)"""
+        self.update_progress()
+        written = "\n".join(f"{result.path} ({result.bytes / 1024:.0f} KB)" for result in results)
+        messagebox.showinfo("Success", f"Image saved to\n{written}")
+    
+    def on_image_save_failed(self, error):
+        self.update_progress()
+        messagebox.showerror("Error", f"Could not save image: {str(error)}")
+
+    def show_timing_panel(self):
+        """Open a window listing the most recent stage timings; recording runs while it is open"""
+        if self.timing_window is not None:
+            self.timing_window.lift()
+            return
+
+        # Start recording if it was not already switched on through the environment
+        self.timing_panel_started_recording = not recorder.enabled
+        recorder.enable()
+
+        self.timing_window = tk.Toplevel(self.root)
+        self.timing_window.title("Timings")
+        self.timing_window.geometry("540x520")
+        self.timing_window.protocol("WM_DELETE_WINDOW", self.close_timing_panel)
+
+        buttons = tk.Frame(self.timing_window)
+        buttons.pack(fill=tk.X, padx=5, pady=5)
+        tk.Button(buttons, text="Export...", command=self.export_timings).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Clear", command=recorder.clear).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(buttons, text="Peak Memory", variable=self.track_memory_var,
+                       command=lambda: setattr(recorder, 'track_memory', self.track_memory_var.get())
+                       ).pack(side=tk.LEFT, padx=5)
+
+        self.timing_tree = ttk.Treeview(self.timing_window, columns=("ms", "peak", "thread"), show="tree headings")
+        self.timing_tree.heading("#0", text="Stage")
+        self.timing_tree.heading("ms", text="ms")
+        self.timing_tree.heading("peak", text="Peak MB")
+        self.timing_tree.heading("thread", text="Thread")
+        self.timing_tree.column("#0", width=220)
+        self.timing_tree.column("ms", width=80, anchor=tk.E)
+        self.timing_tree.column("peak", width=80, anchor=tk.E)
+        self.timing_tree.column("thread", width=120)
+        self.timing_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        self.timing_panel_last_span = None
+        self.refresh_timing_panel()
+
+    def close_timing_panel(self):
+        if self.timing_panel_started_recording:
+            recorder.disable()
+        self.timing_window.destroy()
+        self.timing_window = None
+        self.timing_tree = None
+
+    def refresh_timing_panel(self):
+        """Redraw the timings list when new spans arrived, then check again shortly"""
+        if self.timing_window is None:
+            return
+
+        spans = recorder.recent(self.timing_panel_rows)
+        last_span = spans[-1] if spans else None
+        if last_span is not self.timing_panel_last_span:
+            self.timing_panel_last_span = last_span
+            self.timing_tree.delete(*self.timing_tree.get_children())
+            for s in reversed(spans):
+                # Indent stages by how many listed spans on the same thread enclose them
+                depth = sum(1 for other in spans if other is not s and other.thread == s.thread and other.pid == s.pid
+                            and other.start_ns <= s.start_ns
+                            and s.start_ns + s.duration_ns <= other.start_ns + other.duration_ns)
+                details = " ".join(f"{key}={value}" for key, value in s.args.items()
+                                   if key not in ('peak_rss_mb', 'peak_growth_mb'))
+                label = "    " * depth + s.name + (f" ({details})" if details else "")
+                peak = s.args.get('peak_rss_mb', "")
+                self.timing_tree.insert("", tk.END, text=label, values=(f"{s.duration_ns / 1e6:.1f}", peak, s.thread))
+
+        self.timing_window.after(500, self.refresh_timing_panel)
+
+    def export_timings(self):
+        """Save the recorded spans as a Chrome trace (.json) or as JSON lines (.jsonl)"""
+        output_path = filedialog.asksaveasfilename(
+            parent=self.timing_window,
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json"), ("JSON lines", "*.jsonl")],
+            initialfile="colorstamp_trace"
+        )
+        if not output_path:
+            return
+
+        try:
+            if output_path.endswith(".jsonl"):
+                write_span_log(output_path)
+            else:
+                write_chrome_trace(output_path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not export timings: {str(e)}", parent=self.timing_window)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,305 @@
+"""Headless batch renderer: stamp palette and metadata onto whole folders of images.
+
+Usage:
+    python batch.py photos/ "shoot/**/*.jpg" -o stamped/ -j 8
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from stampcore.assets import ImageAsset
+from stampcore.cache import get_default_cache
+from stampcore.export import DEFAULT_PRESET, EXPORT_PRESETS, export_canvas
+from stampcore.fonts import FontIndex
+from stampcore.palette import DEFAULT_BACKEND, PALETTE_BACKENDS
+from stampcore.spec import make_spec, render_spec, resolve_colors
+from stampcore.timing import recorder, span, write_chrome_trace
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.gif')
+
+# Appended to the input's name for the composition (before any export target suffix)
+OUTPUT_SUFFIX = "_with_metadata"
+OUTPUT_STEM_ENDINGS = tuple({OUTPUT_SUFFIX + target.suffix for targets in EXPORT_PRESETS.values()
+                             for target in targets})
+
+
+def is_output_name(path):
+    """Whether a file name is one of the compositions this tool writes"""
+    return os.path.splitext(os.path.basename(path))[0].endswith(OUTPUT_STEM_ENDINGS)
+
+
+def is_within(path, directory):
+    """Whether path is directory itself or lies below it (both absolute)"""
+    return os.path.commonpath([path, directory]) == directory
+
+
+def collect_images(inputs, exclude_dir=None):
+    """Expand directories, glob patterns and plain paths into a sorted list of image files.
+
+    Compositions written by an earlier run, and anything below exclude_dir (the
+    output directory), are left out so they are never stamped again.
+    """
+    if exclude_dir:
+        exclude_dir = os.path.abspath(exclude_dir)
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            candidates = [os.path.join(entry, name) for name in os.listdir(entry)]
+        elif os.path.exists(entry):
+            candidates = [entry]
+        else:
+            candidates = glob.glob(entry, recursive=True)
+
+        for path in candidates:
+            path = os.path.abspath(path)
+            if not os.path.isfile(path) or not path.lower().endswith(IMAGE_EXTENSIONS) or is_output_name(path):
+                continue
+            if exclude_dir and is_within(path, exclude_dir):
+                continue
+            paths.append(path)
+
+    # Drop duplicates from overlapping inputs while keeping a stable order
+    return sorted(set(paths))
+
+
+def output_path_for(image_path, output_dir, extension=".jpg", source_root=None, qualify=False):
+    """Build the output path the GUI would suggest for an image.
+
+    With source_root, the image's folder below it is mirrored under output_dir, so
+    same-named files from different folders do not overwrite each other. qualify=True
+    adds the source extension to the name (a.jpg and a.png in one folder).
+    """
+    stem, source_extension = os.path.splitext(os.path.basename(image_path))
+    if qualify:
+        stem += "_" + source_extension.lstrip(".").lower()
+    if not output_dir:
+        directory = os.path.dirname(image_path)
+    elif source_root:
+        directory = os.path.normpath(os.path.join(output_dir, os.path.relpath(os.path.dirname(image_path), source_root)))
+    else:
+        directory = output_dir
+    return os.path.join(directory, stem + OUTPUT_SUFFIX + extension)
+
+
+def plan_outputs(image_paths, output_dir=None):
+    """Output path of every image, unique across the batch; {image path: output path}.
+
+    Under output_dir the folder structure below the inputs' common folder is kept.
+    """
+    source_root = os.path.commonpath([os.path.dirname(path) for path in image_paths]) if image_paths else None
+    # a.jpg and a.png in one folder would share an output name, so both get their extension added
+    stems = Counter(os.path.splitext(path)[0] for path in image_paths)
+    return {path: output_path_for(path, output_dir, source_root=source_root,
+                                  qualify=stems[os.path.splitext(path)[0]] > 1)
+            for path in image_paths}
+
+
+def init_worker(trace=False, trace_memory=False):
+    """Set up a pool worker: single-threaded libraries and, if requested, span recording"""
+    limit_worker_threads()
+    if trace or trace_memory:
+        recorder.enable(memory=trace_memory)
+
+
+def limit_worker_threads():
+    """Keep each worker single-threaded so the pool scales with processes, not threads"""
+    os.environ["OMP_NUM_THREADS"] = "1"
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def render_file(spec, output_path, use_cache=True, preset=DEFAULT_PRESET, memory_budget=None):
+    """Render one RenderSpec and write it in every format of the preset; return a timing report.
+
+    memory_budget (bytes) renders in low-memory mode (see ImageAsset).
+    """
+    report = {'path': spec.source, 'output': output_path, 'outputs': [], 'error': None, 'timings': {}}
+    start = time.perf_counter()
+    try:
+        with span("render_file", path=os.path.basename(spec.source)):
+            asset = ImageAsset(spec.source, cache=get_default_cache() if use_cache else None,
+                               memory_budget=memory_budget)
+
+            t = time.perf_counter()
+            spec = resolve_colors(spec, asset)
+            report['timings']['palette'] = time.perf_counter() - t
+
+            # Read the EXIF ahead of composing so its cost is reported on its own
+            t = time.perf_counter()
+            asset.metadata
+            report['timings']['metadata'] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            canvas = render_spec(spec, asset=asset)
+            report['timings']['compose'] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            results = export_canvas(canvas, output_path, EXPORT_PRESETS[preset])
+            report['outputs'] = [result.path for result in results]
+            report['timings']['save'] = time.perf_counter() - t
+    except Exception as e:
+        report['error'] = f"{type(e).__name__}: {e}"
+    report['seconds'] = time.perf_counter() - start
+    if recorder.enabled:
+        # Ship this file's spans back to the parent process with the report
+        report['spans'] = recorder.drain()
+    return report
+
+
+def run_batch(image_paths, output_dir=None, workers=None, font_path=None, font_size=24,
+              shadow=True, num_colors=10, backend=DEFAULT_BACKEND, use_cache=True, on_result=None, trace=False,
+              preset=DEFAULT_PRESET, memory_budget=None, trace_memory=False):
+    """Render every image across a process pool; return the per-file reports in input order.
+
+    Each worker receives a pickled RenderSpec. With trace=True every report carries the
+    timing spans its worker recorded; trace_memory=True records them with their peak RSS.
+    If a worker process dies, its unfinished files are retried one at a time on new
+    pools; a file that kills its worker again is reported as failed.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    reports = {}
+    output_paths = plan_outputs(image_paths, output_dir)
+
+    def render_pool(paths, workers):
+        # Render paths on a new pool; return {path: error} of the renders a dying worker cut short
+        broken = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(trace, trace_memory)) as pool:
+            futures = {}
+            for path in paths:
+                spec = make_spec(path, font_path=font_path, font_size=font_size, shadow=shadow,
+                                 num_colors=num_colors, backend=backend)
+                future = pool.submit(render_file, spec, output_paths[path], use_cache, preset, memory_budget)
+                futures[future] = path
+            for future in as_completed(futures):
+                try:
+                    report = future.result()
+                except BrokenProcessPool as e:
+                    broken[futures[future]] = e
+                    continue
+                reports[futures[future]] = report
+                if on_result:
+                    on_result(report)
+        return broken
+
+    broken = render_pool(image_paths, workers)
+    if broken:
+        # A worker died (crash or OOM kill) and took every unfinished render with it. Retry
+        # those one at a time, so only the file that kills its own worker fails
+        print(f"A worker process died; retrying {len(broken)} images one at a time", file=sys.stderr)
+        for path in image_paths:
+            if path in broken:
+                error = render_pool([path], 1).get(path)
+                if error:
+                    reports[path] = crash_report(path, output_paths[path], error)
+                    if on_result:
+                        on_result(reports[path])
+
+    return [reports[path] for path in image_paths]
+
+
+def print_peak_memory(spans):
+    """Print the highest peak RSS, and peak growth over the stage's start, seen for every stage"""
+    peaks = {}
+    for s in spans:
+        if 'peak_rss_mb' in s.args:
+            peak, growth = peaks.get(s.name, (0, 0))
+            peaks[s.name] = (max(peak, s.args['peak_rss_mb']), max(growth, s.args['peak_growth_mb']))
+    print(f"{'stage':<20} {'peak MB':>9} {'growth MB':>10}")
+    for name, (peak, growth) in sorted(peaks.items(), key=lambda item: -item[1][0]):
+        print(f"{name:<20} {peak:>9.1f} {growth:>10.1f}")
+
+
+def crash_report(path, output_path, error):
+    """The report of a file whose worker process died before it could report"""
+    return {'path': path, 'output': output_path, 'outputs': [], 'error': f"{type(error).__name__}: {error}",
+            'timings': {}, 'seconds': 0.0}
+
+
+def print_report(report):
+    """Print one line per rendered file"""
+    name = os.path.basename(report['path'])
+    if report['error']:
+        print(f"FAIL {name} ({report['seconds']:.2f}s): {report['error']}")
+    else:
+        stages = " ".join(f"{stage}={seconds:.2f}s" for stage, seconds in report['timings'].items())
+        print(f"ok   {name} ({report['seconds']:.2f}s) {stages}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render palette and metadata compositions without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="Image files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="Directory for the compositions (default: next to each input)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--font", help="Path, file name or family of a TrueType/OpenType font (default: Pillow's built-in font)")
+    parser.add_argument("--font-size", type=int, default=24, help="Font size for the metadata text")
+    parser.add_argument("--no-shadow", action="store_true", help="Disable the drop shadow")
+    parser.add_argument("--colors", type=int, default=10, help="Number of palette colors to extract")
+    parser.add_argument("--backend", choices=sorted(PALETTE_BACKENDS), default=DEFAULT_BACKEND,
+                        help="Palette extraction backend (see stampcore/palette.py for the speed/quality trade-offs)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and do not update the palette/metadata cache")
+    parser.add_argument("--preset", choices=list(EXPORT_PRESETS), default=DEFAULT_PRESET,
+                        help="Export preset: formats and encoder settings written per image (see stampcore/export.py)")
+    parser.add_argument("--trace", metavar="FILE", help="Write per-stage timing spans of every worker as a Chrome trace")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Low-memory mode: hold at most this many MB of decoded pixels per image "
+                             "(uncompressed TIFFs are streamed, other sources that do not fit fail)")
+    parser.add_argument("--trace-memory", action="store_true", help="Report the peak resident memory of every stage")
+    args = parser.parse_args(argv)
+
+    image_paths = collect_images(args.inputs, exclude_dir=args.output_dir)
+    if not image_paths:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    # Resolve font names through the font index so workers only receive a path
+    font_path = args.font
+    if font_path and not os.path.isfile(font_path):
+        font_index = FontIndex()
+        font_index.refresh()
+        font_path = font_index.lookup(font_path)
+        if not font_path:
+            print(f"Font not found: {args.font}", file=sys.stderr)
+            return 1
+
+    print(f"Rendering {len(image_paths)} images with {args.workers} workers")
+    start = time.perf_counter()
+    reports = run_batch(
+        image_paths, output_dir=args.output_dir, workers=args.workers, font_path=font_path,
+        font_size=args.font_size, shadow=not args.no_shadow, num_colors=args.colors, backend=args.backend,
+        use_cache=not args.no_cache,
+        on_result=print_report,
+        trace=bool(args.trace),
+        preset=args.preset,
+        memory_budget=args.memory_budget * 2**20 if args.memory_budget else None,
+        trace_memory=args.trace_memory,
+    )
+    elapsed = time.perf_counter() - start
+
+    spans = [s for report in reports for s in report.get('spans', [])]
+    if args.trace:
+        write_chrome_trace(args.trace, spans)
+        print(f"Wrote timing trace to {args.trace}")
+    if args.trace_memory:
+        print_peak_memory(spans)
+
+    failures = [report for report in reports if report['error']]
+    print(f"Rendered {len(reports) - len(failures)}/{len(reports)} images in {elapsed:.2f}s "
+          f"({len(reports) / elapsed:.2f} images/s)")
+    for report in failures:
+        print(f"  failed: {report['path']}: {report['error']}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Per-frame display latency: the old temp-file PNG round trip vs. the in-memory PPM path.
+
+Usage:
+    python benchmarks/display_latency.py [image] [--frames N]
+
+Without an image a random 800x600 frame is used. When a display is available the
+timings include building the tk.PhotoImage, otherwise only the conversion is timed.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from ColorStamp import MetadataPaletteGenerator  # noqa: E402
+
+
+def legacy_pil_to_data(image):
+    """The previous implementation: write a PNG to the working directory and read it back"""
+    temp_file = "temp_image.png"
+    image.save(temp_file)
+    with open(temp_file, "rb") as file:
+        data = file.read()
+    os.remove(temp_file)
+    return data
+
+
+def ppm_pil_to_data(image):
+    return MetadataPaletteGenerator.pil_to_data(None, image)
+
+
+def time_frames(convert, image, frames, make_photo=None):
+    timings = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        data = convert(image)
+        if make_photo:
+            make_photo(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?", help="Image to display (default: random 800x600 frame)")
+    parser.add_argument("--frames", type=int, default=50, help="Number of frames to time per method")
+    args = parser.parse_args(argv)
+
+    if args.image:
+        image = Image.open(args.image).convert('RGB')
+        image.thumbnail((800, 600), Image.LANCZOS)
+    else:
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8))
+
+    # Time PhotoImage construction as well when Tk can open a display
+    make_png_photo = make_ppm_photo = None
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        make_png_photo = lambda data: tk.PhotoImage(data=data)  # noqa: E731
+        make_ppm_photo = lambda data: tk.PhotoImage(data=data, format="PPM")  # noqa: E731
+    except Exception as e:
+        print(f"No Tk display available ({e}); timing the conversion only")
+
+    print(f"Frame size {image.width}x{image.height}, {args.frames} frames")
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            results = {
+                "png temp file": time_frames(legacy_pil_to_data, image, args.frames, make_png_photo),
+                "in-memory ppm": time_frames(ppm_pil_to_data, image, args.frames, make_ppm_photo),
+            }
+        finally:
+            os.chdir(cwd)
+
+    for name, timings in results.items():
+        print(f"{name:>14}: median {statistics.median(timings):7.2f} ms  "
+              f"min {min(timings):7.2f} ms  max {max(timings):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Cold-start import cost of the core package and the entry points.
+
+Usage:
+    python benchmarks/import_time.py [-o results.json] [--repeat 7] [--compare previous.json]
+                                     [--detail stampcore.render]
+
+Every module is imported in a fresh interpreter, --repeat times, and the median
+import time and whole-process wall time are reported. The run fails (exit 1) if a
+module pulls in a library it must not load at import time: tkinter and the heavy
+optional dependencies for the core package and the headless entry points, the heavy
+dependencies for the GUI. --compare additionally fails on imports that got slower
+than --tolerance against an earlier result file. --detail prints the slowest
+imports below one module (from python -X importtime).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+HEAVY_MODULES = ('sklearn', 'scipy', 'cv2', 'exifread', 'matplotlib')
+HEADLESS_FORBIDDEN = ('tkinter',) + HEAVY_MODULES
+
+# Module -> top-level packages that must not be loaded by importing it
+TARGETS = {
+    'stampcore': HEADLESS_FORBIDDEN,
+    'stampcore.layout': HEADLESS_FORBIDDEN + ('numpy', 'PIL'),
+    'stampcore.metadata': HEADLESS_FORBIDDEN + ('numpy', 'PIL'),
+    'stampcore.palette': HEADLESS_FORBIDDEN,
+    'stampcore.render': HEADLESS_FORBIDDEN,
+    'stampcore.assets': HEADLESS_FORBIDDEN,
+    'stampcore.export': HEADLESS_FORBIDDEN,
+    'stampcore.spec': HEADLESS_FORBIDDEN,
+    'batch': HEADLESS_FORBIDDEN,
+    'server': HEADLESS_FORBIDDEN,
+    'watch': HEADLESS_FORBIDDEN,
+    'metadata_index': HEADLESS_FORBIDDEN,
+    'ColorStamp': HEAVY_MODULES,
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+loaded = sorted({{name.split('.')[0] for name in sys.modules}})
+print(json.dumps({{'seconds': seconds, 'loaded': loaded, 'modules': len(sys.modules)}}))
+"""
+
+
+def probe(module):
+    """Import module in a fresh interpreter; return (import seconds, process seconds, loaded packages, module count)"""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    wall = time.perf_counter() - start
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], wall, result['loaded'], result['modules']
+
+
+def measure(module, forbidden, repeat):
+    runs = [probe(module) for _ in range(repeat)]
+    loaded = runs[-1][2]
+    return {
+        'module': module,
+        'import_s': statistics.median(run[0] for run in runs),
+        'process_s': statistics.median(run[1] for run in runs),
+        'modules': runs[-1][3],
+        'forbidden_loaded': [name for name in forbidden if name in loaded],
+    }
+
+
+def print_detail(module, count=15):
+    """The slowest imports (cumulative) below module, from python -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.replace("import time:", "").split("|")
+        rows.append((int(cumulative_us), int(self_us), name))
+    print(f"\nSlowest imports below {module} (cumulative ms, self ms):")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:count]:
+        print(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name.strip()}")
+
+
+def compare(results, previous, tolerance):
+    """Print the change of every import against a previous run; return the regressions"""
+    before = {result['module']: result for result in previous['results']}
+    regressions = []
+    for result in results:
+        old = before.get(result['module'])
+        if not old or not old['import_s']:
+            continue
+        ratio = result['import_s'] / old['import_s']
+        # Ignore changes of a few milliseconds, where process start-up noise dominates
+        slower = ratio > tolerance and result['import_s'] - old['import_s'] > 0.005
+        if slower:
+            regressions.append(result)
+        print(f"{'SLOWER' if slower else '      '} {result['module']:<20} "
+              f"{old['import_s'] * 1000:8.1f} ms -> {result['import_s'] * 1000:8.1f} ms ({ratio:5.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--modules", default=",".join(TARGETS), help="Comma-separated modules to measure")
+    parser.add_argument("--repeat", type=int, default=7, help="Fresh interpreters per module; the median is reported")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--detail", metavar="MODULE", help="List the slowest imports below this module")
+    args = parser.parse_args(argv)
+
+    modules = [module for module in args.modules.split(",") if module]
+    unknown = [module for module in modules if module not in TARGETS]
+    if unknown:
+        parser.error(f"unknown module: {', '.join(unknown)}")
+
+    # Python start-up alone, to read the numbers against
+    baseline = statistics.median(probe("os")[1] for _ in range(args.repeat))
+    print(f"Interpreter start-up: {baseline * 1000:.1f} ms")
+    print(f"{'module':<20} {'import ms':>10} {'process ms':>11} {'modules':>8}  forbidden loaded")
+    results = []
+    for module in modules:
+        result = measure(module, TARGETS[module], args.repeat)
+        results.append(result)
+        print(f"{module:<20} {result['import_s'] * 1000:10.1f} {result['process_s'] * 1000:11.1f} "
+              f"{result['modules']:>8}  {', '.join(result['forbidden_loaded']) or '-'}")
+
+    if args.detail:
+        print_detail(args.detail)
+
+    if args.output:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True).stdout.strip()
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'meta': {'commit': commit, 'python': sys.version.split()[0], 'startup_s': baseline},
+                       'results': results}, f, indent=2)
+
+    failed = False
+    leaks = [result for result in results if result['forbidden_loaded']]
+    for result in leaks:
+        print(f"FAIL: importing {result['module']} loads {', '.join(result['forbidden_loaded'])}")
+        failed = True
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {previous['meta'].get('commit', '?')}):")
+        regressions = compare(results, previous, args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} imports slower than {args.tolerance:.2f}x")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
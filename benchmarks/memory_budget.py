@@ -0,0 +1,165 @@
+"""Peak resident memory of every stage, in normal and low-memory mode.
+
+Usage:
+    python benchmarks/memory_budget.py [--image huge.tif] [--megapixels 200] [--budget 256]
+                                       [--backend mediancut] [--modes normal,low] [-o results.json]
+
+Without --image a 16-bit uncompressed TIFF of --megapixels is written strip by strip
+(never held in memory) to a temporary directory. Each mode renders the image once in
+a fresh interpreter with span memory tracking on (see stampcore/timing.py), and the
+peak RSS of every stage is reported as growth over the interpreter's RSS after its
+imports. The run fails (exit 1) if the low-memory peak grows by more than --budget MB.
+"""
+import argparse
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# Rows per strip of the generated TIFF
+STRIP_ROWS = 64
+
+PROBE = """
+import json, os, sys, tempfile
+from stampcore.assets import ImageAsset
+from stampcore.export import EXPORT_PRESETS, export_canvas
+from stampcore.spec import make_spec, render_spec, resolve_colors
+from stampcore.timing import read_memory, recorder, span
+
+baseline = read_memory()[0]
+recorder.enable(memory=True)
+asset = ImageAsset({path!r}, memory_budget={budget!r})
+spec = make_spec({path!r}, backend={backend!r})
+with span("palette"):
+    spec = resolve_colors(spec, asset)
+with span("metadata"):
+    asset.metadata
+with span("compose"):
+    canvas = render_spec(spec, asset=asset)
+with tempfile.TemporaryDirectory() as directory, span("export"):
+    export_canvas(canvas, os.path.join(directory, "out.jpg"), EXPORT_PRESETS['single'])
+
+stages = {{}}
+for s in recorder.recent():
+    stages[s.name] = max(stages.get(s.name, 0), s.args['peak_rss_mb'])
+# Every span restarts the process peak, so the run's peak is the highest stage peak
+print(json.dumps({{'baseline_mb': baseline / 2**20, 'stages': stages, 'peak_mb': max(stages.values())}}))
+"""
+
+
+def write_strip_tiff(path, width, height, seed=0):
+    """Write a 16-bit RGB uncompressed TIFF band by band, with gradients and noise"""
+    rng = np.random.default_rng(seed)
+    strips = -(-height // STRIP_ROWS)
+    row_bytes = width * 6
+    data_offset = 8
+    if data_offset + height * row_bytes >= 2**32:
+        raise ValueError("test image too large for a classic (non-Big) TIFF")
+    offsets = [data_offset + i * STRIP_ROWS * row_bytes for i in range(strips)]
+    counts = [min(STRIP_ROWS, height - i * STRIP_ROWS) * row_bytes for i in range(strips)]
+    # Bits per sample, strip offsets and strip byte counts follow the pixel data, then the IFD
+    extra_offset = data_offset + height * row_bytes
+    offsets_offset = extra_offset + 6
+    counts_offset = offsets_offset + 4 * strips
+    ifd_offset = counts_offset + 4 * strips
+    extra = struct.pack('<3H', 16, 16, 16) + struct.pack(f'<{strips}I', *offsets) + struct.pack(f'<{strips}I', *counts)
+
+    tags = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 3, extra_offset), (259, 3, 1, 1),
+            (262, 3, 1, 2), (273, 4, strips, offsets_offset), (277, 3, 1, 3), (278, 4, 1, STRIP_ROWS),
+            (279, 4, strips, counts_offset), (284, 3, 1, 1)]
+    ifd = struct.pack('<H', len(tags))
+    for tag, kind, count, value in tags:
+        if kind == 3 and count == 1:
+            ifd += struct.pack('<HHIHH', tag, kind, count, value, 0)
+        else:
+            ifd += struct.pack('<HHII', tag, kind, count, value)
+    ifd += struct.pack('<I', 0)
+
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', ifd_offset))
+        for top in range(0, height, STRIP_ROWS):
+            rows = min(STRIP_ROWS, height - top)
+            y = (top + np.arange(rows, dtype=np.float32))[:, None] / height
+            band = np.empty((rows, width, 3), dtype=np.float32)
+            band[..., 0] = 0.2 + 0.6 * x
+            band[..., 1] = 0.3 + 0.5 * y * (1 - x)
+            band[..., 2] = 0.7 - 0.5 * y
+            band += rng.normal(0, 0.02, band.shape).astype(np.float32)
+            f.write((np.clip(band, 0, 1) * 65535).astype('<u2').tobytes())
+        f.write(extra)
+        f.write(ifd)
+
+
+def run_mode(path, budget, backend):
+    """Render once in a fresh interpreter; return its memory report"""
+    output = subprocess.run([sys.executable, "-c", PROBE.format(path=path, budget=budget, backend=backend)],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    if output.returncode:
+        return {'error': output.stderr.strip().splitlines()[-1]}
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Image to render (default: a generated 16-bit TIFF)")
+    parser.add_argument("--megapixels", type=float, default=200, help="Size of the generated TIFF (2:1 panorama)")
+    parser.add_argument("--budget", type=int, default=256, help="Memory budget of the low-memory mode in MB")
+    parser.add_argument("--backend", default="mediancut", help="Palette backend used for both modes")
+    parser.add_argument("--modes", default="normal,low", help="Comma-separated modes to run: normal, low")
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.image
+        if not path:
+            height = int((args.megapixels * 1e6 / 2) ** 0.5)
+            path = os.path.join(directory, "panorama16.tif")
+            print(f"Writing a {2 * height}x{height} 16-bit TIFF ...")
+            write_strip_tiff(path, 2 * height, height)
+
+        results = {}
+        for mode in args.modes.split(","):
+            budget = args.budget * 2**20 if mode == "low" else None
+            results[mode] = run_mode(os.path.abspath(path), budget, args.backend)
+
+    modes = [mode for mode in results if 'error' not in results[mode]]
+    for mode, result in results.items():
+        if 'error' in result:
+            print(f"{mode}: failed: {result['error']}")
+    if modes:
+        stages = list(dict.fromkeys(name for mode in modes for name in results[mode]['stages']))
+        print(f"Peak RSS growth over the post-import baseline, MB ({os.path.basename(path)}):")
+        print(f"{'stage':<20}" + "".join(f"{mode:>10}" for mode in modes))
+        for name in stages:
+            row = ""
+            for mode in modes:
+                peak = results[mode]['stages'].get(name)
+                row += f"{peak - results[mode]['baseline_mb']:>10.1f}" if peak is not None else f"{'-':>10}"
+            print(f"{name:<20}{row}")
+        print(f"{'whole run':<20}" + "".join(f"{results[m]['peak_mb'] - results[m]['baseline_mb']:>10.1f}"
+                                             for m in modes))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'image': path, 'budget_mb': args.budget, 'results': results}, f, indent=2)
+
+    low = results.get("low")
+    if low is not None:
+        if 'error' in low:
+            return 1
+        growth = low['peak_mb'] - low['baseline_mb']
+        if growth > args.budget:
+            print(f"FAIL: low-memory peak grew by {growth:.0f} MB, more than the {args.budget} MB budget")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
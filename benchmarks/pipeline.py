@@ -0,0 +1,303 @@
+"""Reproducible per-stage timings of the whole pipeline on synthetic images.
+
+Usage:
+    python benchmarks/pipeline.py [-o results.json] [--sizes 2,12,24] [--formats jpeg,png,tiff16]
+                                  [--backends gmm,kmeans] [--repeat 3] [--compare previous.json]
+
+Test images are generated locally from a fixed seed (JPEG with EXIF, PNG and 16-bit
+uncompressed TIFF, at the given sizes in megapixels), so runs on different commits
+time the same inputs. Every stage starts from a fresh ImageAsset with no persistent
+cache, and each timing is the median of --repeat runs. --compare prints the change
+against an earlier result file and exits non-zero if a stage got slower than
+--tolerance.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, REPO_ROOT)
+
+from stampcore.assets import ImageAsset  # noqa: E402
+from stampcore.fonts import FontIndex, load_font  # noqa: E402
+from stampcore.metadata import extract_metadata  # noqa: E402
+from stampcore.palette import DEFAULT_SEED, PALETTE_BACKENDS, PaletteFitter, extract_palette  # noqa: E402
+from stampcore.render import LayeredComposer  # noqa: E402
+from stampcore.shadow import shadow_sprite  # noqa: E402
+
+FORMATS = ('jpeg', 'png', 'tiff16')
+DISPLAY_CANVAS = (800, 600)
+
+
+def synthetic_pixels(megapixels, seed=0):
+    """A 3:2 photo-like image: smooth color fields, a few saturated blobs and sensor noise"""
+    width = int(round((megapixels * 1e6 * 1.5) ** 0.5))
+    height = int(round(width / 1.5))
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    x /= width
+    y /= height
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[..., 0] = 0.25 + 0.5 * x
+    image[..., 1] = 0.2 + 0.6 * y * (1 - x)
+    image[..., 2] = 0.6 - 0.4 * y
+    for _ in range(8):
+        cx, cy, radius = rng.random(), rng.random(), 0.03 + 0.12 * rng.random()
+        blob = np.exp(-((x - cx) ** 2 + ((y - cy) / 1.5) ** 2) / (2 * radius ** 2))
+        image += blob[..., None] * (rng.random(3).astype(np.float32) - 0.3)
+    image += rng.normal(0, 0.015, image.shape).astype(np.float32)
+    return np.clip(image, 0, 1)
+
+
+def synthetic_exif():
+    exif = Image.Exif()
+    exif[0x010F] = "FUJIFILM"
+    exif[0x0110] = "X-E4"
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x829D] = IFDRational(56, 10)
+    exif_ifd[0x829A] = IFDRational(1, 250)
+    exif_ifd[0x8827] = 160
+    exif_ifd[0x9003] = "2024:08:19 15:45:19"
+    exif_ifd[0xA433] = "FUJIFILM"
+    exif_ifd[0xA434] = "XF27mmF2.8 R WR"
+    return exif
+
+
+def generate_images(directory, sizes, formats):
+    """Write (or reuse) the synthetic test images; return {name: (path, format, megapixels)}"""
+    images = {}
+    for megapixels in sizes:
+        pixels = None
+        for fmt in formats:
+            name = f"{megapixels:g}mp_{fmt}"
+            path = os.path.join(directory, name + {'jpeg': '.jpg', 'png': '.png', 'tiff16': '.tif'}[fmt])
+            if not os.path.exists(path):
+                if pixels is None:
+                    pixels = synthetic_pixels(megapixels)
+                if fmt == 'tiff16':
+                    rgb16 = np.round(pixels * 65535).astype(np.uint16)
+                    cv2.imwrite(path, rgb16[..., ::-1], [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+                else:
+                    image = Image.fromarray(np.round(pixels * 255).astype(np.uint8))
+                    if fmt == 'jpeg':
+                        image.save(path, quality=92, exif=synthetic_exif())
+                    else:
+                        image.save(path, exif=synthetic_exif())
+            images[name] = (path, fmt, megapixels)
+    return images
+
+
+def display_size(image_size, canvas_size=DISPLAY_CANVAS):
+    """The size the GUI shows an image at on its default canvas"""
+    ratio = min(canvas_size[0] / image_size[0], canvas_size[1] / image_size[1])
+    return int(image_size[0] * ratio), int(image_size[1] * ratio)
+
+
+def measure(run, repeat, setup=None):
+    """Run setup() (untimed) then run(state) repeat times; return the timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_image(path, backends, repeat, font):
+    """Per-stage timings for one image as a list of (stage, backend, timings)"""
+    results = []
+
+    def decoded_asset():
+        asset = ImageAsset(path)
+        asset.proxy(display_size(asset.size))
+        return asset
+
+    # Opening an image: header plus the display-sized decode the GUI shows
+    results.append(('decode', None, measure(lambda _: decoded_asset(), repeat)))
+    results.append(('decode_full', None, measure(lambda _: ImageAsset(path).image, repeat)))
+
+    # extract_colors: drawing the pixel sample, then each backend's fit on the same sample
+    def sample(asset):
+        if asset.streams_palette():
+            return asset.sampled_pixels(10000, DEFAULT_SEED)
+        return asset.palette_pixels()
+
+    results.append(('palette_sample', None, measure(sample, repeat, setup=lambda: ImageAsset(path))))
+    pixels = sample(ImageAsset(path))
+    for backend in backends:
+        results.append(('extract_colors', backend,
+                        measure(lambda _: extract_palette(pixels, backend=backend), repeat)))
+
+    # Changing the color count: 10 -> 12 -> 8 refitted from the 10-color fit of the same sample
+    for backend in backends:
+        def refit(fitter):
+            fitter.fit(12)
+            fitter.fit(8)
+
+        def fitted(backend=backend):
+            fitter = PaletteFitter(lambda: pixels, backend=backend)
+            fitter.fit(10)
+            return fitter
+
+        results.append(('refit_colors', backend, measure(refit, repeat, setup=fitted)))
+
+    results.append(('extract_metadata', None, measure(lambda _: extract_metadata(path), repeat)))
+
+    # compose: the first preview of a freshly opened image
+    metadata = extract_metadata(path)
+    colors = extract_palette(pixels, backend='histogram')
+    for shadow in (True, False):
+        def compose(asset, shadow=shadow):
+            LayeredComposer().compose(asset, metadata, colors, font, shadow=shadow)
+
+        def setup():
+            shadow_sprite.cache_clear()
+            return decoded_asset()
+
+        stage = 'compose_shadow' if shadow else 'compose_no_shadow'
+        results.append((stage, None, measure(compose, repeat, setup=setup)))
+
+    # save_image: encoding the finished composition
+    canvas = LayeredComposer().compose(decoded_asset(), metadata, colors, font, shadow=True)
+    results.append(('save_jpeg', None, measure(lambda _: canvas.save(io.BytesIO(), 'JPEG', quality=95, subsampling=0), repeat)))
+    results.append(('save_png', None, measure(lambda _: canvas.save(io.BytesIO(), 'PNG'), repeat)))
+    return results
+
+
+def benchmark_fonts(workdir, repeat):
+    """get_available_fonts: a first scan into an empty index, and loading the saved index"""
+    index_path = os.path.join(workdir, "fonts.json")
+
+    def cold(_):
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        index = FontIndex(path=index_path)
+        index.refresh()
+        return ["default"] + index.paths()
+
+    cold_timings = measure(cold, repeat)
+    warm_timings = measure(lambda _: ["default"] + FontIndex(path=index_path).paths(), repeat)
+    return [('get_available_fonts_scan', None, cold_timings), ('get_available_fonts', None, warm_timings)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['image'], result['stage'], result['backend']
+
+
+def compare(results, previous, tolerance):
+    """Print the change of every stage against a previous run; return the regressions"""
+    before = {result_key(result): result for result in previous['results']}
+    regressions = []
+    for result in results:
+        old = before.get(result_key(result))
+        if not old or not old['median_s']:
+            continue
+        ratio = result['median_s'] / old['median_s']
+        # Ignore sub-millisecond stages, where timer noise dominates
+        slower = ratio > tolerance and result['median_s'] - old['median_s'] > 0.001
+        if slower:
+            regressions.append(result)
+        label = f"{result['stage']}[{result['backend']}]" if result['backend'] else result['stage']
+        print(f"{'SLOWER' if slower else '      '} {result['image'] or '-':<14} {label:<28} "
+              f"{old['median_s'] * 1000:9.1f} ms -> {result['median_s'] * 1000:9.1f} ms ({ratio:5.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--sizes", default="2,12,24", help="Comma-separated image sizes in megapixels")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="Comma-separated subset of: " + ", ".join(FORMATS))
+    parser.add_argument("--backends", default=",".join(PALETTE_BACKENDS), help="Comma-separated palette backends")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the median is reported")
+    parser.add_argument("--font", help="Font file for the metadata text (default: Pillow's built-in font)")
+    parser.add_argument("--workdir", help="Keep the generated images here and reuse them across runs")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [float(size) for size in args.sizes.split(",")]
+    formats = [fmt for fmt in args.formats.split(",") if fmt]
+    backends = [backend for backend in args.backends.split(",") if backend]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS] + [b for b in backends if b not in PALETTE_BACKENDS]
+    if unknown:
+        parser.error(f"unknown format or backend: {', '.join(unknown)}")
+
+    font = load_font(args.font, 24)
+    # Backends import their libraries on first use; keep that one-off cost out of the fits
+    warmup = np.random.default_rng(DEFAULT_SEED).integers(0, 256, (1000, 3), dtype=np.uint8)
+    for backend in backends:
+        extract_palette(warmup, num_colors=4, sample_size=1000, backend=backend)
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        workdir = args.workdir or tempdir
+        os.makedirs(workdir, exist_ok=True)
+        print(f"Generating test images in {workdir}")
+        images = generate_images(workdir, sizes, formats)
+
+        for stage, backend, timings in benchmark_fonts(tempdir, args.repeat):
+            results.append({'image': None, 'format': None, 'megapixels': None, 'stage': stage, 'backend': backend,
+                            'median_s': statistics.median(timings), 'runs_s': timings})
+
+        for name, (path, fmt, megapixels) in images.items():
+            print(f"Benchmarking {name}")
+            for stage, backend, timings in benchmark_image(path, backends, args.repeat, font):
+                results.append({'image': name, 'format': fmt, 'megapixels': megapixels, 'stage': stage,
+                                'backend': backend, 'median_s': statistics.median(timings), 'runs_s': timings})
+
+    for result in results:
+        label = f"{result['stage']}[{result['backend']}]" if result['backend'] else result['stage']
+        print(f"{result['image'] or '-':<14} {label:<28} {result['median_s'] * 1000:9.1f} ms")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {previous['meta'].get('commit')}):")
+        if compare(results, previous, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
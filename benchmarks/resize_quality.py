@@ -0,0 +1,75 @@
+"""Check pyramid resizes against a direct full-resolution LANCZOS resize.
+
+Usage:
+    python benchmarks/resize_quality.py [image ...]
+
+Without arguments the bundled example photo is upscaled to 6144 px wide and saved as a
+PNG, so the check exercises the pyramid rather than JPEG draft decoding. Exits non-zero
+if any resize is outside the tolerance.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, REPO_ROOT)
+
+from stampcore.assets import ImageAsset  # noqa: E402
+
+# Target widths: composition (landscape), display canvas, portrait composition and a thumbnail
+TARGET_WIDTHS = [972, 800, 500, 240]
+MAX_MEAN_ERROR = 1.0
+MAX_P999_ERROR = 12
+
+
+def check(path):
+    full = Image.open(path).convert('RGB')
+    ok = True
+    for target_width in TARGET_WIDTHS:
+        size = (target_width, round(target_width * full.height / full.width))
+
+        start = time.perf_counter()
+        reference = full.resize(size, Image.LANCZOS)
+        reference_ms = (time.perf_counter() - start) * 1000
+
+        asset = ImageAsset(path)
+        asset.image  # decode up front so only the resize is timed
+        start = time.perf_counter()
+        result = asset.proxy(size)
+        pyramid_ms = (time.perf_counter() - start) * 1000
+
+        error = np.abs(np.asarray(reference, dtype=np.int16) - np.asarray(result, dtype=np.int16))
+        mean_error = error.mean()
+        p999_error = np.percentile(error, 99.9)
+        passed = mean_error <= MAX_MEAN_ERROR and p999_error <= MAX_P999_ERROR
+        ok &= passed
+        print(f"{'ok  ' if passed else 'FAIL'} {os.path.basename(path)} -> {size[0]}x{size[1]}: "
+              f"mean error {mean_error:.3f}, p99.9 {p999_error:.0f}, max {error.max()} | "
+              f"full LANCZOS {reference_ms:.1f} ms, pyramid {pyramid_ms:.1f} ms")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to check (default: upscaled example photo)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        images = args.images
+        if not images:
+            example = Image.open(os.path.join(REPO_ROOT, "images", "example.jpg")).convert('RGB')
+            path = os.path.join(workdir, "example_large.png")
+            example.resize((6144, round(6144 * example.height / example.width)), Image.LANCZOS).save(path)
+            images = [path]
+
+        results = [check(path) for path in images]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
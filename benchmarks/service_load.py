@@ -0,0 +1,173 @@
+"""Concurrent-request latency and throughput of the HTTP render service.
+
+Usage:
+    python benchmarks/service_load.py [--url http://127.0.0.1:8765] [--image photo.jpg]
+                                      [--endpoint render] [--concurrency 1,2,4,8,16]
+                                      [--requests 48] [-j 4] [--queue 16] [-o results.json]
+
+Without --url a server is started on a free local port with -j workers and --queue
+waiting slots. Each concurrency level runs that many closed-loop clients, each on its
+own keep-alive connection uploading the image and waiting for the reply before
+sending the next request. Reported per level: throughput of successful requests,
+latency percentiles, and how many requests were turned away with 503.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DEFAULT_IMAGE = os.path.join(REPO_ROOT, "images", "example.jpg")
+
+
+async def read_response(reader):
+    """Status and body of one HTTP response"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode('latin-1').split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = dict(line.split(":", 1) for line in lines[1:] if ":" in line)
+    headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+async def client(host, port, request, count, results):
+    """Send count requests back to back on one connection, recording (status, seconds)"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, headers, _ = await read_response(reader)
+            results.append((status, time.perf_counter() - start))
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def run_level(host, port, request, concurrency, total):
+    """Run total requests spread over concurrency clients; return a summary dict"""
+    results = []
+    counts = [total // concurrency + (i < total % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, request, count, results) for count in counts if count))
+    elapsed = time.perf_counter() - start
+
+    latencies = [seconds * 1000 for status, seconds in results if status == 200]
+    summary = {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'ok': len(latencies),
+        'rejected': sum(1 for status, _ in results if status == 503),
+        'errors': sum(1 for status, _ in results if status not in (200, 503)),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+    }
+    if latencies:
+        summary.update(p50_ms=percentile(latencies, 0.5), p95_ms=percentile(latencies, 0.95),
+                       p99_ms=percentile(latencies, 0.99), mean_ms=statistics.mean(latencies))
+    return summary
+
+
+def build_request(host, port, endpoint, image_bytes, query):
+    head = (f"POST /{endpoint}?{query} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            f"Content-Type: application/octet-stream\r\n"
+            f"Content-Length: {len(image_bytes)}\r\n\r\n")
+    return head.encode('latin-1') + image_bytes
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, queue_size):
+    """Start server.py on a free port and wait until it answers; return (process, port)"""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "server.py"), "--port", str(port),
+                                "-j", str(workers), "--queue", str(queue_size), "--no-cache"],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server.py exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("server.py did not start listening within 60 s")
+
+
+def print_results(results):
+    print(f"{'clients':>7} {'ok':>5} {'503':>5} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['concurrency']:>7} {r['ok']:>5} {r['rejected']:>5} {r['errors']:>4} {r['throughput']:>7.2f} "
+              f"{r.get('p50_ms', 0):>8.0f} {r.get('p95_ms', 0):>8.0f} {r.get('p99_ms', 0):>8.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Service to load (default: start server.py locally)")
+    parser.add_argument("--image", default=DEFAULT_IMAGE, help="Image uploaded with every request")
+    parser.add_argument("--endpoint", choices=("render", "analyze"), default="render")
+    parser.add_argument("--query", default="colors=10&backend=kmeans", help="Options sent with every request")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Comma-separated client counts")
+    parser.add_argument("--requests", type=int, default=48, help="Requests per concurrency level")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Workers of the started server")
+    parser.add_argument("--queue", type=int, default=16, help="Queue slots of the started server")
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        process, port = start_server(args.workers, args.queue)
+        host = "127.0.0.1"
+
+    try:
+        request = build_request(host, port, args.endpoint, image_bytes, args.query)
+        # Warm up the workers (imports, first fit) so the first level is not penalised
+        asyncio.run(run_level(host, port, request, args.workers if process else 1, args.workers if process else 1))
+        results = []
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            results.append(asyncio.run(run_level(host, port, request, concurrency, args.requests)))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    print(f"{args.endpoint} of {os.path.basename(args.image)} ({len(image_bytes) / 1e6:.1f} MB), "
+          f"{args.requests} requests per level" + (f", {args.workers} workers, queue {args.queue}" if process else ""))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'endpoint': args.endpoint, 'image': args.image, 'workers': args.workers if process else None,
+                       'queue': args.queue if process else None, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import queue
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's work function once the job has been cancelled"""
+
+
+class BackgroundJob:
+    """Run work on a worker thread and deliver its results on the Tk event loop.
+
+    Tk widgets may only be touched from the main thread, so the worker never calls back
+    directly: everything it posts goes through a queue that the main loop polls with
+    root.after. Once cancelled, nothing more is delivered, which lets a newer job
+    supersede a stale one even if the stale worker is still busy.
+    """
+
+    def __init__(self, root, work, on_done=None, on_error=None, poll_ms=30):
+        self.root = root
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.poll_ms = poll_ms
+        self._events = queue.Queue()
+        self._cancelled = threading.Event()
+        self._finished = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def running(self):
+        return not self._finished and not self.cancelled
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self.root.after(self.poll_ms, self._poll)
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        """Call between stages of the work function to stop early once cancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def post(self, callback, *args):
+        """Schedule callback(*args) on the Tk main thread (dropped if the job is cancelled)"""
+        self._events.put((callback, args))
+
+    def _run(self):
+        try:
+            result = self.work(self)
+        except JobCancelled:
+            return
+        except Exception as e:
+            self._events.put(('error', e))
+        else:
+            self._events.put(('done', result))
+
+    def _poll(self):
+        while not self._finished:
+            try:
+                callback, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if self.cancelled:
+                continue
+            if callback == 'done':
+                self._finished = True
+                if self.on_done:
+                    self.on_done(payload)
+            elif callback == 'error':
+                self._finished = True
+                if self.on_error:
+                    self.on_error(payload)
+            else:
+                callback(*payload)
+
+        # Keep polling until the job finishes or is cancelled and its worker has gone quiet
+        if not self._finished and not self.cancelled:
+            self.root.after(self.poll_ms, self._poll)
@@ -0,0 +1,227 @@
+"""Index the EXIF metadata of whole photo libraries into a queryable SQLite store.
+
+Usage:
+    python metadata_index.py index ~/Pictures
+    python metadata_index.py query --camera "X-E4" --lens 70-300 --iso-max 400 --since 2024-08-01
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from stampcore.cache import default_cache_dir
+from stampcore.metadata import camera_name, lens_name, read_exif
+
+# Formats the header reader or its exifread fallback can pull EXIF from
+INDEXED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.heic')
+
+# Stored for files whose EXIF cannot be read, so they are not read again until they change
+FAILED_ROW = (None,) * 6
+
+IndexedPhoto = namedtuple('IndexedPhoto', [
+    'path', 'camera', 'lens', 'f_number', 'exposure_time', 'iso', 'taken',
+])
+
+
+def walk_images(root):
+    """Yield (path, stat) for every indexable image below root"""
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            print(f"Skipping {directory}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif entry.name.lower().endswith(INDEXED_EXTENSIONS):
+                try:
+                    yield entry.path, entry.stat()
+                except OSError:
+                    pass
+
+
+def _taken_timestamp(date_taken):
+    """DateTimeOriginal in ISO format so dates sort and compare as text, or None"""
+    try:
+        return datetime.strptime(date_taken, "%Y:%m:%d %H:%M:%S").isoformat(sep=' ')
+    except (TypeError, ValueError):
+        return None
+
+
+def _row_for(path):
+    try:
+        record = read_exif(path)
+    except Exception as e:
+        print(f"Error extracting EXIF data from {path}: {e}")
+        return FAILED_ROW
+    return (
+        camera_name(record) or None,
+        lens_name(record) or None,
+        float(record.f_number) if record.f_number else None,
+        float(record.exposure_time) if record.exposure_time else None,
+        record.iso,
+        _taken_timestamp(record.date_taken),
+    )
+
+
+class MetadataIndex:
+    """Persistent camera, lens, exposure and date index of image files.
+
+    index() walks directory trees and only reads the EXIF header of files that are new
+    or whose mtime or size changed, writing the rows in a single transaction. A file whose
+    header cannot be read gets a row without fields, like a file without EXIF. Entries for
+    files that disappeared from an indexed tree are dropped. query() filters on any
+    combination of fields through indexed columns.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(default_cache_dir(), "metadata.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS photos ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, camera TEXT, lens TEXT, "
+            "f_number REAL, exposure_time REAL, iso INTEGER, taken TEXT)"
+        )
+        for column in ('camera', 'lens', 'iso', 'taken'):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS photos_{column} ON photos ({column})")
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def index(self, root, workers=4):
+        """Index every image below root; return (files seen, files read, files removed)"""
+        root = os.path.abspath(root)
+        prefix = root.rstrip(os.sep) + os.sep
+        with self._lock:
+            known = {
+                path: (mtime_ns, size) for path, mtime_ns, size in self._db.execute(
+                    "SELECT path, mtime_ns, size FROM photos WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                    (root, prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'),
+                )
+            }
+
+        seen = set()
+        stale = []
+        for path, stat in walk_images(root):
+            seen.add(path)
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                stale.append((path, stat))
+
+        # Header reads are mostly I/O waits, so a few threads keep a cold disk busy
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            rows = [
+                (path, stat.st_mtime_ns, stat.st_size) + row
+                for (path, stat), row in zip(stale, executor.map(_row_for, [path for path, _ in stale]))
+            ]
+
+        removed = [(path,) for path in known if path not in seen]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany("DELETE FROM photos WHERE path = ?", removed)
+        return len(seen), len(stale), len(removed)
+
+    def query(self, camera=None, lens=None, f_min=None, f_max=None, iso_min=None, iso_max=None,
+              since=None, until=None, limit=None):
+        """Indexed photos matching every given filter, oldest first.
+
+        camera and lens match case-insensitive substrings; since and until are ISO dates
+        or timestamps, with until inclusive of the whole day when only a date is given.
+        """
+        clauses = []
+        params = []
+        if camera:
+            clauses.append("camera LIKE ?")
+            params.append(f"%{camera}%")
+        if lens:
+            clauses.append("lens LIKE ?")
+            params.append(f"%{lens}%")
+        for column, operator, value in (('f_number', '>=', f_min), ('f_number', '<=', f_max),
+                                        ('iso', '>=', iso_min), ('iso', '<=', iso_max),
+                                        ('taken', '>=', since)):
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        if until is not None:
+            clauses.append("taken <= ?")
+            params.append(until if len(until) > 10 else f"{until} 23:59:59")
+
+        sql = "SELECT path, camera, lens, f_number, exposure_time, iso, taken FROM photos"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY taken, path"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [IndexedPhoto(*row) for row in self._db.execute(sql, params)]
+
+
+def format_exposure(seconds):
+    if not seconds:
+        return ""
+    return f"1/{round(1 / seconds)}s" if seconds < 1 else f"{seconds:.1f}s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index and query the EXIF metadata of photo folders.")
+    parser.add_argument("--db", help="Index database (default: metadata.sqlite3 in the ColorStamp cache directory)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="Add or refresh directory trees")
+    index_parser.add_argument("roots", nargs="+", help="Directories to index recursively")
+    index_parser.add_argument("-j", "--workers", type=int, default=4, help="Threads reading file headers")
+
+    query_parser = commands.add_parser("query", help="List indexed photos matching the filters")
+    query_parser.add_argument("--camera", help="Substring of the camera make and model")
+    query_parser.add_argument("--lens", help="Substring of the lens make and model")
+    query_parser.add_argument("--f-min", type=float, help="Smallest f-number")
+    query_parser.add_argument("--f-max", type=float, help="Largest f-number")
+    query_parser.add_argument("--iso-min", type=int, help="Lowest ISO")
+    query_parser.add_argument("--iso-max", type=int, help="Highest ISO")
+    query_parser.add_argument("--since", help="Earliest capture date (YYYY-MM-DD)")
+    query_parser.add_argument("--until", help="Latest capture date (YYYY-MM-DD)")
+    query_parser.add_argument("--limit", type=int, help="Maximum number of results")
+    args = parser.parse_args(argv)
+
+    index = MetadataIndex(args.db)
+    try:
+        if args.command == "index":
+            for root in args.roots:
+                if not os.path.isdir(root):
+                    print(f"Not a directory: {root}", file=sys.stderr)
+                    return 1
+                start = time.perf_counter()
+                seen, read, removed = index.index(root, workers=args.workers)
+                elapsed = time.perf_counter() - start
+                print(f"{root}: {seen} images, {read} read, {removed} removed in {elapsed:.2f}s "
+                      f"({seen / elapsed if elapsed else 0:.0f} files/s)")
+        else:
+            for photo in index.query(camera=args.camera, lens=args.lens, f_min=args.f_min, f_max=args.f_max,
+                                     iso_min=args.iso_min, iso_max=args.iso_max, since=args.since,
+                                     until=args.until, limit=args.limit):
+                aperture = f"f/{photo.f_number:.1f}" if photo.f_number else ""
+                iso = f"ISO{photo.iso}" if photo.iso is not None else ""
+                print("\t".join([photo.path, photo.camera or "", photo.lens or "", aperture,
+                                 format_exposure(photo.exposure_time), iso, photo.taken or ""]))
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
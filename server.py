@@ -0,0 +1,367 @@
+"""Local HTTP render service: palettes, metadata and compositions without the GUI.
+
+Usage:
+    python server.py [--host 127.0.0.1] [--port 8765] [-j 4] [--queue 16] [--root ~/Pictures]
+
+Endpoints:
+    GET  /health    queue and worker status
+    POST /analyze   palette and metadata of an image as JSON
+    POST /render    the composition as an image (JPEG by default)
+
+Send the image as the request body (Content-Type image/* or application/octet-stream)
+with options in the query string, or a JSON body {"path": "...", ...options} naming a
+file below one of the --root directories. Options:
+    colors=10          number of palette colors to extract
+    palette=#aabbcc,.. colors to stamp instead of the extracted palette (/render); JSON
+                       requests may also give a list of "#aabbcc" strings or [r, g, b] lists
+    backend=gmm        palette backend
+    font=NAME          installed font file name, family or path; font_size=24
+    shadow=1           drop shadow on (1) or off (0)
+    format=jpeg        jpeg, png or webp (/render)
+
+Requests are served from a fixed process pool. At most --queue requests wait for a
+worker; beyond that the service answers 503 with Retry-After, before reading the
+request body, instead of queueing without bound.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from PIL import UnidentifiedImageError
+
+from batch import init_worker
+from stampcore.assets import ImageAsset
+from stampcore.cache import get_default_cache
+from stampcore.export import DEFAULT_OPTIONS
+from stampcore.fonts import FontIndex
+from stampcore.palette import DEFAULT_BACKEND, PALETTE_BACKENDS
+from stampcore.spec import make_spec, render_spec
+
+MAX_BODY_BYTES = 200 * 1024 * 1024
+HEADER_TIMEOUT = 30
+# Endpoints served by the process pool, and so subject to the admission limit
+POOL_ENDPOINTS = ('/analyze', '/render')
+OUTPUT_FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp')}
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+               411: 'Length Required', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class RequestError(Exception):
+    """A request that cannot be served, with the HTTP status to answer"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def analyze_image(path, num_colors, backend, use_cache):
+    """Palette and metadata of one image (runs in a pool worker)"""
+    asset = ImageAsset(path, cache=get_default_cache() if use_cache else None)
+    colors = asset.palette(num_colors=num_colors, backend=backend)
+    return {
+        'size': list(asset.size),
+        'palette': [list(color) for color in colors],
+        'hex': ['#%02x%02x%02x' % tuple(color) for color in colors],
+        'metadata': asset.metadata,
+    }
+
+
+def render_image(spec, output_format, use_cache):
+    """Encoded composition of a RenderSpec (runs in a pool worker)"""
+    canvas = render_spec(spec, cache=get_default_cache() if use_cache else None)
+
+    image_format = OUTPUT_FORMATS[output_format][0]
+    buffer = io.BytesIO()
+    canvas.save(buffer, format=image_format, **DEFAULT_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def parse_color(value):
+    """An RGB tuple from "#aabbcc" or, in JSON requests, a [r, g, b] list of 0-255 ints"""
+    if not isinstance(value, str):
+        if len(value) != 3 or not all(isinstance(c, int) and 0 <= c <= 255 for c in value):
+            raise ValueError(f"not an RGB triple of 0-255 integers: {value}")
+        return tuple(value)
+    value = value.strip().lstrip('#')
+    if len(value) != 6:
+        raise ValueError(value)
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+class RenderService:
+    """Asyncio HTTP front end dispatching to a bounded process pool"""
+
+    def __init__(self, workers=None, queue_size=16, roots=(), use_cache=True):
+        self.workers = workers or os.cpu_count()
+        self.max_pending = self.workers + queue_size
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.use_cache = use_cache
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.pending = 0
+        self.stats = {'served': 0, 'rejected': 0, 'failed': 0}
+        self.font_index = FontIndex()
+        self.font_index.refresh()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def admit(self, target):
+        """Reserve a place for a request to a pool endpoint, or fail fast when the queue is full.
+
+        Returns True if a place was taken; the caller gives it back with release().
+        """
+        if urlsplit(target).path not in POOL_ENDPOINTS:
+            return False
+        if self.pending >= self.max_pending:
+            self.stats['rejected'] += 1
+            raise RequestError(503, "Too many requests in flight, retry shortly")
+        self.pending += 1
+        return True
+
+    def release(self):
+        self.pending -= 1
+
+    async def run_in_pool(self, function, *args):
+        """Run function in a worker once one is free (the request was admitted beforehand)"""
+        # The semaphore keeps the pool's own queue empty, so waiting requests stay
+        # cancellable here and the admission limit is exact
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+
+    def parse_options(self, params):
+        try:
+            options = {
+                'num_colors': int(params.get('colors', 10)),
+                'backend': params.get('backend', DEFAULT_BACKEND),
+                'font_size': int(params.get('font_size', 24)),
+                'shadow': str(params.get('shadow', '1')).lower() not in ('0', 'false', 'no', 'off'),
+                'format': str(params.get('format', 'jpeg')).lower(),
+                'palette': None,
+                'font_path': None,
+            }
+            palette = params.get('palette')
+            if palette:
+                colors = palette.split(',') if isinstance(palette, str) else palette
+                options['palette'] = [parse_color(color) for color in colors]
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, f"Invalid option: {e}")
+
+        if not 1 <= options['num_colors'] <= 64:
+            raise RequestError(400, "colors must be between 1 and 64")
+        if not 4 <= options['font_size'] <= 400:
+            raise RequestError(400, "font_size must be between 4 and 400")
+        if options['backend'] not in PALETTE_BACKENDS:
+            raise RequestError(400, f"Unknown backend, choose from {', '.join(PALETTE_BACKENDS)}")
+        if options['format'] not in OUTPUT_FORMATS:
+            raise RequestError(400, f"Unknown format, choose from {', '.join(OUTPUT_FORMATS)}")
+
+        font = params.get('font')
+        if font and font != "default":
+            # Font names are resolved here so workers only ever receive a path. Only installed
+            # fonts are accepted, so a client cannot probe for arbitrary files
+            font = str(font)
+            options['font_path'] = self.font_index.lookup(font) or (font if font in self.font_index.fonts else None)
+            if not options['font_path']:
+                raise RequestError(400, f"Font not found: {font}")
+        return options
+
+    def resolve_path(self, path):
+        """A requested file path, if it lies below one of the allowed roots"""
+        real_path = os.path.realpath(os.path.expanduser(path))
+        if not any(real_path == root or real_path.startswith(root + os.sep) for root in self.roots):
+            raise RequestError(403, "Path is outside the directories this service may read (see --root)")
+        if not os.path.isfile(real_path):
+            raise RequestError(404, f"No such file: {path}")
+        return real_path
+
+    async def handle_request(self, method, target, headers, body):
+        """Route one request; return (status, content type, body bytes)"""
+        url = urlsplit(target)
+        if url.path == '/health':
+            payload = dict(self.stats, workers=self.workers, pending=self.pending, max_pending=self.max_pending)
+            return 200, 'application/json', json.dumps(payload).encode()
+        if url.path not in POOL_ENDPOINTS:
+            raise RequestError(404, f"Unknown endpoint {url.path}")
+        if method != 'POST':
+            raise RequestError(405, "Use POST")
+
+        params = dict(parse_qsl(url.query))
+        content_type = headers.get('content-type', '').split(';')[0].strip()
+        upload_path = None
+        if content_type == 'application/json':
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError as e:
+                raise RequestError(400, f"Invalid JSON body: {e}")
+            if not isinstance(request, dict) or 'path' not in request:
+                raise RequestError(400, "JSON requests need a \"path\"")
+            params.update(request)
+            path = self.resolve_path(str(request['path']))
+            use_cache = self.use_cache
+        else:
+            if not body:
+                raise RequestError(400, "Send an image as the request body or a JSON body with a path")
+            upload_path = await asyncio.to_thread(self.spool_upload, body)
+            path = upload_path
+            # Uploads are one-off temporary files; keep them out of the persistent cache
+            use_cache = False
+
+        try:
+            options = self.parse_options(params)
+            if url.path == '/analyze':
+                result = await self.run_in_pool(analyze_image, path, options['num_colors'], options['backend'], use_cache)
+                return 200, 'application/json', json.dumps(result).encode()
+            spec = make_spec(path, colors=options['palette'], font_path=options['font_path'],
+                             font_size=options['font_size'], shadow=options['shadow'],
+                             num_colors=options['num_colors'], backend=options['backend'])
+            data = await self.run_in_pool(render_image, spec, options['format'], use_cache)
+            return 200, OUTPUT_FORMATS[options['format']][1], data
+        except UnidentifiedImageError:
+            raise RequestError(400, "The request does not contain a readable image")
+        finally:
+            if upload_path:
+                os.remove(upload_path)
+
+    @staticmethod
+    def spool_upload(body):
+        fd, path = tempfile.mkstemp(prefix="colorstamp-upload-")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        return path
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 431, 'application/json', b'{"error": "Headers too large"}', False)
+                    return
+
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self.respond(writer, 400, 'application/json', b'{"error": "Malformed request line"}', False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() == 'HTTP/1.1')
+
+                start = time.perf_counter()
+                length = 0
+                body = None
+                admitted = False
+                try:
+                    if 'chunked' in headers.get('transfer-encoding', '').lower():
+                        keep_alive = False
+                        raise RequestError(411, "Chunked uploads are not supported; send Content-Length")
+                    length = int(headers.get('content-length', 0) or 0)
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise RequestError(413, f"Request body exceeds {MAX_BODY_BYTES} bytes")
+                    # Turn a request away before reading a body of up to MAX_BODY_BYTES for it
+                    admitted = self.admit(target)
+                    body = await reader.readexactly(length) if length else b''
+                    status, content_type, payload = await self.handle_request(method.upper(), target, headers, body)
+                    self.stats['served'] += 1
+                except RequestError as e:
+                    if body is None and length:
+                        # The unread body would be parsed as the next request, so close instead
+                        keep_alive = False
+                    status, content_type, payload = e.status, 'application/json', json.dumps({'error': str(e)}).encode()
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    status, content_type = 500, 'application/json'
+                    payload = json.dumps({'error': f"{type(e).__name__}: {e}"}).encode()
+                finally:
+                    if admitted:
+                        self.release()
+
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                await self.respond(writer, status, content_type, payload, keep_alive, elapsed_ms)
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content_type, payload, keep_alive, elapsed_ms=None):
+        headers = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(payload)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        if elapsed_ms is not None:
+            headers.append(f"Server-Timing: total;dur={elapsed_ms:.1f}")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def serve(host, port, workers, queue_size, roots, use_cache=True):
+    service = RenderService(workers=workers, queue_size=queue_size, roots=roots, use_cache=use_cache)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+
+    # Stop on SIGTERM as on Ctrl-C, so the worker processes are shut down with the server
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    try:
+        address = server.sockets[0].getsockname()
+        print(f"Serving on http://{address[0]}:{address[1]} with {service.workers} workers "
+              f"and up to {queue_size} queued requests", flush=True)
+        async with server:
+            await stop.wait()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--queue", type=int, default=16, help="Requests allowed to wait for a worker before 503s")
+    parser.add_argument("--root", action="append", default=[],
+                        help="Directory whose files may be requested by path (repeatable; default: uploads only)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and do not update the palette/metadata cache")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue, args.root, use_cache=not args.no_cache))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
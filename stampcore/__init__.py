@@ -0,0 +1,12 @@
+"""Headless ColorStamp core: image assets, palettes, metadata, layout, rendering and export.
+
+Nothing in here imports tkinter, and heavy optional libraries (scikit-learn,
+exifread) are imported by the functions that need them rather than at module
+level, so `import stampcore.render` stays cheap for batch workers, the render
+service and other tools. The GUI (ColorStamp.py) and the command line entry points
+(batch.py, server.py, watch.py, metadata_index.py) are built on top of it.
+benchmarks/import_time.py measures and checks the cold-start cost.
+
+The package is deliberately not named "colorstamp": on case-insensitive file systems
+it would clash with ColorStamp.py.
+"""
@@ -0,0 +1,315 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from .integral import IntegralImage
+from .metadata import format_metadata, read_exif_record
+from .palette import DEFAULT_BACKEND, DEFAULT_SEED, PaletteFitter
+from .sampling import can_stream_rows, reduce_streamed, sample_pixels
+from .timing import span
+
+# Stitched panoramas routinely exceed Pillow's default decompression bomb limit (~179 MP)
+Image.MAX_IMAGE_PIXELS = 1_000_000_000
+
+# Palette sampling draws from a reduced decode holding at least this many pixels
+PALETTE_MIN_PIXELS = 250_000
+
+# Non-JPEG sources larger than this are sampled by streaming the full-resolution pixels
+# (see sampling.py) instead of decoding and reducing the whole image
+STREAM_SAMPLING_MIN_PIXELS = 40_000_000
+
+# Resizes start from the smallest pyramid level at least this many times larger than the
+# target. 3 keeps the result within one grey level on average of a full-resolution
+# LANCZOS resize (tests/test_resize.py) at a fraction of the cost; below that the 2x box
+# reductions soften small targets visibly
+REDUCING_GAP = 3.0
+
+# Default budget of the low-memory mode, in bytes
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Pillow keeps RGB images as four bytes per pixel
+RGB_BYTES_PER_PIXEL = 4
+
+# Full-resolution sampling holds the decoded image, its pixel array and a summed-area
+# table of three uint32 sums per pixel
+INTEGRAL_BYTES_PER_PIXEL = RGB_BYTES_PER_PIXEL + 3 + 12
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when a low-memory asset would have to hold more pixels than its budget allows"""
+
+
+class ImageAsset:
+    """A source image decoded once and shared by display, palette extraction and composition.
+
+    Consumers that only need a small image ask decode() for a minimum size. JPEGs are then
+    decoded with DCT-domain downscaling (Image.draft), which skips most of the decode work
+    and memory; the full-resolution image is only decoded when something needs it.
+
+    Every decode is the top of a pyramid of successive 2x reductions (Image.reduce), built
+    lazily and kept, so each resize starts from the nearest larger level instead of
+    running LANCZOS over the whole source again.
+
+    With a memory_budget (bytes) the asset never holds more decoded pixels than the
+    budget: uncompressed sources are reduced while streaming their strips from disk
+    (see sampling.reduce_streamed), only levels well below the budget stay resident, and
+    asking for the full-resolution image of a larger source raises MemoryBudgetError.
+    """
+
+    def __init__(self, path, cache=None, memory_budget=None):
+        self.path = path
+        self.cache = cache
+        self.memory_budget = memory_budget
+        self._size = None
+        self._format = None
+        self._levels = []
+        self._image = None
+        self._pixels = None
+        self._metadata = None
+        self._integral = None
+        self._proxies = {}
+        self._fitters = {}
+        self._lock = threading.RLock()
+
+    @property
+    def image(self):
+        """The full-resolution RGB image, decoded on first access"""
+        with self._lock:
+            if self._image is None:
+                self._check_budget(self.size, "the full-resolution image")
+                with Image.open(self.path) as img:
+                    self._image = img.convert('RGB')
+                self._levels.append(self._image)
+            return self._image
+
+    def _read_header(self):
+        with self._lock:
+            if self._format is None:
+                with Image.open(self.path) as img:
+                    self._size = img.size
+                    self._format = img.format
+
+    @property
+    def size(self):
+        """Full-resolution size, read from the file header without decoding"""
+        self._read_header()
+        return self._size
+
+    @property
+    def format(self):
+        """File format as reported by Pillow, read from the file header"""
+        self._read_header()
+        return self._format
+
+    def fits_budget(self, size, bytes_per_pixel=RGB_BYTES_PER_PIXEL):
+        """Whether an RGB image of this size fits the memory budget (always true without one)"""
+        return self.memory_budget is None or size[0] * size[1] * bytes_per_pixel <= self.memory_budget
+
+    def _check_budget(self, size, what, bytes_per_pixel=RGB_BYTES_PER_PIXEL):
+        if not self.fits_budget(size, bytes_per_pixel):
+            raise MemoryBudgetError(
+                f"{what} of {os.path.basename(self.path)} ({size[0]}x{size[1]}) needs "
+                f"{size[0] * size[1] * bytes_per_pixel / 2**20:.0f} MB, more than the "
+                f"{self.memory_budget / 2**20:.0f} MB memory budget; raise the budget or convert it to "
+                f"an uncompressed TIFF, which can be streamed")
+
+    def _keeps(self, image):
+        """Whether a decoded level may stay resident (a small fraction of the budget)"""
+        return self.memory_budget is None or image.width * image.height * RGB_BYTES_PER_PIXEL * 8 <= self.memory_budget
+
+    def _decode_file(self, min_size):
+        width, height = self.size
+        # Largest integer reduction that still covers min_size
+        factor = max(1, min(width // max(1, min_size[0]), height // max(1, min_size[1])))
+        with span("decode", path=os.path.basename(self.path)), Image.open(self.path) as img:
+            if img.format == 'JPEG':
+                # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding, never below min_size
+                img.draft('RGB', min_size)
+                self._check_budget(img.size, "the smallest JPEG decode")
+                image = img.convert('RGB')
+            elif self.memory_budget is not None and factor > 1 and can_stream_rows(self.path):
+                image = reduce_streamed(self.path, factor)
+            else:
+                self._check_budget(self.size, "decoding")
+                image = img.convert('RGB')
+                if self.memory_budget is not None and factor > 1:
+                    image = image.reduce(factor)
+
+        if image.size == self.size and self._keeps(image):
+            # No reduction was possible, so this is the full-resolution image
+            self._image = image
+        if self._keeps(image):
+            self._levels.append(image)
+        return image
+
+    def decode(self, min_size):
+        """The smallest pyramid level that is at least min_size in both dimensions.
+
+        Falls back to the full-resolution image when the source is smaller than min_size.
+        """
+        min_width, min_height = min_size
+        with self._lock:
+            fitting = [level for level in self._levels if level.width >= min_width and level.height >= min_height]
+            if fitting:
+                level = min(fitting, key=lambda level: level.width)
+            elif self._image is not None:
+                return self._image
+            else:
+                level = self._decode_file((min_width, min_height))
+                if level.width < min_width or level.height < min_height:
+                    return level
+
+            # Walk down the pyramid, materialising 2x reductions that still cover min_size
+            while -(-level.width // 2) >= min_width and -(-level.height // 2) >= min_height:
+                with span("reduce", size=f"{level.width}x{level.height}"):
+                    level = level.reduce(2)
+                if self._keeps(level):
+                    self._levels.append(level)
+            return level
+
+    @property
+    def pixels(self):
+        """The full-resolution pixel buffer as an (height, width, 3) uint8 array"""
+        with self._lock:
+            if self._pixels is None:
+                self._pixels = np.asarray(self.image)
+            return self._pixels
+
+    @property
+    def integral(self):
+        """Summed-area table of the full-resolution image, built on first use"""
+        with self._lock:
+            if self._integral is None:
+                self._check_budget(self.size, "the full-resolution sampling table", INTEGRAL_BYTES_PER_PIXEL)
+                self._integral = IntegralImage(self.pixels)
+            return self._integral
+
+    @property
+    def integral_ready(self):
+        """The summed-area table if it has been built already, else None; never builds it"""
+        return self._integral
+
+    @property
+    def metadata(self):
+        """The parsed EXIF metadata, read from the file (or the persistent cache) only once"""
+        with self._lock:
+            if self._metadata is None:
+                record = self.cache.get_exif(self.path) if self.cache else None
+                if record is None:
+                    with span("metadata"):
+                        record = read_exif_record(self.path)
+                    if self.cache:
+                        self.cache.put_exif(self.path, record)
+                # The cache keeps the raw record and it is formatted here, so the current
+                # date shown for files without a capture date is never frozen in the cache
+                self._metadata = format_metadata(record)
+            return self._metadata
+
+    def palette_pixels(self):
+        """Pixel buffer for palette sampling, from a decode reduced to about PALETTE_MIN_PIXELS"""
+        width, height = self.size
+        factor = min(1.0, math.sqrt(PALETTE_MIN_PIXELS / (width * height)))
+        image = self.decode((math.ceil(width * factor), math.ceil(height * factor)))
+        return np.asarray(image)
+
+    def streams_palette(self):
+        """Whether palette sampling streams the full-resolution pixels instead of a reduced decode"""
+        width, height = self.size
+        if self.memory_budget is not None:
+            # Only uncompressed sources stream in bounded memory; the rest sample a budgeted decode
+            return width * height > STREAM_SAMPLING_MIN_PIXELS and can_stream_rows(self.path)
+        return self.format != 'JPEG' and width * height > STREAM_SAMPLING_MIN_PIXELS
+
+    def sampled_pixels(self, sample_size, seed=DEFAULT_SEED):
+        """A uniform pixel sample drawn in bounded memory, from the decoded image if there is one"""
+        return sample_pixels(self._image if self._image is not None else self.path, sample_size, seed=seed,
+                             low_memory=self.memory_budget is not None)
+
+    def palette_fitter(self, sample_size=10000, backend=DEFAULT_BACKEND, seed=DEFAULT_SEED):
+        """The PaletteFitter for this image and sampling settings, kept for refits at other color counts"""
+        key = (sample_size, backend, seed)
+        with self._lock:
+            if key not in self._fitters:
+                streamed = self.streams_palette()
+
+                def load_pixels():
+                    with span("palette_sample", streamed=streamed):
+                        return self.sampled_pixels(sample_size, seed) if streamed else self.palette_pixels()
+
+                self._fitters[key] = PaletteFitter(load_pixels, sample_size=sample_size, backend=backend, seed=seed)
+            return self._fitters[key]
+
+    def palette(self, num_colors=10, sample_size=10000, backend=DEFAULT_BACKEND, seed=DEFAULT_SEED,
+                check_cancelled=None):
+        """Palette colors for the image, served from the persistent cache when possible.
+
+        Refits of the same image at another color count are warm-started from the
+        earlier ones (see PaletteFitter). Only cold fits are written to the persistent
+        cache, so a cached palette does not depend on which counts were tried before.
+        check_cancelled is called between the sampling and fitting stages and the fit's
+        iterations, and raises to abandon the extraction.
+        """
+        params = {'backend': backend, 'num_colors': num_colors, 'sample_size': sample_size, 'seed': seed}
+        streamed = self.streams_palette()
+        if streamed:
+            # Low-memory streaming reads tiles in row order, which changes the sample
+            cache_key = dict(params, sampling='stream' if self.memory_budget is None else 'stream-rows')
+        else:
+            cache_key = dict(params, min_pixels=PALETTE_MIN_PIXELS)
+        fitter = self.palette_fitter(sample_size, backend, seed)
+        if self.cache:
+            colors = self.cache.get_palette(self.path, cache_key)
+            if colors is not None:
+                # A refit at another count can start from the cached palette
+                fitter.add_fit(num_colors, colors)
+                return colors
+
+        fitter.load_sample(check_cancelled)
+        with span("palette_fit", backend=backend, num_colors=num_colors):
+            colors = fitter.fit(num_colors, check_cancelled)
+        if self.cache and not fitter.is_warm(num_colors):
+            self.cache.put_palette(self.path, cache_key, colors)
+        return colors
+
+    def proxy(self, size, check_cancelled=None):
+        """Return a LANCZOS-resized copy of the image, cached by target size.
+
+        check_cancelled is called between the decode and the resize, and raises to stop.
+        """
+        size = tuple(size)
+        with self._lock:
+            if size not in self._proxies:
+                source = self.decode((math.ceil(size[0] * REDUCING_GAP), math.ceil(size[1] * REDUCING_GAP)))
+                if check_cancelled is not None:
+                    check_cancelled()
+                with span("resize", size=f"{size[0]}x{size[1]}"):
+                    self._proxies[size] = source.resize(size, Image.LANCZOS)
+            return self._proxies[size]
+
+
+_assets = OrderedDict()
+_assets_lock = threading.Lock()
+MAX_CACHED_ASSETS = 2
+
+
+def open_asset(path, cache=None, memory_budget=None):
+    """Return the cached asset for a file, decoding it again only if the file changed"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, memory_budget)
+    with _assets_lock:
+        asset = _assets.pop(key, None)
+        if memory_budget is not None:
+            # Other cached assets may hold full-resolution decodes the budget does not allow for
+            _assets.clear()
+        if asset is None:
+            asset = ImageAsset(path, cache=cache, memory_budget=memory_budget)
+        _assets[key] = asset
+
+        # Evict the least recently opened images
+        while len(_assets) > MAX_CACHED_ASSETS:
+            _assets.popitem(last=False)
+        return asset
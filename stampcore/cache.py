@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from fractions import Fraction
+
+from .metadata import ExifRecord
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def default_cache_dir():
+    """Per-user cache directory, honouring XDG_CACHE_HOME"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "colorstamp")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """BLAKE2b digest of a file's contents"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Persistent palette and EXIF record cache keyed by file content hash.
+
+    Entries are keyed by the content digest plus the extraction parameters, so a copied
+    or renamed file still hits. The digest itself is memoised per path and recomputed
+    whenever the file's mtime or size changes. The total stored size is bounded, with
+    the least recently used entries evicted first.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        if path is None:
+            path = os.path.join(default_cache_dir(), "cache.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        # One connection shared by the GUI worker threads; batch processes each open their own
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT, nbytes INTEGER, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def digest(self, image_path):
+        """Content digest of a file, rehashing only when its mtime or size changed"""
+        image_path = os.path.abspath(image_path)
+        stat = os.stat(image_path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT mtime_ns, size, digest FROM files WHERE path = ?", (image_path,)
+            ).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return row[2]
+
+        digest = file_digest(image_path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest) VALUES (?, ?, ?, ?)",
+                (image_path, stat.st_mtime_ns, stat.st_size, digest),
+            )
+        return digest
+
+    def _key(self, image_path, kind, params):
+        return f"{self.digest(image_path)}:{kind}:{json.dumps(params, sort_keys=True)}"
+
+    def _get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def _put(self, key, value):
+        value = json.dumps(value)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(key) + len(value), time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until we are comfortably under the limit
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, nbytes in self._db.execute("SELECT key, nbytes FROM entries ORDER BY last_used"):
+            stale.append((key,))
+            freed += nbytes
+            if freed >= target:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def get_palette(self, image_path, params):
+        """Cached palette colors for a file and extraction parameters, or None"""
+        colors = self._get(self._key(image_path, "palette", params))
+        return None if colors is None else [tuple(color) for color in colors]
+
+    def put_palette(self, image_path, params, colors):
+        self._put(self._key(image_path, "palette", params), [list(color) for color in colors])
+
+    def get_exif(self, image_path):
+        """Cached raw EXIF record for a file, or None"""
+        values = self._get(self._key(image_path, "exif", {}))
+        if values is None:
+            return None
+        return ExifRecord(*[Fraction(*value) if isinstance(value, list) else value for value in values])
+
+    def put_exif(self, image_path, record):
+        # Rationals are stored as [numerator, denominator] so they come back exact
+        values = [[value.numerator, value.denominator] if isinstance(value, Fraction) else value
+                  for value in record]
+        self._put(self._key(image_path, "exif", {}), values)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """The shared per-user cache, opened on first use (None if it cannot be opened)"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = ResultCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Palette cache disabled: {e}")
+                _default_cache = False
+        return _default_cache or None
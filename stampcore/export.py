@@ -0,0 +1,112 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from .timing import span
+
+# One file written from a composition. format None takes the format from the chosen
+# file name's extension; max_size scales the canvas down so its longer side fits
+ExportTarget = namedtuple('ExportTarget', ['suffix', 'format', 'options', 'max_size'])
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+EXTENSION_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+
+# Encoder settings used when a target leaves the format to the file name
+DEFAULT_OPTIONS = {
+    'JPEG': {'quality': 95, 'subsampling': 0},
+    'PNG': {},
+    'WEBP': {'quality': 90, 'method': 4},
+}
+
+EXPORT_PRESETS = {
+    # The chosen file only, as JPEG (quality 95, 4:4:4) or PNG
+    'single': [
+        ExportTarget('', None, {}, None),
+    ],
+    # Full-quality JPEG, a WebP for the web and a small PNG proxy
+    'publish': [
+        ExportTarget('', 'JPEG', {'quality': 95, 'subsampling': 0, 'optimize': True, 'progressive': True}, None),
+        ExportTarget('', 'WEBP', {'quality': 85, 'method': 4}, None),
+        ExportTarget('_proxy', 'PNG', {'optimize': True}, 540),
+    ],
+    # Smaller files for direct upload
+    'web': [
+        ExportTarget('', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}, None),
+        ExportTarget('', 'WEBP', {'quality': 80, 'method': 6}, None),
+    ],
+}
+DEFAULT_PRESET = 'single'
+
+ExportResult = namedtuple('ExportResult', ['path', 'format', 'bytes', 'seconds'])
+
+
+def target_path(output_path, target):
+    """File name for one target: the chosen name plus the target's suffix and extension"""
+    stem, extension = os.path.splitext(output_path)
+    if target.format is not None:
+        extension = FORMAT_EXTENSIONS[target.format]
+    return stem + target.suffix + extension
+
+
+def target_format(path, target):
+    """Pillow format a target is written in; raises ValueError for an extension Pillow cannot write"""
+    if target.format is not None:
+        return target.format
+    extension = os.path.splitext(path)[1].lower()
+    if extension in EXTENSION_FORMATS:
+        return EXTENSION_FORMATS[extension]
+
+    # Any other format Pillow can write (.tif, .bmp, .gif, ...) is saved with its defaults
+    image_format = Image.registered_extensions().get(extension)
+    if image_format not in Image.SAVE:
+        raise ValueError(f"Cannot export to '{os.path.basename(path)}': Pillow has no writer for "
+                         f"the extension '{extension}'")
+    return image_format
+
+
+def encode_target(canvas, output_path, target):
+    """Encode one target and write it atomically; return an ExportResult"""
+    start = time.perf_counter()
+    path = target_path(output_path, target)
+    image_format = target_format(path, target)
+    options = target.options if target.format else DEFAULT_OPTIONS.get(image_format, {})
+
+    with span("encode", format=image_format, path=os.path.basename(path)):
+        # Image.save stores the encoder settings on the image object, so every thread
+        # encodes its own copy of the shared canvas
+        image = canvas.copy()
+        if target.max_size:
+            image.thumbnail((target.max_size, target.max_size), Image.LANCZOS)
+
+        # Write next to the destination and swap it in, so readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            image.save(temp_path, format=image_format, **options)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    return ExportResult(path, image_format, os.path.getsize(path), time.perf_counter() - start)
+
+
+def export_canvas(canvas, output_path, targets, max_workers=None):
+    """Encode every target of a preset from one composed canvas on parallel threads.
+
+    Pillow releases the GIL while encoding and resampling, so the targets encode
+    concurrently. Returns the ExportResults in target order; the first encoder error
+    is raised once all targets have finished. A target that takes its format from the
+    file name raises ValueError up front if Pillow cannot write that extension.
+    """
+    if isinstance(targets, str):
+        targets = EXPORT_PRESETS[targets]
+    # Reject an unsupported file name before any target is written
+    for target in targets:
+        target_format(target_path(output_path, target), target)
+    canvas.load()
+    with ThreadPoolExecutor(max_workers=max_workers or len(targets)) as pool:
+        futures = [pool.submit(encode_target, canvas, output_path, target) for target in targets]
+    return [future.result() for future in futures]
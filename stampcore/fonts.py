@@ -0,0 +1,179 @@
+import functools
+import json
+import os
+import threading
+
+from PIL import ImageFont
+
+from .cache import default_cache_dir
+
+# Common font directories
+FONT_DIRS = [
+    # Windows
+    r"C:\Windows\Fonts",
+    # MacOS
+    "/Library/Fonts",
+    "/System/Library/Fonts",
+    os.path.expanduser("~/Library/Fonts"),
+    # Linux
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    os.path.expanduser("~/.fonts"),
+]
+
+# Look for common font file extensions
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+
+@functools.lru_cache(maxsize=64)
+def load_font(font_path, font_size):
+    """Load a TrueType font, falling back to the default font.
+
+    Parsed fonts are kept in a bounded LRU keyed by (path, size), so repeated previews
+    and batch renders reuse the same FreeTypeFont instead of re-reading the file.
+    """
+    if not font_path or font_path == "default":
+        return ImageFont.load_default()
+
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except Exception as e:
+        print(f"Error loading font {font_path}: {e}")
+        return ImageFont.load_default()
+
+
+def read_font_name(path):
+    """Family and style names stored in a font file, or empty strings if it cannot be parsed"""
+    try:
+        return ImageFont.truetype(path, 12).getname()
+    except Exception:
+        return "", ""
+
+
+class FontIndex:
+    """Persisted index of installed font files with their family, style and mtime.
+
+    Loading the saved index is instant. refresh() only rescans directories whose mtime
+    changed since the last scan (a directory's mtime moves whenever a file is added,
+    removed or renamed in it) and only parses font files that are new or modified.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, font_dirs=None):
+        self.path = path or os.path.join(default_cache_dir(), "fonts.json")
+        self.font_dirs = FONT_DIRS if font_dirs is None else font_dirs
+        self.fonts = {}        # font path -> {'family', 'style', 'mtime'}
+        self.dir_mtimes = {}   # every scanned directory -> its mtime
+        self._names = None     # file name, family or "family style" -> font path
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.VERSION:
+            with self._lock:
+                self.fonts = data.get('fonts', {})
+                self.dir_mtimes = data.get('dirs', {})
+                self._names = None
+
+    def save(self):
+        with self._lock:
+            data = {'version': self.VERSION, 'fonts': self.fonts, 'dirs': self.dir_mtimes}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save font index: {e}")
+
+    def paths(self):
+        """Indexed font paths, sorted by file name"""
+        with self._lock:
+            return sorted(self.fonts, key=lambda path: os.path.basename(path).lower())
+
+    def lookup(self, name):
+        """Font path for a file name, family name or "family style", or None"""
+        with self._lock:
+            if self._names is None:
+                names = {}
+                # Sort so the choice between same-named files is stable; file names win over families
+                for path in sorted(self.fonts, reverse=True):
+                    info = self.fonts[path]
+                    if info['family']:
+                        names[f"{info['family']} {info['style']}".strip()] = path
+                        names[info['family']] = path
+                for path in sorted(self.fonts, reverse=True):
+                    names[os.path.basename(path)] = path
+                self._names = names
+            return self._names.get(name)
+
+    def changed_dirs(self):
+        """Directories that are new, gone or modified since the last scan"""
+        changed = []
+        for directory in list(self.dir_mtimes) + [d for d in self.font_dirs if d not in self.dir_mtimes]:
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self.dir_mtimes.get(directory):
+                changed.append(directory)
+        return changed
+
+    def refresh(self):
+        """Rescan changed directories; return True if the set of fonts changed"""
+        changed = self.changed_dirs()
+        if not changed:
+            return False
+
+        with self._lock:
+            fonts = dict(self.fonts)
+            dir_mtimes = dict(self.dir_mtimes)
+
+        pending = list(changed)
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+                entries = list(os.scandir(directory))
+            except OSError:
+                # The directory is gone: forget it, its subdirectories and their fonts
+                prefix = directory.rstrip(os.sep) + os.sep
+                for path in [p for p in fonts if os.path.dirname(p) == directory]:
+                    del fonts[path]
+                for subdir in [d for d in dir_mtimes if d == directory or d.startswith(prefix)]:
+                    del dir_mtimes[subdir]
+                continue
+
+            dir_mtimes[directory] = mtime
+            present = set()
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # Subdirectories we have never seen are scanned in full
+                    if entry.path not in dir_mtimes:
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith(FONT_EXTENSIONS):
+                    present.add(entry.path)
+                    file_mtime = entry.stat().st_mtime
+                    known = fonts.get(entry.path)
+                    if known is None or known['mtime'] != file_mtime:
+                        family, style = read_font_name(entry.path)
+                        fonts[entry.path] = {'family': family, 'style': style, 'mtime': file_mtime}
+
+            # Drop fonts deleted from this directory
+            for path in [p for p in fonts if os.path.dirname(p) == directory and p not in present]:
+                del fonts[path]
+
+        with self._lock:
+            fonts_changed = fonts.keys() != self.fonts.keys()
+            self.fonts = fonts
+            self.dir_mtimes = dir_mtimes
+            self._names = None
+        self.save()
+        return fonts_changed
@@ -0,0 +1,46 @@
+import numpy as np
+
+# Rectangle sums are computed with wrapping uint32 arithmetic, which stays exact as long
+# as a single rectangle's true sum fits in 32 bits
+MAX_EXACT_AREA = (2 ** 32 - 1) // 255
+
+
+class IntegralImage:
+    """Summed-area table of an RGB image for constant-time rectangle averages"""
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.height, self.width = pixels.shape[:2]
+
+        # Pad with a leading row and column of zeros so every lookup is four reads.
+        # uint32 keeps the table at four bytes per channel; overflow in the running sums
+        # cancels out in the modular differences taken by sum()
+        self.table = np.zeros((self.height + 1, self.width + 1, 3), dtype=np.uint32)
+        np.cumsum(pixels[..., :3], axis=0, dtype=np.uint32, out=self.table[1:, 1:])
+        np.cumsum(self.table[1:, 1:], axis=1, dtype=np.uint32, out=self.table[1:, 1:])
+
+    def clamp(self, x0, y0, x1, y1):
+        x0, x1 = sorted((int(x0), int(x1)))
+        y0, y1 = sorted((int(y0), int(y1)))
+        return max(0, x0), max(0, y0), min(self.width, x1), min(self.height, y1)
+
+    def sum(self, x0, y0, x1, y1):
+        """Per-channel sum over the half-open box [x0, x1) x [y0, y1)"""
+        x0, y0, x1, y1 = self.clamp(x0, y0, x1, y1)
+        if x0 >= x1 or y0 >= y1:
+            return np.zeros(3, dtype=np.uint64)
+
+        if (x1 - x0) * (y1 - y0) > MAX_EXACT_AREA:
+            # Too large for the 32-bit table to be exact; sum the region directly
+            return self.pixels[y0:y1, x0:x1, :3].reshape(-1, 3).sum(axis=0, dtype=np.uint64)
+
+        t = self.table
+        return (t[y1, x1] - t[y0, x1] - t[y1, x0] + t[y0, x0]).astype(np.uint64)
+
+    def mean(self, x0, y0, x1, y1):
+        """Average RGB color of the box as an integer tuple, or None if it is empty"""
+        x0, y0, x1, y1 = self.clamp(x0, y0, x1, y1)
+        area = (x1 - x0) * (y1 - y0)
+        if area <= 0:
+            return None
+        return tuple(int(channel) for channel in self.sum(x0, y0, x1, y1) // area)
@@ -0,0 +1,74 @@
+"""Canvas geometry of the Instagram Stories composition, independent of any pixels."""
+from collections import namedtuple
+
+# Positions of every element on the canvas, derived from the source image size only
+Layout = namedtuple('Layout', [
+    'canvas_size',        # (width, height) of the Instagram Stories canvas
+    'image_box',          # (x, y, width, height) of the resized photo
+    'palette_box',        # (x, y, width, height) of the color palette strip
+    'metadata_y',         # top of the first metadata text line
+    'right_column_x',     # left edge of the right-hand metadata column
+])
+
+
+def compute_layout(image_size):
+    """Lay out the composition for a source image of the given size"""
+    original_width, original_height = image_size
+
+    # Create Instagram Stories format (9:16 aspect ratio)
+    stories_ratio = 9 / 16
+
+    # Determine the size of the Instagram Stories canvas
+    stories_width = 1080
+    stories_height = int(stories_width / stories_ratio)  # Should be 1920px
+
+    # Define padding and section heights
+    metadata_height = 180
+    bottom_padding = 180
+    available_height = stories_height - metadata_height - bottom_padding
+
+    # Scale the original image to fit within the available area while preserving aspect ratio
+    img_ratio = original_width / original_height
+
+    # Add horizontal padding of 5% on each side
+    horizontal_padding = int(stories_width * 0.05)
+    max_image_width = stories_width - 2 * horizontal_padding
+
+    if img_ratio > 1:  # Landscape image
+        new_width = max_image_width
+        new_height = int(new_width / img_ratio)
+        if new_height > available_height:
+            new_height = available_height
+            new_width = int(new_height * img_ratio)
+    else:  # Portrait image
+        new_height = available_height
+        new_width = int(new_height * img_ratio)
+        if new_width > max_image_width:
+            new_width = max_image_width
+            new_height = int(new_width / img_ratio)
+
+    # Calculate position to center the image
+    x_position = (stories_width - new_width) // 2
+    y_position = metadata_height + (available_height - new_height) // 2
+
+    # Make the color palette thicker and add horizontal padding
+    palette_height = 80  # Thicker palette
+    palette_padding = horizontal_padding  # Use same padding as image
+
+    # Calculate available width for palette after padding
+    palette_total_width = stories_width - (2 * palette_padding)
+
+    # Position palette in the middle between image bottom and canvas bottom
+    image_bottom = y_position + new_height
+    palette_y = image_bottom + ((stories_height - image_bottom) // 2) - (palette_height // 2)
+
+    # Position metadata in the middle between top border and image top
+    metadata_center_y = y_position // 2 - 30  # Center minus offset for text height
+
+    return Layout(
+        canvas_size=(stories_width, stories_height),
+        image_box=(x_position, y_position, new_width, new_height),
+        palette_box=(palette_padding, palette_y, palette_total_width, palette_height),
+        metadata_y=metadata_center_y,
+        right_column_x=stories_width - 300,
+    )
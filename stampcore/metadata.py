@@ -0,0 +1,321 @@
+import struct
+from collections import namedtuple
+from datetime import datetime
+from fractions import Fraction
+
+# The raw EXIF values a composition needs. Rationals are kept as Fractions so the
+# formatted shutter speed matches the camera's value exactly; missing fields are None
+ExifRecord = namedtuple('ExifRecord', [
+    'make',            # camera manufacturer
+    'model',           # camera model
+    'lens_make',       # lens manufacturer
+    'lens_model',      # lens model, or the LensSpecification text when the model is missing
+    'f_number',        # aperture as an f-number
+    'exposure_time',   # exposure time in seconds
+    'iso',             # ISO speed rating
+    'date_taken',      # DateTimeOriginal as "YYYY:MM:DD HH:MM:SS"
+], defaults=(None,) * 8)
+
+# Tags read from IFD0 and the EXIF sub-IFD
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_SHUTTER_SPEED_VALUE = 0x9201
+TAG_APERTURE_VALUE = 0x9202
+TAG_LENS_SPECIFICATION = 0xA432
+TAG_LENS_MAKE = 0xA433
+TAG_LENS_MODEL = 0xA434
+
+IFD0_TAGS = {TAG_MAKE, TAG_MODEL, TAG_EXIF_IFD}
+EXIF_TAGS = {TAG_EXPOSURE_TIME, TAG_F_NUMBER, TAG_ISO, TAG_DATE_TIME_ORIGINAL, TAG_LENS_MAKE, TAG_LENS_MODEL}
+# Only consulted when the preferred tag is absent, so they never delay the early exit
+EXIF_FALLBACK_TAGS = {TAG_SHUTTER_SPEED_VALUE, TAG_APERTURE_VALUE, TAG_LENS_SPECIFICATION}
+
+# TIFF field types: struct format and size of a single value
+FIELD_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('LL', 8),
+    7: ('s', 1), 9: ('l', 4), 10: ('ll', 8),
+}
+
+
+class ExifFormatError(ValueError):
+    """The file claims to carry EXIF data but its structure could not be followed"""
+
+
+class _TiffReader:
+    """Reads tags from a TIFF structure through a read(offset, size) callable"""
+
+    def __init__(self, read):
+        self.read = read
+        byte_order = read(0, 2)
+        if byte_order == b'II':
+            self.order = '<'
+        elif byte_order == b'MM':
+            self.order = '>'
+        else:
+            raise ExifFormatError("not a TIFF header")
+        magic, self.ifd0 = struct.unpack(self.order + 'HL', read(2, 6))
+        if magic != 42:
+            raise ExifFormatError("not a TIFF header")
+
+    def read_ifd(self, offset, wanted, optional=()):
+        """Values of the wanted tags in the IFD at offset, stopping once all are found"""
+        values = {}
+        (count,) = struct.unpack(self.order + 'H', self.read(offset, 2))
+        entries = self.read(offset + 2, count * 12)
+        if len(entries) < count * 12:
+            raise ExifFormatError("truncated IFD")
+        remaining = len(wanted)
+        for i in range(count):
+            tag, field_type, n, raw = struct.unpack(self.order + 'HHL4s', entries[i * 12:i * 12 + 12])
+            if tag not in wanted and tag not in optional:
+                continue
+            if field_type in FIELD_TYPES:
+                values[tag] = self._decode(field_type, n, raw)
+            if tag in wanted:
+                remaining -= 1
+                if remaining == 0:
+                    break
+        return values
+
+    def _decode(self, field_type, count, raw):
+        fmt, size = FIELD_TYPES[field_type]
+        nbytes = size * count
+        if nbytes <= 4:
+            data = raw[:nbytes]
+        else:
+            (offset,) = struct.unpack(self.order + 'L', raw)
+            data = self.read(offset, nbytes)
+            if len(data) < nbytes:
+                raise ExifFormatError("value outside the EXIF block")
+
+        if fmt == 's':
+            return data.split(b'\x00', 1)[0].decode('utf-8', 'replace').strip()
+        values = struct.unpack(self.order + fmt * count, data)
+        if len(fmt) == 2:
+            values = [Fraction(num, den) if den else None for num, den in zip(values[::2], values[1::2])]
+        return values
+
+
+def _jpeg_exif_block(f):
+    """The TIFF block of a JPEG's Exif APP1 segment, walking only segment headers"""
+    f.seek(2)
+    while True:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xDA or code == 0xD9:
+            # Start of scan or end of image: no metadata beyond this point
+            return None
+        (length,) = struct.unpack('>H', marker[2:])
+        if code == 0xE1:
+            payload = f.read(length - 2)
+            if payload.startswith(b'Exif\x00\x00'):
+                return payload[6:]
+        else:
+            f.seek(length - 2, 1)
+
+
+def _png_exif_block(f):
+    """The payload of a PNG's eXIf chunk, walking only chunk headers"""
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>L4s', header)
+        if chunk_type == b'eXIf':
+            return f.read(length)
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        f.seek(length + 4, 1)
+
+
+def _record_from_tiff(read):
+    tiff = _TiffReader(read)
+    ifd0 = tiff.read_ifd(tiff.ifd0, IFD0_TAGS)
+    exif = {}
+    if TAG_EXIF_IFD in ifd0:
+        exif = tiff.read_ifd(ifd0[TAG_EXIF_IFD][0], EXIF_TAGS, EXIF_FALLBACK_TAGS)
+
+    def first(values):
+        return values[0] if values else None
+
+    f_number = first(exif.get(TAG_F_NUMBER))
+    if f_number is None and first(exif.get(TAG_APERTURE_VALUE)) is not None:
+        # APEX aperture value: AV = 2 log2(N)
+        f_number = 2 ** (float(exif[TAG_APERTURE_VALUE][0]) / 2)
+
+    exposure_time = first(exif.get(TAG_EXPOSURE_TIME))
+    if exposure_time is None and first(exif.get(TAG_SHUTTER_SPEED_VALUE)) is not None:
+        # APEX shutter speed value: TV = -log2(t)
+        exposure_time = 2 ** -float(exif[TAG_SHUTTER_SPEED_VALUE][0])
+
+    lens_model = exif.get(TAG_LENS_MODEL)
+    if not lens_model and exif.get(TAG_LENS_SPECIFICATION):
+        lens_model = f"[{', '.join(str(v) for v in exif[TAG_LENS_SPECIFICATION])}]"
+
+    return ExifRecord(
+        make=ifd0.get(TAG_MAKE),
+        model=ifd0.get(TAG_MODEL),
+        lens_make=exif.get(TAG_LENS_MAKE),
+        lens_model=lens_model,
+        f_number=f_number,
+        exposure_time=exposure_time,
+        iso=first(exif.get(TAG_ISO)),
+        date_taken=exif.get(TAG_DATE_TIME_ORIGINAL),
+    )
+
+
+def read_exif_header(image_path):
+    """Read the EXIF record from the file header only, without decoding image data.
+
+    JPEG and PNG files are walked segment by segment up to the EXIF block and TIFF files
+    are read through the offsets their IFDs point at, so only a few kilobytes are read.
+    Returns None for other formats, and an empty record if the file carries no EXIF.
+    """
+    with open(image_path, 'rb') as f:
+        signature = f.read(8)
+        if signature[:2] == b'\xff\xd8':
+            block = _jpeg_exif_block(f)
+        elif signature == b'\x89PNG\r\n\x1a\n':
+            block = _png_exif_block(f)
+        elif signature[:4] in (b'II*\x00', b'MM\x00*'):
+            def read(offset, size):
+                f.seek(offset)
+                return f.read(size)
+            return _record_from_tiff(read)
+        else:
+            return None
+
+    if block is None:
+        return ExifRecord()
+    return _record_from_tiff(lambda offset, size: block[offset:offset + size])
+
+
+def read_exif_exifread(image_path):
+    """Read the EXIF record with exifread, which understands more container formats"""
+    import exifread
+
+    with open(image_path, 'rb') as f:
+        tags = exifread.process_file(f, details=False)
+
+    def text(name):
+        return str(tags[name]) if name in tags else None
+
+    def ratio(name):
+        if name not in tags:
+            return None
+        value = tags[name].values[0]
+        return Fraction(value.num, value.den) if value.den else None
+
+    f_number = ratio('EXIF FNumber')
+    if f_number is None and ratio('EXIF ApertureValue') is not None:
+        f_number = 2 ** (float(ratio('EXIF ApertureValue')) / 2)
+
+    exposure_time = ratio('EXIF ExposureTime')
+    if exposure_time is None and ratio('EXIF ShutterSpeedValue') is not None:
+        exposure_time = 2 ** -float(ratio('EXIF ShutterSpeedValue'))
+
+    iso = tags['EXIF ISOSpeedRatings'].values[0] if 'EXIF ISOSpeedRatings' in tags else None
+
+    return ExifRecord(
+        make=text('Image Make'),
+        model=text('Image Model'),
+        lens_make=text('EXIF LensMake'),
+        lens_model=text('EXIF LensModel') or text('EXIF LensSpecification'),
+        f_number=f_number,
+        exposure_time=exposure_time,
+        iso=iso,
+        date_taken=text('EXIF DateTimeOriginal'),
+    )
+
+
+def read_exif(image_path):
+    """Read the EXIF record of an image, falling back to exifread for unusual files"""
+    try:
+        record = read_exif_header(image_path)
+        if record is not None:
+            return record
+    except (ExifFormatError, struct.error) as e:
+        print(f"Falling back to exifread for {image_path}: {e}")
+    return read_exif_exifread(image_path)
+
+
+def camera_name(record):
+    """Camera make and model, without repeating a make the model already starts with"""
+    camera_make = record.make or ""
+    camera_model = record.model or ""
+    if camera_make and camera_model and not camera_model.startswith(camera_make):
+        return f"{camera_make} {camera_model}"
+    return camera_model
+
+
+def lens_name(record):
+    """Lens make and model, without repeating a make the model already starts with"""
+    lens_make = record.lens_make or ""
+    lens_info = record.lens_model or ""
+    if lens_make and lens_info and not lens_info.startswith(lens_make):
+        return f"{lens_make} {lens_info}"
+    return lens_info
+
+
+def format_metadata(record):
+    """Format an EXIF record into the text fields printed on the composition"""
+    # Aperture
+    aperture = f"f/{float(record.f_number):.1f}" if record.f_number else ""
+
+    # Shutter speed
+    shutter = ""
+    if record.exposure_time:
+        if record.exposure_time < 1:
+            shutter = f"1/{int(1 / record.exposure_time)}s"
+        else:
+            shutter = f"{float(record.exposure_time):.1f}s"
+
+    # ISO
+    iso = f"ISO{record.iso}" if record.iso is not None else ""
+
+    # Format date and time
+    date_taken = record.date_taken
+    if date_taken:
+        try:
+            date_time_obj = datetime.strptime(date_taken, "%Y:%m:%d %H:%M:%S")
+            formatted_date = date_time_obj.strftime("%Y.%m.%d")
+            formatted_time = date_time_obj.strftime("%H:%M:%S")
+        except ValueError:
+            formatted_date = date_taken
+            formatted_time = ""
+    else:
+        now = datetime.now()
+        formatted_date = now.strftime("%Y.%m.%d")
+        formatted_time = now.strftime("%H:%M:%S")
+
+    return {
+        'camera_info': camera_name(record),
+        'lens_info': lens_name(record),
+        'aperture': aperture,
+        'shutter': shutter,
+        'iso': iso,
+        'date': formatted_date,
+        'time': formatted_time
+    }
+
+
+def read_exif_record(image_path):
+    """The EXIF record of an image, or an empty record if it cannot be read"""
+    try:
+        return read_exif(image_path)
+    except Exception as e:
+        print(f"Error extracting EXIF data: {e}")
+        return ExifRecord()
+
+
+def extract_metadata(image_path):
+    """Extract metadata from the image"""
+    return format_metadata(read_exif_record(image_path))
@@ -0,0 +1,312 @@
+"""Palette extraction backends.
+
+Every backend takes an (N, 3) array of sampled RGB pixels and the number of colors
+and returns its colors as an array of RGB rows. Approximate single-core cost for
+10 colors on the default 10,000-pixel sample:
+
+    gmm        ~600 ms Gaussian Mixture fit. Soft clustering gives smooth, well-separated
+                       averages; the slowest backend and the historical default.
+    kmeans     ~35 ms  MiniBatchKMeans. Very close to the GMM palette on most photos,
+                       slightly more prone to splitting large flat areas.
+    mediancut  ~7 ms   Pillow median-cut quantize. Deterministic and fast; favours
+                       colors covering large areas, small accents can be lost.
+    octree     <1 ms   Pillow fast-octree quantize. Fastest Pillow method; colors snap to
+                       an octree grid, so gradients come out slightly posterized.
+    histogram  <1 ms   Pure NumPy 3D histogram (16 bins per channel), returning the mean
+                       color of the most populated bins. Cheapest, but neighbouring bins
+                       of one dominant color can both make the palette.
+
+scikit-learn takes about a second to import, so it is only imported by the backends
+that use it, on their first call.
+
+gmm_fit and kmeans_fit can also start from an earlier fit. PaletteFitter uses that to
+refit one sample at another color count from the nearest count fitted before, split
+or merged to the new count, which converges in a few iterations.
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# Regularisation added to the diagonal of the covariances, as GaussianMixture does
+GMM_REG_COVAR = 1e-6
+
+# A split cluster's two centers sit this many standard deviations either side of its
+# mean along its main axis: +-0.8 sigma are the means of the two halves of a normal
+# distribution, which leaves each half 1 - 0.8^2 of the variance along that axis
+SPLIT_SIGMAS = 0.8
+
+# Cluster weights, centers and (n, 3, 3) covariances of one fit
+Mixture = namedtuple('Mixture', ['weights', 'means', 'covariances'])
+
+
+def nearest_means(pixels, means):
+    """Index of the nearest mean for every pixel"""
+    distances = ((pixels[:, None, :] - means[None, :, :]) ** 2).sum(axis=2)
+    return distances.argmin(axis=1)
+
+
+def hard_mixture(sample_pixels, means):
+    """Weights and covariances of the clusters formed by assigning every pixel to its nearest mean"""
+    pixels = np.asarray(sample_pixels, dtype=np.float64)
+    means = np.array(means, dtype=np.float64)
+    labels = nearest_means(pixels, means)
+    overall = np.cov(pixels, rowvar=False)
+    covariances = []
+    for index in range(len(means)):
+        members = pixels[labels == index]
+        # Clusters too small for a covariance of their own borrow the sample's
+        covariances.append(np.cov(members, rowvar=False) if len(members) > 3 else overall)
+    # Keep every weight positive so no cluster starts out dead
+    counts = np.bincount(labels, minlength=len(means))
+    weights = (counts + 1) / (counts.sum() + len(means))
+    return Mixture(weights, means, np.array(covariances) + GMM_REG_COVAR * np.eye(3))
+
+
+def warm_start_mixture(mixture, num_colors):
+    """A starting mixture of num_colors clusters, split or merged from an earlier fit.
+
+    Growing splits the cluster contributing the largest squared error (weight times
+    total variance) in two along its main axis. Shrinking merges the two closest
+    centers into one cluster with the same mean and covariance as the pair.
+    """
+    weights, means, covariances = (np.array(part, dtype=np.float64) for part in mixture)
+    while len(means) < num_colors:
+        index = (weights * np.trace(covariances, axis1=1, axis2=2)).argmax()
+        variances, axes = np.linalg.eigh(covariances[index])
+        offset = axes[:, -1] * np.sqrt(max(variances[-1], 0.0)) * SPLIT_SIGMAS
+        covariance = covariances[index] - np.outer(offset, offset)
+        weights[index] /= 2
+        weights = np.append(weights, weights[index])
+        means = np.vstack([means, means[index] + offset])
+        means[index] -= offset
+        covariances[index] = covariance
+        covariances = np.concatenate([covariances, covariance[None]])
+    while len(means) > num_colors:
+        gaps = ((means[:, None, :] - means[None, :, :]) ** 2).sum(axis=2)
+        gaps[np.diag_indices(len(means))] = np.inf
+        i, j = np.unravel_index(gaps.argmin(), gaps.shape)
+        weight = weights[i] + weights[j]
+        mean = (weights[i] * means[i] + weights[j] * means[j]) / weight
+        covariances[i] = sum(weights[k] * (covariances[k] + np.outer(means[k] - mean, means[k] - mean))
+                             for k in (i, j)) / weight
+        weights[i], means[i] = weight, mean
+        weights, means, covariances = (np.delete(part, j, axis=0) for part in (weights, means, covariances))
+    return Mixture(weights / weights.sum(), means, covariances)
+
+
+def check_each_step(estimator, method, check_cancelled):
+    """Call check_cancelled() before every call of an estimator's per-iteration method.
+
+    scikit-learn has no progress callback, so this wraps a private method on the
+    instance; check_cancelled raises to abandon the fit. A no-op if the method is missing.
+    """
+    if check_cancelled is None or not hasattr(estimator, method):
+        return
+    step = getattr(estimator, method)
+
+    def checked_step(*args, **kwargs):
+        check_cancelled()
+        return step(*args, **kwargs)
+
+    setattr(estimator, method, checked_step)
+
+
+def gmm_fit(sample_pixels, num_colors, init=None, check_cancelled=None):
+    """Fit a Gaussian Mixture Model, from scratch or from a starting Mixture; return the fitted Mixture"""
+    from sklearn.mixture import GaussianMixture
+
+    if init is None:
+        gmm = GaussianMixture(n_components=num_colors, random_state=42)
+    else:
+        # Start every parameter from init, which skips the k-means initialisation
+        gmm = GaussianMixture(n_components=num_colors, random_state=42, init_params='random_from_data',
+                              weights_init=init.weights, means_init=init.means,
+                              precisions_init=np.linalg.inv(init.covariances))
+    # One M-step per EM iteration
+    check_each_step(gmm, '_m_step', check_cancelled)
+    gmm.fit(sample_pixels)
+    return Mixture(gmm.weights_, gmm.means_, gmm.covariances_)
+
+
+def gmm_palette(sample_pixels, num_colors):
+    """Cluster centers of a Gaussian Mixture Model"""
+    return gmm_fit(sample_pixels, num_colors).means
+
+
+def kmeans_fit(sample_pixels, num_colors, init=None, check_cancelled=None):
+    """Fit mini-batch k-means, from scratch or from a starting Mixture's centers; return the cluster centers"""
+    from sklearn.cluster import MiniBatchKMeans
+
+    if init is None:
+        kmeans = MiniBatchKMeans(n_clusters=num_colors, random_state=42, n_init=3)
+    else:
+        kmeans = MiniBatchKMeans(n_clusters=num_colors, random_state=42, n_init=1,
+                                 init=np.asarray(init.means, dtype=np.float32))
+    # One convergence check per mini-batch step
+    check_each_step(kmeans, '_mini_batch_convergence', check_cancelled)
+    kmeans.fit(sample_pixels.astype(np.float32))
+    return kmeans.cluster_centers_
+
+
+def kmeans_palette(sample_pixels, num_colors):
+    """Cluster centers of mini-batch k-means"""
+    return kmeans_fit(sample_pixels, num_colors)
+
+
+def _quantize_palette(sample_pixels, num_colors, method):
+    # Pillow quantizes images, so lay the sample out as a single-row image
+    strip = Image.fromarray(np.ascontiguousarray(sample_pixels, dtype=np.uint8).reshape(1, -1, 3), 'RGB')
+    quantized = strip.quantize(colors=num_colors, method=method)
+
+    # Only return palette entries that are actually used, most frequent first
+    counts = np.bincount(np.asarray(quantized).ravel(), minlength=num_colors)
+    palette = np.array(quantized.getpalette()[:3 * len(counts)]).reshape(-1, 3)
+    used = [index for index in np.argsort(-counts, kind='stable') if counts[index] > 0]
+    return palette[used[:num_colors]]
+
+
+def mediancut_palette(sample_pixels, num_colors):
+    """Pillow median-cut quantization"""
+    return _quantize_palette(sample_pixels, num_colors, Image.Quantize.MEDIANCUT)
+
+
+def octree_palette(sample_pixels, num_colors):
+    """Pillow fast-octree quantization"""
+    return _quantize_palette(sample_pixels, num_colors, Image.Quantize.FASTOCTREE)
+
+
+def histogram_palette(sample_pixels, num_colors, bins_per_channel=16):
+    """Mean colors of the most populated cells of a 3D color histogram"""
+    sample_pixels = np.asarray(sample_pixels, dtype=np.uint8)
+    shift = 8 - int(np.log2(bins_per_channel))
+    cells = sample_pixels >> shift
+    cell_index = (cells[:, 0].astype(np.int64) * bins_per_channel + cells[:, 1]) * bins_per_channel + cells[:, 2]
+
+    # Count pixels and sum their colors per cell in one pass each
+    num_cells = bins_per_channel ** 3
+    counts = np.bincount(cell_index, minlength=num_cells)
+    sums = np.stack([np.bincount(cell_index, weights=sample_pixels[:, c], minlength=num_cells) for c in range(3)], axis=1)
+
+    top = np.argsort(-counts, kind='stable')[:num_colors]
+    top = top[counts[top] > 0]
+    return sums[top] / counts[top, None]
+
+
+PALETTE_BACKENDS = {
+    'gmm': gmm_palette,
+    'kmeans': kmeans_palette,
+    'mediancut': mediancut_palette,
+    'octree': octree_palette,
+    'histogram': histogram_palette,
+}
+# Backends that can start from an earlier fit: name -> fit(sample, num_colors, init, check_cancelled)
+WARM_START_FITS = {
+    'gmm': gmm_fit,
+    'kmeans': kmeans_fit,
+}
+DEFAULT_BACKEND = 'gmm'
+DEFAULT_SEED = 42
+
+
+def check_backend(backend):
+    if backend not in PALETTE_BACKENDS:
+        raise ValueError(f"Unknown palette backend {backend!r}, choose from {', '.join(PALETTE_BACKENDS)}")
+
+
+def draw_sample(pixels, sample_size=10000, seed=DEFAULT_SEED):
+    """A (sample_size, 3) random sample of an RGB pixel buffer"""
+    # Reshape the image to be a list of pixels
+    pixels = pixels.reshape(-1, 3)
+
+    # Reduce the size of the pixel list for faster processing; a fixed seed keeps the
+    # palette reproducible, which the persistent cache relies on
+    sample_size = min(sample_size, len(pixels))
+    indices = np.random.default_rng(seed).choice(len(pixels), size=sample_size, replace=False)
+    return pixels[indices]
+
+
+def to_colors(cluster_colors):
+    """Convert cluster centers to integer RGB tuples"""
+    return [tuple(map(int, color)) for color in cluster_colors]
+
+
+def extract_palette(pixels, num_colors=10, sample_size=10000, backend=DEFAULT_BACKEND, seed=DEFAULT_SEED):
+    """Extract dominant colors from an RGB pixel buffer with the selected backend"""
+    check_backend(backend)
+    return to_colors(PALETTE_BACKENDS[backend](draw_sample(pixels, sample_size, seed), num_colors))
+
+
+class PaletteFitter:
+    """Fits one pixel sample at any number of colors, reusing earlier fits.
+
+    The sample is drawn once, on the first fit, from load_pixels(). Fits are memoised
+    per color count. With the gmm and kmeans backends a new count starts from the
+    fit of the nearest count so far, split or merged to the new count
+    (warm_start_mixture), so stepping the count up or down takes a few iterations
+    instead of a cold fit. The first fit is cold and matches extract_palette.
+
+    check_cancelled, if given, is called before the sample is loaded, before a fit and
+    between the iterations of the gmm and kmeans fits, and raises to abandon the work.
+    """
+
+    def __init__(self, load_pixels, sample_size=10000, backend=DEFAULT_BACKEND, seed=DEFAULT_SEED):
+        check_backend(backend)
+        self.load_pixels = load_pixels
+        self.sample_size = sample_size
+        self.backend = backend
+        self.seed = seed
+        self.sample = None
+        self.fits = {}           # num_colors -> cluster centers
+        self.mixtures = {}       # num_colors -> Mixture, for the counts a refit can start from
+        self.warm_started = set()
+        self._lock = threading.Lock()
+
+    def load_sample(self, check_cancelled=None):
+        """Draw the pixel sample now if that has not happened yet"""
+        with self._lock:
+            if self.sample is None:
+                if check_cancelled is not None:
+                    check_cancelled()
+                self.sample = draw_sample(self.load_pixels(), self.sample_size, self.seed)
+
+    def add_fit(self, num_colors, colors):
+        """Remember a palette fitted elsewhere (e.g. from the persistent cache) as a starting point"""
+        with self._lock:
+            if num_colors not in self.fits and len(colors) == num_colors:
+                self.fits[num_colors] = np.asarray(colors, dtype=np.float64)
+
+    def is_warm(self, num_colors):
+        """Whether the fit for num_colors was warm-started, so it may differ from a cold fit"""
+        return num_colors in self.warm_started
+
+    def _mixture(self, num_colors):
+        if num_colors not in self.mixtures:
+            # Fits that only kept their centers get weights and covariances from the sample
+            self.mixtures[num_colors] = hard_mixture(self.sample, self.fits[num_colors])
+        return self.mixtures[num_colors]
+
+    def fit(self, num_colors, check_cancelled=None):
+        """Palette colors for num_colors, fitted now or served from an earlier fit"""
+        self.load_sample(check_cancelled)
+        with self._lock:
+            if num_colors not in self.fits:
+                if check_cancelled is not None:
+                    check_cancelled()
+                fit = WARM_START_FITS.get(self.backend)
+                init = None
+                if fit is not None and self.fits and num_colors <= len(self.sample):
+                    nearest = min(self.fits, key=lambda count: (abs(count - num_colors), -count))
+                    init = warm_start_mixture(self._mixture(nearest), num_colors)
+                if fit is None:
+                    result = PALETTE_BACKENDS[self.backend](self.sample, num_colors)
+                else:
+                    result = fit(self.sample, num_colors, init=init, check_cancelled=check_cancelled)
+                if init is not None:
+                    self.warm_started.add(num_colors)
+                if isinstance(result, Mixture):
+                    self.mixtures[num_colors] = result
+                    result = result.means
+                self.fits[num_colors] = np.asarray(result, dtype=np.float64)
+            return to_colors(self.fits[num_colors])
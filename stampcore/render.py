@@ -0,0 +1,117 @@
+import threading
+
+from PIL import Image, ImageDraw
+
+from .layout import compute_layout
+from .shadow import draw_shadow
+from .timing import span
+
+
+def render_base_layer(asset, layout, shadow):
+    """White canvas with the drop shadow and the resized photo"""
+    x_position, y_position, new_width, new_height = layout.image_box
+
+    # Create the white background canvas
+    canvas = Image.new('RGB', layout.canvas_size, color=(255, 255, 255))
+
+    # Add shadow if requested
+    if shadow:
+        with span("shadow"):
+            draw_shadow(canvas, (x_position, y_position), (new_width, new_height))
+
+    # Paste the resized image onto the white canvas (cached on the asset, so repeated previews reuse it)
+    canvas.paste(asset.proxy((new_width, new_height)), (x_position, y_position))
+    return canvas
+
+
+def render_palette_layer(colors_to_use, layout):
+    """The color boxes as an RGB strip plus the mask of the pixels they cover"""
+    _, _, palette_total_width, palette_height = layout.palette_box
+    strip = Image.new('RGB', (palette_total_width + 1, palette_height + 1))
+    mask = Image.new('L', strip.size, 0)
+    strip_draw = ImageDraw.Draw(strip)
+    mask_draw = ImageDraw.Draw(mask)
+
+    # Draw color boxes side by side across the padded width
+    palette_box_width = palette_total_width / len(colors_to_use) if colors_to_use else 0
+    for i, color in enumerate(colors_to_use):
+        left = i * palette_box_width
+        right = (i + 1) * palette_box_width
+        strip_draw.rectangle([left, 0, right, palette_height], fill=color)
+        mask_draw.rectangle([left, 0, right, palette_height], fill=255)
+    return strip, mask
+
+
+def render_text_layer(metadata, font, layout):
+    """Coverage mask of the metadata text, cropped to the text, with its canvas offset"""
+    mask = Image.new('L', layout.canvas_size, 0)
+    draw = ImageDraw.Draw(mask)
+    metadata_center_y = layout.metadata_y
+
+    # Draw the camera and lens information (left side)
+    draw.text((20, metadata_center_y), metadata['camera_info'], fill=255, font=font)
+    draw.text((20, metadata_center_y + 40), metadata['lens_info'], fill=255, font=font)
+
+    # Draw the technical specs (right side)
+    tech_info = f"{metadata['aperture']} {metadata['shutter']} {metadata['iso']}".strip()
+    draw.text((layout.right_column_x, metadata_center_y), tech_info, fill=255, font=font)
+
+    # Draw the date and time on the same line (right side, below technical specs)
+    date_time_info = f"{metadata['date']} {metadata['time']}"
+    draw.text((layout.right_column_x, metadata_center_y + 40), date_time_info, fill=255, font=font)
+
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+    return (bbox[0], bbox[1]), mask.crop(bbox)
+
+
+class LayeredComposer:
+    """Builds compositions from cached layers, redrawing only the layers whose inputs changed.
+
+    The photo and shadow form the base layer; the palette strip and the metadata text are
+    separate layers stamped onto a copy of it. Toggling the shadow therefore skips the
+    text, and adding a color or changing the font leaves the resized photo untouched.
+    Compositions are serialized, so one composer can serve a preview and an export
+    running on different threads.
+    """
+
+    def __init__(self):
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def _layer(self, name, key, render):
+        cached = self._layers.get(name)
+        if cached is None or cached[0] != key:
+            with span(f"{name}_layer"):
+                cached = (key, render())
+            self._layers[name] = cached
+        return cached[1]
+
+    def compose(self, asset, metadata, colors_to_use, font, shadow=True, layout=None):
+        """Create a new image with metadata and color palette from a decoded image asset"""
+        with self._lock, span("compose"):
+            layout = layout or compute_layout(asset.size)
+            colors_to_use = tuple(tuple(color) for color in colors_to_use)
+
+            base = self._layer('base', (asset, layout, shadow),
+                               lambda: render_base_layer(asset, layout, shadow))
+            palette = self._layer('palette', (colors_to_use, layout),
+                                  lambda: render_palette_layer(colors_to_use, layout))
+            text = self._layer('text', (tuple(sorted(metadata.items())), font, layout),
+                               lambda: render_text_layer(metadata, font, layout))
+
+            with span("stamp_layers"):
+                canvas = base.copy()
+                if colors_to_use:
+                    strip, mask = palette
+                    canvas.paste(strip, layout.palette_box[:2], mask)
+                if text is not None:
+                    (text_x, text_y), text_mask = text
+                    canvas.paste((0, 0, 0), (text_x, text_y, text_x + text_mask.width, text_y + text_mask.height), text_mask)
+            return canvas
+
+
+def create_composition(asset, metadata, colors_to_use, font, shadow=True, layout=None):
+    """Create a new image with metadata and color palette from a decoded image asset"""
+    return LayeredComposer().compose(asset, metadata, colors_to_use, font, shadow=shadow, layout=layout)
@@ -0,0 +1,275 @@
+"""Bounded-memory pixel sampling for very large images.
+
+Pixels are streamed in chunks (memory-mapped strips or tiles of uncompressed TIFFs,
+decoded row bands of everything else) and only the pixels picked for the sample are
+ever converted to 8-bit RGB, so memory grows with the sample size rather than the
+image size.
+"""
+import math
+
+import numpy as np
+from PIL import Image
+
+from .palette import DEFAULT_SEED
+
+# Rows per band when streaming an image Pillow has to decode
+BAND_ROWS = 256
+
+# Raw bytes read per band when streaming uncompressed rows, and columns converted at once
+RAW_BAND_BYTES = 8 * 1024 * 1024
+REDUCE_BLOCK_COLUMNS = 2048
+
+# Raw TIFF sample layouts that can be read straight from a memory map:
+# Pillow rawmode -> (NumPy dtype, channels)
+MEMMAP_RAWMODES = {
+    'L': ('u1', 1),
+    'RGB': ('u1', 3),
+    'RGBA': ('u1', 4),
+    'RGBX': ('u1', 4),
+    'I;16': ('<u2', 1),
+    'I;16B': ('>u2', 1),
+    'RGB;16L': ('<u2', 3),
+    'RGB;16B': ('>u2', 3),
+    'RGBA;16L': ('<u2', 4),
+    'RGBA;16B': ('>u2', 4),
+}
+
+
+def to_rgb8(pixels):
+    """Convert (N, channels) gray, RGB or RGBA pixels of 8 or 16 bits to (N, 3) uint8 RGB"""
+    if pixels.dtype.itemsize == 2:
+        # Keep the high byte, as Pillow does when it loads 16-bit images
+        pixels = (pixels >> 8).astype(np.uint8)
+    if pixels.shape[1] == 1:
+        return np.repeat(pixels, 3, axis=1)
+    return np.ascontiguousarray(pixels[:, :3], dtype=np.uint8)
+
+
+class ReservoirSampler:
+    """Uniform sample without replacement from a stream of pixel chunks.
+
+    Uses Li's Algorithm L: after the reservoir is filled it jumps straight to the next
+    pixel to take, with geometrically distributed gaps, so only O(k log(N / k)) pixels
+    are ever touched or converted for a sample of k out of N.
+    """
+
+    def __init__(self, sample_size, seed=DEFAULT_SEED):
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.reservoir = np.zeros((sample_size, 3), dtype=np.uint8)
+        self.filled = 0
+        self.seen = 0
+        self._w = 1.0
+        self._next = 0
+
+    def _uniform(self):
+        # In (0, 1], so the logarithms below stay finite
+        return 1.0 - self.rng.random()
+
+    def _skip(self):
+        return math.floor(math.log(self._uniform()) / math.log1p(-self._w)) + 1
+
+    def add(self, chunk):
+        """Offer a (rows, width, channels) chunk of pixels, in stream order"""
+        rows, width = chunk.shape[:2]
+        start, end = self.seen, self.seen + rows * width
+        flat = chunk.reshape(rows, width, -1)
+
+        def gather(indices):
+            indices = np.asarray(indices, dtype=np.int64) - start
+            return to_rgb8(flat[indices // width, indices % width])
+
+        if self.filled < self.sample_size:
+            take = min(self.sample_size - self.filled, end - start)
+            self.reservoir[self.filled:self.filled + take] = gather(np.arange(start, start + take))
+            self.filled += take
+            if self.filled == self.sample_size:
+                self._w = math.exp(math.log(self._uniform()) / self.sample_size)
+                self._next = start + take - 1 + self._skip()
+
+        if self.filled == self.sample_size:
+            # Later picks overwrite earlier ones that land in the same slot
+            picks = {}
+            while self._next < end:
+                picks[int(self.rng.random() * self.sample_size)] = self._next
+                self._w *= math.exp(math.log(self._uniform()) / self.sample_size)
+                self._next += self._skip()
+            if picks:
+                slots = np.fromiter(picks.keys(), dtype=np.int64, count=len(picks))
+                self.reservoir[slots] = gather(list(picks.values()))
+        self.seen = end
+
+    @property
+    def sample(self):
+        return self.reservoir[:self.filled]
+
+
+def _pixel_bytes(rawmode):
+    dtype, channels = MEMMAP_RAWMODES[rawmode]
+    return np.dtype(dtype).itemsize * channels
+
+
+def _raw_layouts(img):
+    """(extents, offset, rawmode, stride) of every strip or tile of uncompressed data, or None"""
+    layouts = []
+    for tile in img.tile:
+        codec, extents, offset, args = tile
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if codec != 'raw' or rawmode not in MEMMAP_RAWMODES or orientation != 1:
+            return None
+        layouts.append((extents, offset, rawmode, stride))
+    return layouts
+
+
+def _memmap_blocks(img, path, layouts):
+    """Yield ((x0, y0), pixels) views of the strips or tiles described by layouts"""
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    for (x0, y0, x1, y1), offset, rawmode, stride in layouts:
+        dtype, channels = MEMMAP_RAWMODES[rawmode]
+        pixel_bytes = _pixel_bytes(rawmode)
+        width, rows = x1 - x0, y1 - y0
+        stride = stride or width * pixel_bytes
+        # Tiles on the right and bottom edges are padded past the image in the file
+        rows = min(rows, img.height - y0)
+        width = min(width, img.width - x0)
+        block = data[offset:offset + rows * stride].reshape(rows, stride)
+        yield (x0, y0), block[:, :width * pixel_bytes].view(dtype).reshape(rows, width, channels)
+
+
+def _memmap_chunks(img, path):
+    """Yield views of an uncompressed TIFF's strips or tiles, or None if it has other data"""
+    layouts = _raw_layouts(img)
+    if layouts is None:
+        return None
+    return (block for _, block in _memmap_blocks(img, path, layouts))
+
+
+def can_stream_rows(path):
+    """Whether iter_raw_rows can read the file without decoding it"""
+    with Image.open(path) as img:
+        return _raw_layouts(img) is not None
+
+
+def _read_block(f, offset, rows, width, rawmode, stride):
+    dtype, channels = MEMMAP_RAWMODES[rawmode]
+    pixel_bytes = _pixel_bytes(rawmode)
+    stride = stride or width * pixel_bytes
+    f.seek(offset)
+    data = np.fromfile(f, dtype=np.uint8, count=rows * stride)
+    return data.reshape(rows, stride)[:, :width * pixel_bytes].view(dtype).reshape(rows, width, channels)
+
+
+def iter_raw_rows(path):
+    """Yield full-width (rows, width, channels) bands of an uncompressed file, top to bottom.
+
+    The data is read rather than memory-mapped, so pages already consumed do not stay
+    resident. Adjacent strips are read together up to RAW_BAND_BYTES; tiles are
+    assembled one tile row at a time.
+    """
+    with Image.open(path) as img:
+        layouts = _raw_layouts(img)
+        if layouts is None:
+            raise ValueError(f"{path} has no uncompressed pixel data to stream")
+        width, height = img.size
+    layouts.sort(key=lambda layout: (layout[0][1], layout[0][0]))
+
+    with open(path, 'rb') as f:
+        run = None  # (offset, rows, rawmode, stride) of adjacent full-width strips
+        band, band_y = None, None
+        for (x0, y0, x1, y1), offset, rawmode, stride in layouts:
+            rows = min(y1, height) - y0
+            if x0 == 0 and x1 >= width:
+                row_bytes = stride or width * _pixel_bytes(rawmode)
+                if run and run[2:] == (rawmode, stride) and run[0] + run[1] * row_bytes == offset \
+                        and (run[1] + rows) * row_bytes <= RAW_BAND_BYTES:
+                    run = (run[0], run[1] + rows, rawmode, stride)
+                    continue
+                if run:
+                    yield _read_block(f, run[0], run[1], width, run[2], run[3])
+                run = (offset, rows, rawmode, stride)
+                continue
+
+            block = _read_block(f, offset, rows, min(x1, width) - x0, rawmode, stride)
+            if band is None or band_y != y0:
+                if band is not None:
+                    yield band
+                band, band_y = np.empty((rows, width, block.shape[2]), dtype=block.dtype), y0
+            band[:, x0:x0 + block.shape[1]] = block
+        if run:
+            yield _read_block(f, run[0], run[1], width, run[2], run[3])
+        if band is not None:
+            yield band
+
+
+def reduce_streamed(path, factor):
+    """An uncompressed image box-reduced by an integer factor, read band by band.
+
+    Rows are read RAW_BAND_BYTES at a time and converted to 8-bit RGB in blocks of
+    REDUCE_BLOCK_COLUMNS columns, so memory stays at a few bands however tall the
+    image is (a band is at least factor rows, so it grows with very wide images).
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+    reduced = Image.new('RGB', (-(-width // factor), -(-height // factor)))
+    block_columns = max(factor, REDUCE_BLOCK_COLUMNS // factor * factor)
+    pending, pending_rows, top = [], 0, 0
+
+    def flush(rows):
+        # Reduce the first rows (a multiple of factor, except at the bottom edge); keep the rest
+        nonlocal pending, pending_rows, top
+        band = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        for left in range(0, width, block_columns):
+            block = band[:rows, left:left + block_columns]
+            pixels = to_rgb8(block.reshape(-1, block.shape[2])).reshape(rows, block.shape[1], 3)
+            reduced.paste(Image.fromarray(pixels).reduce(factor), (left // factor, top))
+        top += -(-rows // factor)
+        pending = [band[rows:]] if rows < len(band) else []
+        pending_rows = len(band) - rows
+
+    for rows in iter_raw_rows(path):
+        pending.append(rows)
+        pending_rows += len(rows)
+        if pending_rows >= factor:
+            flush(pending_rows - pending_rows % factor)
+    if pending_rows:
+        flush(pending_rows)
+    return reduced
+
+
+def _image_bands(image):
+    """Yield row bands of a decoded Pillow image as arrays"""
+    for top in range(0, image.height, BAND_ROWS):
+        yield np.asarray(image.crop((0, top, image.width, min(image.height, top + BAND_ROWS))))
+
+
+def iter_pixel_chunks(source, low_memory=False):
+    """Yield (rows, width, channels) pixel chunks of an image file or decoded Pillow image.
+
+    Uncompressed TIFFs are memory-mapped and read strip by strip or tile by tile without
+    decoding. Other files are decoded by Pillow and handed out in row bands, so no
+    flattened or converted copy of the whole image is made. With low_memory=True
+    uncompressed files are read band by band instead of mapped, so the pages touched
+    by the sampler do not accumulate in the resident set.
+    """
+    if isinstance(source, Image.Image):
+        yield from _image_bands(source if source.mode in ('L', 'RGB', 'RGBA') else source.convert('RGB'))
+        return
+    if low_memory and can_stream_rows(source):
+        yield from iter_raw_rows(source)
+        return
+
+    with Image.open(source) as img:
+        chunks = _memmap_chunks(img, source) if img.format == 'TIFF' else None
+        if chunks is None:
+            if img.mode not in ('L', 'RGB', 'RGBA'):
+                img = img.convert('RGB')
+            chunks = _image_bands(img)
+        yield from chunks
+
+
+def sample_pixels(source, sample_size, seed=DEFAULT_SEED, low_memory=False):
+    """A uniform (sample_size, 3) uint8 reservoir sample of an image's pixels, streamed in bounded memory"""
+    sampler = ReservoirSampler(sample_size, seed=seed)
+    for chunk in iter_pixel_chunks(source, low_memory=low_memory):
+        sampler.add(chunk)
+    return sampler.sample
@@ -0,0 +1,47 @@
+"""Immutable render specs and the renderer that turns them into compositions.
+
+A RenderSpec captures everything a composition depends on, so it can be built on the
+Tk thread from the current widget values and rendered anywhere else: on a worker
+thread, or pickled to a pool process. Equal specs render identical images.
+"""
+from collections import namedtuple
+
+from .assets import ImageAsset
+from .fonts import load_font
+from .palette import DEFAULT_BACKEND
+from .render import LayeredComposer
+
+# colors None stamps the palette extracted with num_colors and backend (deterministic,
+# as palettes use a fixed seed); layout None lays the canvas out for the source size
+RenderSpec = namedtuple('RenderSpec', [
+    'source', 'colors', 'font_path', 'font_size', 'shadow', 'layout', 'num_colors', 'backend',
+], defaults=(None, None, 24, True, None, 10, DEFAULT_BACKEND))
+
+
+def make_spec(source, colors=None, **options):
+    """A RenderSpec with colors normalized to hashable integer RGB tuples"""
+    if colors is not None:
+        colors = tuple(tuple(int(channel) for channel in color) for color in colors)
+    return RenderSpec(source, colors, **options)
+
+
+def resolve_colors(spec, asset):
+    """The spec with its palette extracted from the asset if it did not name colors"""
+    if spec.colors is not None:
+        return spec
+    colors = asset.palette(num_colors=spec.num_colors, backend=spec.backend)
+    return spec._replace(colors=tuple(tuple(color) for color in colors))
+
+
+def render_spec(spec, asset=None, composer=None, cache=None):
+    """Compose the image a RenderSpec describes.
+
+    Only reads the source file, through the given asset if it is already open. Pass the
+    same composer across calls to redraw only the layers whose inputs changed.
+    """
+    if asset is None or asset.path != spec.source:
+        asset = ImageAsset(spec.source, cache=cache)
+    spec = resolve_colors(spec, asset)
+    font = load_font(spec.font_path, spec.font_size)
+    composer = composer or LayeredComposer()
+    return composer.compose(asset, asset.metadata, spec.colors, font, shadow=spec.shadow, layout=spec.layout)
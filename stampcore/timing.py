@@ -0,0 +1,231 @@
+"""Lightweight timing spans for the pipeline stages.
+
+Wrap a stage in `with span("name"):`. While recording is off, span() returns a shared
+no-op context manager after a single flag check, so instrumented code costs a few
+hundred nanoseconds per stage. Once enabled, finished spans are kept in a bounded
+ring buffer, optionally appended to a JSON-lines log as they end, and can be exported
+as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev).
+
+Recording can be switched on without code changes through the environment:
+
+    COLORSTAMP_TRACE=trace.json      write a Chrome trace of the session on exit
+    COLORSTAMP_TRACE_LOG=spans.jsonl append one JSON object per finished span
+    COLORSTAMP_TRACE_MEMORY=1        attach the peak resident set size to every span
+
+Peak memory comes from the kernel's high-water mark (VmHWM), which each span restarts
+through /proc/self/clear_refs on Linux. The counter is process-wide: a span's peak
+includes whatever other threads allocated at the same time, and where the mark cannot
+be reset (other systems) it is the peak of the process so far.
+"""
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+# One finished span; start and duration are perf_counter_ns() values
+Span = namedtuple('Span', ['name', 'start_ns', 'duration_ns', 'pid', 'thread', 'args'])
+
+DEFAULT_CAPACITY = 10000
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class SpanRecorder:
+    """Collects finished spans from every thread into a bounded buffer"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.enabled = False
+        self.track_memory = False
+        self.spans = deque(maxlen=capacity)
+        self._log = None
+        self._lock = threading.Lock()
+        self._memory_lock = threading.Lock()
+        self._open_spans = []
+
+    def enable(self, log_path=None, memory=None):
+        """Start recording, appending each finished span to log_path as JSON lines if given.
+
+        memory=True attaches peak_rss_mb and peak_growth_mb to every span (None keeps the
+        current setting).
+        """
+        with self._lock:
+            if log_path and self._log is None:
+                self._log = open(log_path, 'a', encoding='utf-8')
+            if memory is not None:
+                self.track_memory = memory
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def record(self, span):
+        self.spans.append(span)
+        if self._log is not None:
+            line = json.dumps(log_record(span))
+            with self._lock:
+                if self._log is not None:
+                    self._log.write(line + "\n")
+                    self._log.flush()
+
+    def recent(self, count=None):
+        """The most recently finished spans, oldest first"""
+        spans = list(self.spans)
+        return spans if count is None else spans[-count:]
+
+    def drain(self):
+        """Remove and return every recorded span (used to ship spans out of worker processes)"""
+        spans = []
+        while True:
+            try:
+                spans.append(self.spans.popleft())
+            except IndexError:
+                return spans
+
+    def clear(self):
+        self.spans.clear()
+
+    def open_memory_span(self, active):
+        """Restart the peak for a starting span, first crediting the peak so far to enclosing spans"""
+        with self._memory_lock:
+            rss, peak = read_memory()
+            for other in self._open_spans:
+                other.peak = max(other.peak, peak or 0)
+            reset_peak_rss()
+            active.rss_start = rss or 0
+            active.peak = rss or 0
+            self._open_spans.append(active)
+
+    def close_memory_span(self, active):
+        """Peak and peak growth over its start (MB) of a finishing span"""
+        with self._memory_lock:
+            _, peak = read_memory()
+            self._open_spans.remove(active)
+        peak = max(active.peak, peak or 0)
+        return {'peak_rss_mb': round(peak / 2**20, 1), 'peak_growth_mb': round((peak - active.rss_start) / 2**20, 1)}
+
+
+def read_memory():
+    """(resident, peak resident) bytes of this process; either is None where it cannot be read"""
+    try:
+        with open("/proc/self/status", encoding='ascii') as f:
+            status = f.read()
+    except OSError:
+        try:
+            import resource
+        except ImportError:
+            return None, None
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == 'darwin' else peak * 1024
+
+    values = {}
+    for line in status.splitlines():
+        if line.startswith(("VmRSS:", "VmHWM:")):
+            key, value = line.split(":", 1)
+            values[key] = int(value.split()[0]) * 1024
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+def reset_peak_rss():
+    """Restart the peak resident set size from the current one; False where that is not possible"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _ActiveSpan:
+    __slots__ = ('recorder', 'name', 'args', 'start_ns', 'rss_start', 'peak', 'tracks_memory')
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tracks_memory = self.recorder.track_memory
+        if self.tracks_memory:
+            self.recorder.open_memory_span(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        if self.tracks_memory:
+            self.args = dict(self.args, **self.recorder.close_memory_span(self))
+        if exc_type is not None:
+            self.args = dict(self.args, error=exc_type.__name__)
+        self.recorder.record(Span(self.name, self.start_ns, duration_ns, os.getpid(),
+                                  threading.current_thread().name, self.args))
+        return False
+
+
+recorder = SpanRecorder()
+
+
+def log_record(span):
+    """A span as a flat dict for structured (JSON-lines) logs"""
+    return {
+        'name': span.name, 'start_ms': span.start_ns / 1e6, 'duration_ms': span.duration_ns / 1e6,
+        'pid': span.pid, 'thread': span.thread, **span.args,
+    }
+
+
+def span(name, **args):
+    """Context manager timing one stage; args are attached to the recorded span"""
+    if not recorder.enabled:
+        return _NO_SPAN
+    return _ActiveSpan(recorder, name, args)
+
+
+def chrome_trace(spans):
+    """Spans as a Chrome trace event document ("X" complete events, microseconds)"""
+    events = []
+    thread_ids = {}
+    for s in spans:
+        tid = thread_ids.setdefault((s.pid, s.thread), len(thread_ids) + 1)
+        events.append({
+            'name': s.name, 'ph': 'X', 'ts': s.start_ns / 1000, 'dur': s.duration_ns / 1000,
+            'pid': s.pid, 'tid': tid, 'args': s.args,
+        })
+    for (pid, thread), tid in thread_ids.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path, spans=None):
+    """Write spans (default: everything recorded) to a Chrome trace JSON file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(recorder.recent() if spans is None else spans), f)
+
+
+def write_span_log(path, spans=None):
+    """Write spans (default: everything recorded) as JSON lines"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for s in recorder.recent() if spans is None else spans:
+            f.write(json.dumps(log_record(s)) + "\n")
+
+
+def enable_from_environment():
+    """Honour COLORSTAMP_TRACE, COLORSTAMP_TRACE_LOG and COLORSTAMP_TRACE_MEMORY; return the trace path, if any"""
+    trace_path = os.environ.get("COLORSTAMP_TRACE")
+    log_path = os.environ.get("COLORSTAMP_TRACE_LOG")
+    recorder.track_memory = os.environ.get("COLORSTAMP_TRACE_MEMORY", "") not in ("", "0")
+    if trace_path or log_path:
+        recorder.enable(log_path=log_path)
+    if trace_path:
+        atexit.register(write_chrome_trace, trace_path)
+    return trace_path
+
+
+enable_from_environment()
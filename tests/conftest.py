@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The entry points (batch.py, ...) live at the repository root, next to stampcore
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
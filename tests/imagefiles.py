@@ -0,0 +1,52 @@
+"""Helpers that write test images."""
+import struct
+
+import numpy as np
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+
+def write_strip_tiff(path, pixels, strip_rows=16):
+    """Write (height, width, 3) uint16 pixels as an uncompressed little-endian RGB TIFF in strips"""
+    height, width = pixels.shape[:2]
+    data = np.ascontiguousarray(pixels, dtype='<u2').tobytes()
+    row_bytes = width * 6
+    strips = -(-height // strip_rows)
+    offsets = [8 + i * strip_rows * row_bytes for i in range(strips)]
+    counts = [min(strip_rows, height - i * strip_rows) * row_bytes for i in range(strips)]
+
+    # Bits per sample, strip offsets and strip byte counts follow the pixel data, then the IFD
+    extra_offset = 8 + len(data)
+    offsets_offset = extra_offset + 6
+    counts_offset = offsets_offset + 4 * strips
+    ifd_offset = counts_offset + 4 * strips
+    extra = struct.pack('<3H', 16, 16, 16) + struct.pack(f'<{strips}I', *offsets) + struct.pack(f'<{strips}I', *counts)
+
+    tags = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 3, extra_offset), (259, 3, 1, 1),
+            (262, 3, 1, 2), (273, 4, strips, offsets_offset), (277, 3, 1, 3), (278, 4, 1, strip_rows),
+            (279, 4, strips, counts_offset), (284, 3, 1, 1)]
+    ifd = struct.pack('<H', len(tags))
+    for tag, kind, count, value in tags:
+        if kind == 3 and count == 1:
+            ifd += struct.pack('<HHIHH', tag, kind, count, value, 0)
+        else:
+            ifd += struct.pack('<HHII', tag, kind, count, value)
+    ifd += struct.pack('<I', 0)
+
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', ifd_offset) + data + extra + ifd)
+
+
+def synthetic_exif():
+    """EXIF of a FUJIFILM X-E4 shot, with every field the composition prints"""
+    exif = Image.Exif()
+    exif[0x010F] = "FUJIFILM"
+    exif[0x0110] = "X-E4"
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x829D] = IFDRational(56, 10)
+    exif_ifd[0x829A] = IFDRational(1, 250)
+    exif_ifd[0x8827] = 160
+    exif_ifd[0x9003] = "2024:08:19 15:45:19"
+    exif_ifd[0xA433] = "FUJIFILM"
+    exif_ifd[0xA434] = "XF27mmF2.8 R WR"
+    return exif
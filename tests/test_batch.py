@@ -0,0 +1,58 @@
+import os
+
+from PIL import Image
+
+from batch import collect_images, is_output_name, output_path_for, plan_outputs
+
+
+def touch_image(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', (8, 8)).save(path)
+    return path
+
+
+def test_output_next_to_the_source_by_default():
+    assert output_path_for("/photos/DSC1.jpg", None) == "/photos/DSC1_with_metadata.jpg"
+
+
+def test_output_mirrors_folders_below_the_source_root():
+    assert (output_path_for("/photos/x/DSC1.jpg", "/out", source_root="/photos")
+            == os.path.join("/out", "x", "DSC1_with_metadata.jpg"))
+    assert output_path_for("/photos/DSC1.jpg", "/out", source_root="/photos") == "/out/DSC1_with_metadata.jpg"
+
+
+def test_qualified_output_names_keep_the_source_extension():
+    assert output_path_for("/photos/a.PNG", "/out", qualify=True) == "/out/a_png_with_metadata.jpg"
+
+
+def test_same_names_in_different_folders_do_not_collide():
+    plan = plan_outputs(["/photos/x/DSC1.jpg", "/photos/y/DSC1.jpg"], "/out")
+    assert plan == {
+        "/photos/x/DSC1.jpg": "/out/x/DSC1_with_metadata.jpg",
+        "/photos/y/DSC1.jpg": "/out/y/DSC1_with_metadata.jpg",
+    }
+
+
+def test_same_stem_with_different_extensions_do_not_collide():
+    for output_dir in (None, "/out"):
+        plan = plan_outputs(["/photos/a.jpg", "/photos/a.png", "/photos/b.jpg"], output_dir)
+        assert len(set(plan.values())) == 3
+        assert os.path.basename(plan["/photos/a.jpg"]) == "a_jpg_with_metadata.jpg"
+        assert os.path.basename(plan["/photos/a.png"]) == "a_png_with_metadata.jpg"
+        assert os.path.basename(plan["/photos/b.jpg"]) == "b_with_metadata.jpg"
+
+
+def test_outputs_are_recognised():
+    assert is_output_name("/out/DSC1_with_metadata.jpg")
+    assert is_output_name("/out/DSC1_with_metadata_proxy.png")
+    assert not is_output_name("/photos/DSC1.jpg")
+
+
+def test_collect_images_skips_earlier_outputs_and_the_output_dir(tmp_path):
+    source = touch_image(str(tmp_path / "a.jpg"))
+    touch_image(str(tmp_path / "a_with_metadata.jpg"))
+    touch_image(str(tmp_path / "out" / "b.jpg"))
+    (tmp_path / "notes.txt").write_text("not an image")
+
+    assert collect_images([str(tmp_path)]) == [source]
+    assert collect_images([str(tmp_path / "**" / "*.jpg")], exclude_dir=str(tmp_path / "out")) == [source]
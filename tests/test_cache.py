@@ -0,0 +1,76 @@
+import os
+import shutil
+from fractions import Fraction
+
+import pytest
+from PIL import Image
+
+import stampcore.assets
+from imagefiles import synthetic_exif
+from stampcore.assets import ImageAsset
+from stampcore.cache import ResultCache
+from stampcore.metadata import ExifRecord, read_exif_record
+
+PARAMS = {'num_colors': 3, 'backend': 'kmeans'}
+COLORS = [(200, 40, 40), (10, 20, 30), (255, 255, 255)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache" / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def write_photo(path, color=(120, 80, 40), exif=None):
+    Image.new('RGB', (64, 48), color).save(path, exif=exif or Image.Exif())
+    return path
+
+
+def test_palette_round_trip_by_content(cache, tmp_path):
+    photo = write_photo(str(tmp_path / "a.jpg"))
+    assert cache.get_palette(photo, PARAMS) is None
+    cache.put_palette(photo, PARAMS, COLORS)
+    assert cache.get_palette(photo, PARAMS) == COLORS
+    # Keyed by content: a copy hits, other parameters miss
+    copy = shutil.copy(photo, str(tmp_path / "copy.jpg"))
+    assert cache.get_palette(copy, PARAMS) == COLORS
+    assert cache.get_palette(photo, dict(PARAMS, num_colors=4)) is None
+
+
+def test_changed_contents_miss(cache, tmp_path):
+    photo = write_photo(str(tmp_path / "a.jpg"), exif=synthetic_exif())
+    cache.put_palette(photo, PARAMS, COLORS)
+    cache.put_exif(photo, read_exif_record(photo))
+    stat = os.stat(photo)
+
+    # Rewritten in place with other pixels and no EXIF, with a new modification time
+    write_photo(photo, color=(10, 200, 10))
+    os.utime(photo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get_palette(photo, PARAMS) is None
+    assert cache.get_exif(photo) is None
+
+
+def test_exif_round_trip_keeps_rationals_exact(cache, tmp_path):
+    photo = write_photo(str(tmp_path / "a.jpg"))
+    record = ExifRecord(make="FUJIFILM", model="X-E4", f_number=Fraction(28, 10),
+                        exposure_time=Fraction(1, 3), iso=160)
+    cache.put_exif(photo, record)
+
+    cached = cache.get_exif(photo)
+    assert cached == record
+    assert isinstance(cached.exposure_time, Fraction) and cached.exposure_time == Fraction(1, 3)
+    assert cached.lens_model is None and cached.date_taken is None
+
+
+def test_metadata_is_read_from_the_cache(cache, tmp_path, monkeypatch):
+    photo = write_photo(str(tmp_path / "a.jpg"), exif=synthetic_exif())
+    metadata = ImageAsset(photo, cache=cache).metadata
+    assert cache.get_exif(photo) == read_exif_record(photo)
+
+    # A new asset for the same contents formats the cached record without reading the file
+    def fail(path):
+        raise AssertionError("EXIF read again")
+
+    monkeypatch.setattr(stampcore.assets, 'read_exif_record', fail)
+    assert ImageAsset(photo, cache=cache).metadata == metadata
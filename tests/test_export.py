@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from stampcore.export import EXPORT_PRESETS, export_canvas
+
+
+@pytest.fixture
+def canvas():
+    pixels = np.random.default_rng(0).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+@pytest.mark.parametrize("name, image_format", [("out.jpg", "JPEG"), ("out.png", "PNG"), ("out.webp", "WEBP"),
+                                                ("out.tif", "TIFF"), ("out.bmp", "BMP")])
+def test_single_export_takes_the_format_from_the_name(tmp_path, canvas, name, image_format):
+    path = str(tmp_path / name)
+    [result] = export_canvas(canvas, path, EXPORT_PRESETS['single'])
+    assert result.path == path and result.format == image_format
+    with Image.open(path) as written:
+        assert written.format == image_format
+        if image_format in ("PNG", "TIFF", "BMP"):
+            assert np.array_equal(np.asarray(written.convert('RGB')), np.asarray(canvas))
+
+
+def test_extension_without_a_writer_is_rejected_before_writing(tmp_path, canvas):
+    with pytest.raises(ValueError, match="no writer"):
+        export_canvas(canvas, str(tmp_path / "out.xyz"), EXPORT_PRESETS['single'])
+    assert os.listdir(tmp_path) == []
+
+
+def test_presets_write_every_target(tmp_path, canvas):
+    results = export_canvas(canvas, str(tmp_path / "out.tif"), EXPORT_PRESETS['publish'])
+    assert [os.path.basename(result.path) for result in results] == ["out.jpg", "out.webp", "out_proxy.png"]
+    assert all(os.path.getsize(result.path) == result.bytes for result in results)
@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+HEAVY_MODULES = ('sklearn', 'scipy', 'cv2', 'exifread', 'matplotlib')
+HEADLESS_FORBIDDEN = ('tkinter',) + HEAVY_MODULES
+
+PROBE = """
+import json, sys
+{statement}
+print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))
+"""
+
+
+def loaded_packages(statement):
+    """Top-level packages loaded after running statement in a fresh interpreter"""
+    output = subprocess.run([sys.executable, "-c", PROBE.format(statement=statement)], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    return set(json.loads(output.strip().splitlines()[-1]))
+
+
+@pytest.mark.parametrize("module, forbidden", [
+    ('stampcore', HEADLESS_FORBIDDEN),
+    ('stampcore.metadata', HEADLESS_FORBIDDEN + ('numpy', 'PIL')),
+    ('stampcore.layout', HEADLESS_FORBIDDEN + ('numpy', 'PIL')),
+    ('stampcore.spec', HEADLESS_FORBIDDEN),
+    ('batch', HEADLESS_FORBIDDEN),
+    ('server', HEADLESS_FORBIDDEN),
+    ('watch', HEADLESS_FORBIDDEN),
+    ('metadata_index', HEADLESS_FORBIDDEN),
+    ('ColorStamp', HEAVY_MODULES),
+])
+def test_cold_import_stays_light(module, forbidden):
+    assert loaded_packages(f"import {module}").isdisjoint(forbidden)
+
+
+def test_pool_worker_start_stays_light():
+    assert loaded_packages("import batch; batch.init_worker()").isdisjoint(HEADLESS_FORBIDDEN)
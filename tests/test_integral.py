@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from stampcore.integral import IntegralImage
+
+
+@pytest.fixture
+def pixels():
+    return np.random.default_rng(0).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+
+
+def test_sums_match_numpy(pixels):
+    integral = IntegralImage(pixels)
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        x0, x1 = sorted(rng.integers(0, 54, 2))
+        y0, y1 = sorted(rng.integers(0, 38, 2))
+        expected = pixels[y0:y1, x0:x1].reshape(-1, 3).sum(axis=0, dtype=np.uint64)
+        assert np.array_equal(integral.sum(x0, y0, x1, y1), expected)
+
+
+def test_boxes_are_clamped_and_ordered(pixels):
+    integral = IntegralImage(pixels)
+    whole = pixels.reshape(-1, 3).sum(axis=0, dtype=np.uint64)
+    assert np.array_equal(integral.sum(-10, -10, 100, 100), whole)
+    assert np.array_equal(integral.sum(53, 37, 0, 0), whole)
+    assert integral.mean(5, 5, 5, 9) is None
+
+
+def test_mean_of_a_box(pixels):
+    integral = IntegralImage(pixels)
+    box = pixels[3:11, 7:20].reshape(-1, 3).astype(np.uint64)
+    assert integral.mean(7, 3, 20, 11) == tuple(int(c) for c in box.sum(axis=0) // len(box))
+
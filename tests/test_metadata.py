@@ -0,0 +1,53 @@
+import glob
+import os
+from fractions import Fraction
+
+import pytest
+from PIL import Image
+
+from imagefiles import synthetic_exif
+from stampcore.metadata import ExifRecord, format_metadata, read_exif_exifread, read_exif_header
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "images")
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(IMAGES_DIR, "*"))), ids=os.path.basename)
+def test_header_reader_matches_exifread_on_sample_images(path):
+    assert read_exif_header(path) == read_exif_exifread(path)
+
+
+@pytest.mark.parametrize("extension", [".jpg", ".png", ".tif"])
+def test_header_reader_matches_exifread(tmp_path, extension):
+    path = str(tmp_path / ("exif" + extension))
+    Image.new('RGB', (64, 48), (120, 80, 40)).save(path, exif=synthetic_exif())
+    assert read_exif_header(path) == read_exif_exifread(path)
+
+
+@pytest.mark.parametrize("extension", [".jpg", ".png"])
+def test_header_reader_fields(tmp_path, extension):
+    path = str(tmp_path / ("exif" + extension))
+    Image.new('RGB', (64, 48), (120, 80, 40)).save(path, exif=synthetic_exif())
+    assert read_exif_header(path) == ExifRecord(make="FUJIFILM", model="X-E4", lens_make="FUJIFILM", lens_model="XF27mmF2.8 R WR",
+                                f_number=Fraction(28, 5), exposure_time=Fraction(1, 250), iso=160,
+                                date_taken="2024:08:19 15:45:19")
+
+
+def test_file_without_exif_gives_an_empty_record(tmp_path):
+    path = str(tmp_path / "plain.jpg")
+    Image.new('RGB', (16, 16)).save(path)
+    assert read_exif_header(path) == ExifRecord()
+
+
+def test_format_metadata():
+    record = ExifRecord(make="FUJIFILM", model="X-E4", lens_make="FUJIFILM", lens_model="FUJIFILM XF27mm",
+                        f_number=Fraction(28, 5), exposure_time=Fraction(1, 250), iso=160,
+                        date_taken="2024:08:19 15:45:19")
+    assert format_metadata(record) == {
+        'camera_info': "FUJIFILM X-E4",
+        'lens_info': "FUJIFILM XF27mm",
+        'aperture': "f/5.6",
+        'shutter': "1/250s",
+        'iso': "ISO160",
+        'date': "2024.08.19",
+        'time': "15:45:19",
+    }
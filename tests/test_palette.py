@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from stampcore.palette import PaletteFitter, extract_palette
+
+CENTERS = np.array([[230, 40, 40], [40, 200, 60], [40, 60, 220], [240, 230, 60], [20, 20, 20],
+                    [200, 200, 210], [150, 60, 180], [60, 190, 200]], dtype=np.float64)
+
+
+@pytest.fixture(scope="module")
+def pixels():
+    rng = np.random.default_rng(0)
+    clusters = CENTERS[rng.integers(0, len(CENTERS), 20000)] + rng.normal(0, 8, (20000, 3))
+    return np.clip(clusters, 0, 255).astype(np.uint8).reshape(100, 200, 3)
+
+
+@pytest.mark.parametrize("backend", ["gmm", "kmeans"])
+def test_refits_give_the_requested_color_count(pixels, backend):
+    fitter = PaletteFitter(lambda: pixels, sample_size=4000, backend=backend)
+    for num_colors in (5, 8, 3, 12, 2, 8):
+        colors = fitter.fit(num_colors)
+        assert len(colors) == num_colors
+        assert all(len(color) == 3 and all(0 <= channel <= 255 for channel in color) for color in colors)
+
+    assert not fitter.is_warm(5)
+    assert all(fitter.is_warm(num_colors) for num_colors in (8, 3, 12, 2))
+
+
+@pytest.mark.parametrize("backend", ["gmm", "kmeans"])
+def test_first_fit_is_cold(pixels, backend):
+    fitter = PaletteFitter(lambda: pixels, sample_size=4000, backend=backend)
+    assert fitter.fit(6) == extract_palette(pixels, num_colors=6, sample_size=4000, backend=backend)
+
+
+def test_warm_refit_finds_the_clusters(pixels):
+    fitter = PaletteFitter(lambda: pixels, sample_size=4000, backend="kmeans")
+    fitter.fit(4)
+    colors = np.array(fitter.fit(len(CENTERS)), dtype=np.float64)
+    assert fitter.is_warm(len(CENTERS))
+
+    # Every true cluster center has a palette color close by
+    distances = np.linalg.norm(CENTERS[:, None] - colors[None], axis=2).min(axis=1)
+    assert distances.max() < 20
+
+
+def test_sample_is_drawn_once(pixels):
+    loads = []
+    fitter = PaletteFitter(lambda: loads.append(1) or pixels, sample_size=4000, backend="mediancut")
+    fitter.fit(4)
+    fitter.fit(7)
+    assert len(loads) == 1
+    assert not fitter.is_warm(7)
+
+
+class Cancelled(Exception):
+    pass
+
+
+@pytest.mark.parametrize("backend", ["gmm", "kmeans"])
+def test_cancelled_fit_stops_between_iterations(pixels, backend):
+    calls = []
+
+    def check_cancelled():
+        calls.append(1)
+        if len(calls) > 3:
+            raise Cancelled()
+
+    fitter = PaletteFitter(lambda: pixels, sample_size=4000, backend=backend)
+    with pytest.raises(Cancelled):
+        fitter.fit(6, check_cancelled)
+    assert len(calls) == 4
+    assert 6 not in fitter.fits
+
+    # The abandoned fit leaves nothing behind, and checks that never fire change nothing
+    assert fitter.fit(6, lambda: None) == extract_palette(pixels, num_colors=6, sample_size=4000, backend=backend)
+    assert not fitter.is_warm(6)
+
+
+def test_cancelled_before_sampling_loads_nothing(pixels):
+    loads = []
+
+    def check_cancelled():
+        raise Cancelled()
+
+    fitter = PaletteFitter(lambda: loads.append(1) or pixels, sample_size=4000, backend="mediancut")
+    with pytest.raises(Cancelled):
+        fitter.fit(4, check_cancelled)
+    assert loads == [] and fitter.sample is None
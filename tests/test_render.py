@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagefiles import synthetic_exif
+from stampcore.assets import ImageAsset
+from stampcore.fonts import FontIndex
+from stampcore.render import LayeredComposer
+from stampcore.spec import make_spec, render_spec
+
+
+@pytest.fixture(scope="module")
+def photo(tmp_path_factory):
+    # A dated photo, so the text layer does not fall back to the current time between renders
+    path = str(tmp_path_factory.mktemp("render") / "photo.jpg")
+    x = np.linspace(0, 255, 640)[None, :, None]
+    y = np.linspace(0, 255, 420)[:, None, None]
+    pixels = np.concatenate([np.broadcast_to(x, (420, 640, 1)), np.broadcast_to(y, (420, 640, 1)),
+                             np.broadcast_to(255 - x, (420, 640, 1))], axis=2)
+    Image.fromarray(pixels.astype(np.uint8)).save(path, quality=92, exif=synthetic_exif())
+    return path
+
+
+def second_font():
+    index = FontIndex()
+    index.refresh()
+    return sorted(index.fonts)[0] if index.fonts else None
+
+
+def test_incremental_compose_matches_a_fresh_compose(photo):
+    red, green, blue = (200, 30, 30), (30, 200, 30), (30, 30, 200)
+    specs = [
+        make_spec(photo, colors=[red, green, blue]),
+        # Palette change
+        make_spec(photo, colors=[blue, red]),
+        # Text change
+        make_spec(photo, colors=[blue, red], font_size=30),
+        make_spec(photo, colors=[blue, red], font_size=30, font_path=second_font()),
+        # Shadow change, then back to the first composition
+        make_spec(photo, colors=[blue, red], font_size=30, shadow=False),
+        make_spec(photo, colors=[red, green, blue]),
+    ]
+    asset = ImageAsset(photo)
+    composer = LayeredComposer()
+    for spec in specs:
+        incremental = render_spec(spec, asset=asset, composer=composer)
+        fresh = render_spec(spec)
+        assert np.array_equal(np.asarray(incremental), np.asarray(fresh)), spec
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from stampcore.assets import ImageAsset
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "images", "example.jpg")
+
+# Same bounds as benchmarks/resize_quality.py, plus a PSNR floor
+MAX_MEAN_ERROR = 1.0
+MAX_P999_ERROR = 12
+MIN_PSNR = 38.0
+
+
+@pytest.fixture(scope="module")
+def sources(tmp_path_factory):
+    """The example photo as a JPEG (draft decoding) and upscaled as a JPEG and a PNG (pyramid)"""
+    directory = tmp_path_factory.mktemp("resize")
+    example = Image.open(EXAMPLE).convert('RGB')
+    large = example.resize((4096, round(4096 * example.height / example.width)), Image.LANCZOS)
+    paths = {'jpeg': EXAMPLE, 'large_jpeg': str(directory / "large.jpg"), 'large_png': str(directory / "large.png")}
+    large.save(paths['large_jpeg'], quality=95)
+    large.save(paths['large_png'], compress_level=1)
+    # Decode each source in full once, for the reference resizes
+    fulls = {}
+    for name, path in paths.items():
+        with Image.open(path) as img:
+            fulls[name] = img.convert('RGB')
+    return {name: (paths[name], fulls[name]) for name in paths}
+
+
+@pytest.mark.parametrize("source", ['jpeg', 'large_jpeg', 'large_png'])
+@pytest.mark.parametrize("target_width", [972, 500, 240])
+def test_reduced_resize_matches_full_lanczos(sources, source, target_width):
+    path, full = sources[source]
+    size = (target_width, round(target_width * full.height / full.width))
+    reference = np.asarray(full.resize(size, Image.LANCZOS), dtype=np.float64)
+    result = np.asarray(ImageAsset(path).proxy(size), dtype=np.float64)
+
+    error = np.abs(reference - result)
+    psnr = 10 * np.log10(255 ** 2 / max((error ** 2).mean(), 1e-12))
+    assert error.mean() <= MAX_MEAN_ERROR
+    assert np.percentile(error, 99.9) <= MAX_P999_ERROR
+    assert psnr >= MIN_PSNR
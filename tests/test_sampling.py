@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagefiles import write_strip_tiff
+from stampcore.sampling import ReservoirSampler, can_stream_rows, reduce_streamed, sample_pixels
+
+
+def indexed_pixels(count):
+    """Pixels whose RGB value encodes their position in the stream"""
+    index = np.arange(count)
+    return np.stack([index >> 16, (index >> 8) & 255, index & 255], axis=1).astype(np.uint8)
+
+
+def positions(sample):
+    sample = sample.astype(np.int64)
+    return (sample[:, 0] << 16) | (sample[:, 1] << 8) | sample[:, 2]
+
+
+def feed(sampler, pixels, width, chunk_rows):
+    image = pixels.reshape(-1, width, 3)
+    for top in range(0, len(image), chunk_rows):
+        sampler.add(image[top:top + chunk_rows])
+    return sampler.sample
+
+
+def test_sample_is_drawn_without_replacement():
+    pixels = indexed_pixels(200 * 300)
+    sample = feed(ReservoirSampler(500, seed=3), pixels, 300, 7)
+    assert sample.shape == (500, 3)
+    picked = positions(sample)
+    assert len(np.unique(picked)) == 500
+    assert picked.min() >= 0 and picked.max() < len(pixels)
+
+
+def test_short_stream_is_taken_whole():
+    pixels = indexed_pixels(40 * 10)
+    sample = feed(ReservoirSampler(1000), pixels, 10, 16)
+    assert np.array_equal(sample, pixels)
+
+
+def test_sample_does_not_depend_on_chunking():
+    pixels = indexed_pixels(100 * 120)
+    samples = [feed(ReservoirSampler(300, seed=5), pixels, 120, rows) for rows in (1, 13, 100)]
+    assert np.array_equal(samples[0], samples[1])
+    assert np.array_equal(samples[0], samples[2])
+
+
+def test_every_pixel_is_equally_likely():
+    count, size, runs = 2000, 100, 400
+    pixels = indexed_pixels(count)
+    hits = np.zeros(count)
+    for seed in range(runs):
+        hits[positions(feed(ReservoirSampler(size, seed=seed), pixels, 50, 5))] += 1
+
+    # Each pixel is picked with probability size / count, in every tenth of the stream alike
+    expected = runs * size / count
+    assert hits.mean() == pytest.approx(expected)
+    for part in np.array_split(hits, 10):
+        assert part.mean() == pytest.approx(expected, rel=0.1)
+
+def test_streamed_sample_matches_the_decoded_image(tmp_path):
+    path = str(tmp_path / "rgb8.tif")
+    pixels = np.random.default_rng(2).integers(0, 256, (300, 211, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, compression="raw")
+
+    # Memory-mapped strips, row bands and an in-memory image all yield the same pixel stream
+    expected = feed(ReservoirSampler(1000, seed=9), pixels.reshape(-1, 3), 211, 300)
+    for source, low_memory in ((path, False), (path, True), (Image.fromarray(pixels), False)):
+        assert np.array_equal(sample_pixels(source, 1000, seed=9, low_memory=low_memory), expected)
+
+@pytest.mark.parametrize("factor", [2, 3, 8])
+def test_reduce_streamed_matches_decode_then_reduce_8bit(tmp_path, factor):
+    path = str(tmp_path / "rgb8.tif")
+    pixels = np.random.default_rng(0).integers(0, 256, (203, 157, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, compression="raw")
+    assert can_stream_rows(path)
+
+    with Image.open(path) as img:
+        expected = img.convert('RGB').reduce(factor)
+    assert np.array_equal(np.asarray(reduce_streamed(path, factor)), np.asarray(expected))
+
+
+@pytest.mark.parametrize("factor", [2, 5])
+def test_reduce_streamed_matches_decode_then_reduce_16bit(tmp_path, factor):
+    path = str(tmp_path / "rgb16.tif")
+    write_strip_tiff(path, np.random.default_rng(1).integers(0, 65536, (150, 301, 3), dtype=np.uint16))
+    assert can_stream_rows(path)
+
+    with Image.open(path) as img:
+        expected = img.convert('RGB').reduce(factor)
+    assert np.array_equal(np.asarray(reduce_streamed(path, factor)), np.asarray(expected))
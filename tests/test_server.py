@@ -0,0 +1,40 @@
+import pytest
+
+from server import RenderService, RequestError
+
+
+@pytest.fixture(scope="module")
+def service():
+    # The worker pool only starts processes on its first job, which these tests never submit
+    service = RenderService(workers=1, queue_size=0)
+    yield service
+    service.close()
+
+
+def test_fonts_resolve_by_name_or_installed_path(service):
+    if not service.font_index.fonts:
+        pytest.skip("no fonts installed")
+    path = sorted(service.font_index.fonts)[0]
+    assert service.parse_options({'font': path})['font_path'] == path
+    assert service.parse_options({'font': path.rsplit('/', 1)[-1]})['font_path'] is not None
+
+
+def test_font_option_does_not_reveal_other_files(service, tmp_path):
+    existing = tmp_path / "secret.txt"
+    existing.write_text("not a font")
+    for font in (str(existing), str(tmp_path / "missing.ttf")):
+        with pytest.raises(RequestError) as error:
+            service.parse_options({'font': font})
+        assert error.value.status == 400
+
+
+def test_palette_accepts_hex_strings_and_rgb_lists(service):
+    assert service.parse_options({'palette': "#ff0000,00ff80"})['palette'] == [(255, 0, 0), (0, 255, 128)]
+    assert service.parse_options({'palette': ["#ff0000", [1, 2, 3]]})['palette'] == [(255, 0, 0), (1, 2, 3)]
+
+
+@pytest.mark.parametrize("palette", [[[1, 2]], [[1, 2, 300]], [[1.5, 2, 3]], [None], 5, "#ff00"])
+def test_malformed_palettes_are_bad_requests(service, palette):
+    with pytest.raises(RequestError) as error:
+        service.parse_options({'palette': palette})
+    assert error.value.status == 400
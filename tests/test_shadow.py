@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from stampcore.shadow import SHADOW_BLUR, SHADOW_OFFSET, draw_shadow, shadow_sprite
+
+# Largest difference in any channel from the original GaussianBlur shadow
+MAX_SHADOW_ERROR = 8
+
+
+def baseline_shadow(canvas, position, size, blur=SHADOW_BLUR, offset=SHADOW_OFFSET):
+    """The drop shadow as the original renderer drew it, with a full 2D GaussianBlur"""
+    width, height = size
+    shadow = Image.new('RGBA', (width + blur * 10, height + blur * 10), (0, 0, 0, 0))
+    mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask).rectangle([(0, 0), (width, height)], fill=256)
+    shadow.paste((0, 0, 0, 128), (blur, blur, blur + width, blur + height), mask)
+    shadow = shadow.filter(ImageFilter.GaussianBlur(blur))
+    canvas.paste(shadow, (position[0] - blur + offset, position[1] - blur + offset), shadow)
+
+
+def composed(draw, size, position=(60, 40), canvas_size=(700, 500)):
+    canvas = Image.new('RGB', canvas_size, (255, 255, 255))
+    draw(canvas, position, size)
+    canvas.paste(Image.new('RGB', size, (90, 120, 150)), position)
+    return np.asarray(canvas, dtype=np.int16)
+
+
+@pytest.mark.parametrize("size", [(400, 300), (300, 400), (97, 61)])
+def test_sprite_shadow_matches_gaussian_blur(size):
+    error = np.abs(composed(draw_shadow, size) - composed(baseline_shadow, size))
+    assert error.max() <= MAX_SHADOW_ERROR
+    assert error.mean() < 0.1
+
+
+def test_sprite_is_cached_per_size():
+    assert shadow_sprite(120, 80) is shadow_sprite(120, 80)
+    assert shadow_sprite(120, 80).size == (120 + SHADOW_BLUR * 10, 80 + SHADOW_BLUR * 10)
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from PIL import Image
+
+import batch
+import watch
+from watch import RenderLedger, has_stem_sibling
+
+SPEC_OPTIONS = {'num_colors': 3, 'backend': 'kmeans'}
+render_file = batch.render_file
+
+
+def touch_image(path, color=(200, 40, 40)):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', (64, 48), color).save(path)
+    return path
+
+
+def crash_on_marked(spec, output_path, *args):
+    # Stands in for render_file in the pool; kills the worker like a segfault or OOM kill would
+    if 'crash' in os.path.basename(spec.source):
+        os._exit(1)
+    return render_file(spec, output_path, *args)
+
+
+def run_watch(roots, output_dir, tmp_path, **kwargs):
+    reports = []
+    kwargs.setdefault('workers', 1)
+    counts = watch.watch(roots, output_dir, settle=0.05, poll=True, interval=0.05,
+                         ledger=RenderLedger(str(tmp_path / "ledger.sqlite3")), spec_options=SPEC_OPTIONS,
+                         use_cache=False, on_result=reports.append, max_idle=0.3, **kwargs)
+    return counts, reports
+
+
+@pytest.mark.parametrize("output", ["photos", "."])
+def test_output_dir_may_not_be_or_contain_a_root(tmp_path, output):
+    root = tmp_path / "photos"
+    root.mkdir()
+    with pytest.raises(ValueError):
+        watch.watch([str(root)], str(tmp_path / output), max_idle=0)
+
+
+def test_stem_siblings(tmp_path):
+    a_jpg = touch_image(str(tmp_path / "a.jpg"))
+    b_jpg = touch_image(str(tmp_path / "b.jpg"))
+    (tmp_path / "b.xmp").write_text("")
+    assert not has_stem_sibling(a_jpg)
+    touch_image(str(tmp_path / "a.png"))
+    assert has_stem_sibling(a_jpg)
+    # Sidecars are not images, so they do not clash with the output name
+    assert not has_stem_sibling(b_jpg)
+
+
+def test_outputs_are_not_rendered_and_contents_render_once(tmp_path):
+    root = tmp_path / "photos"
+    output_dir = root / "stamped"
+    touch_image(str(root / "x" / "DSC1.jpg"))
+    # Compositions from earlier runs, beside the sources or in the output folder
+    touch_image(str(root / "DSC0_with_metadata.jpg"))
+    touch_image(str(output_dir / "old.jpg"))
+
+    counts, reports = run_watch([str(root)], str(output_dir), tmp_path)
+    assert counts == {'rendered': 1, 'skipped': 0, 'failed': 0}
+    assert [os.path.basename(report['path']) for report in reports] == ["DSC1.jpg"]
+    assert os.path.exists(output_dir / "x" / "DSC1_with_metadata.jpg")
+
+    # The same contents under the same settings are skipped after a restart
+    counts, reports = run_watch([str(root)], str(output_dir), tmp_path)
+    assert counts == {'rendered': 0, 'skipped': 1, 'failed': 0}
+    assert reports == []
+
+
+def test_watch_survives_a_dying_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, 'render_file', crash_on_marked)
+    root = tmp_path / "photos"
+    # Different contents, or the ledger would skip one as already rendered
+    touch_image(str(root / "crash.jpg"), (40, 40, 200))
+    touch_image(str(root / "fine.jpg"))
+
+    counts, reports = run_watch([str(root)], str(tmp_path / "out"), tmp_path, workers=2)
+    assert counts == {'rendered': 1, 'skipped': 0, 'failed': 1}
+    errors = {os.path.basename(report['path']): report['error'] for report in reports}
+    assert errors['fine.jpg'] is None
+    assert errors['crash.jpg'].startswith("BrokenProcessPool")
+
+
+def test_batch_survives_a_dying_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, 'render_file', crash_on_marked)
+    paths = [touch_image(str(tmp_path / name)) for name in ("a.jpg", "crash.jpg", "b.jpg")]
+
+    reports = batch.run_batch(paths, str(tmp_path / "out"), workers=2, use_cache=False, **SPEC_OPTIONS)
+    assert [report['path'] for report in reports] == paths
+    assert [report['error'] is None for report in reports] == [True, False, True]
+    assert reports[1]['error'].startswith("BrokenProcessPool")
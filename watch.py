@@ -0,0 +1,436 @@
+"""Watch-folder daemon: render new and changed images as they land in a folder.
+
+Usage:
+    python watch.py ~/Exports -o ~/Exports/stamped -j 2 [--settle 2] [--poll]
+
+New or rewritten images are picked up through inotify on Linux, or by rescanning the
+folders every --interval seconds elsewhere (or with --poll). A file is rendered once
+its size and modification time have stayed unchanged for --settle seconds, so
+exports still being written are left alone. Files whose contents were already
+rendered with the same settings are skipped, and at most -j renders run at once
+however many files arrive; the rest wait in a queue.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import sqlite3
+import struct
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from batch import (IMAGE_EXTENSIONS, crash_report, init_worker, is_output_name, is_within,
+                   output_path_for, print_report, render_file)
+from stampcore.cache import default_cache_dir, file_digest
+from stampcore.export import DEFAULT_PRESET, EXPORT_PRESETS
+from stampcore.fonts import FontIndex
+from stampcore.palette import DEFAULT_BACKEND, PALETTE_BACKENDS
+from stampcore.spec import make_spec
+
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 2.0
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_image(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(path).startswith('.')
+
+
+def has_stem_sibling(path):
+    """Whether another image in the same folder has the same name without extension"""
+    directory, name = os.path.split(path)
+    stem = os.path.splitext(name)[0]
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return False
+    return any(other != name and os.path.splitext(other)[0] == stem and is_image(other) for other in names)
+
+
+def scan_images(directory, ignore=()):
+    """Every image below directory, skipping the ignored directories"""
+    paths = []
+    for parent, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if os.path.join(parent, d) not in ignore and not d.startswith('.')]
+        paths.extend(os.path.join(parent, name) for name in files if is_image(name))
+    return paths
+
+
+class PollingWatcher:
+    """Finds changed images by rescanning the folders and comparing size and mtime"""
+
+    def __init__(self, roots, ignore=(), interval=DEFAULT_POLL_INTERVAL):
+        self.roots = roots
+        self.ignore = ignore
+        self.interval = interval
+        self.seen = {}
+        self.next_scan = 0
+
+    def close(self):
+        pass
+
+    def changes(self, timeout):
+        """Paths that appeared or changed since the last call, waiting at most timeout seconds"""
+        delay = self.next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(delay, 0))
+        self.next_scan = time.monotonic() + self.interval
+
+        changed = set()
+        seen = {}
+        for root in self.roots:
+            for path in scan_images(root, self.ignore):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen[path] = (st.st_size, st.st_mtime_ns)
+                if self.seen.get(path) != seen[path]:
+                    changed.add(path)
+        self.seen = seen
+        return changed
+
+
+class InotifyWatcher:
+    """Linux inotify watches on every directory below the roots, through libc via ctypes"""
+
+    def __init__(self, roots, ignore=()):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.roots = roots
+        self.ignore = ignore
+        self.watches = {}   # watch descriptor -> directory
+        # Images found while adding watches (new directories may arrive already filled)
+        self.pending = set()
+        for root in roots:
+            self.add_tree(root)
+        self.pending.clear()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_tree(self, directory):
+        """Watch directory and everything below it, remembering the images already there"""
+        for parent, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if os.path.join(parent, d) not in self.ignore and not d.startswith('.')]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(parent), WATCH_MASK | IN_ONLYDIR)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(err, "inotify watch limit reached (raise fs.inotify.max_user_watches or use --poll)")
+                continue
+            self.watches[wd] = parent
+            self.pending.update(os.path.join(parent, name) for name in files if is_image(name))
+
+    def changes(self, timeout):
+        """Paths created, written or moved in since the last call, waiting at most timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                data = os.read(self.fd, 256 * 1024)
+            except BlockingIOError:
+                data = b''
+            self.parse_events(data)
+        changed, self.pending = self.pending, set()
+        return changed
+
+    def parse_events(self, data):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; fall back to treating everything as changed
+                for root in self.roots:
+                    self.pending.update(scan_images(root, self.ignore))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path not in self.ignore and not name.startswith('.'):
+                    self.add_tree(path)
+            elif is_image(name) and mask & (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.pending.add(path)
+
+
+def open_watcher(roots, ignore=(), poll=False, interval=DEFAULT_POLL_INTERVAL):
+    """An inotify watcher where available, otherwise a polling one"""
+    if not poll:
+        try:
+            return InotifyWatcher(roots, ignore)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling every {interval:g}s")
+    return PollingWatcher(roots, ignore, interval)
+
+
+class RenderLedger:
+    """Records which file contents were rendered with which settings, across restarts"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(default_cache_dir(), "watch.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS rendered ("
+            " digest TEXT, settings TEXT, outputs TEXT, rendered_at REAL,"
+            " PRIMARY KEY (digest, settings))"
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def is_rendered(self, digest, settings):
+        """True if these contents were rendered with these settings and the outputs still exist"""
+        row = self.db.execute(
+            "SELECT outputs FROM rendered WHERE digest = ? AND settings = ?", (digest, settings)
+        ).fetchone()
+        return row is not None and all(os.path.exists(path) for path in json.loads(row[0]))
+
+    def mark_rendered(self, digest, settings, outputs):
+        self.db.execute(
+            "INSERT OR REPLACE INTO rendered VALUES (?, ?, ?, ?)", (digest, settings, json.dumps(outputs), time.time())
+        )
+        self.db.commit()
+
+
+def watch(roots, output_dir, workers=2, settle=DEFAULT_SETTLE_SECONDS, poll=False, interval=DEFAULT_POLL_INTERVAL,
+          ledger=None, spec_options=None, preset=DEFAULT_PRESET, use_cache=True, on_result=print_report,
+          max_idle=None, memory_budget=None):
+    """Render images as they settle in the watched folders until interrupted.
+
+    spec_options are the RenderSpec fields shared by every image (font, colors, ...).
+    memory_budget (bytes) renders in low-memory mode (see ImageAsset).
+    With max_idle set, return once nothing has happened for that many seconds (used
+    for scripted runs). If a worker process dies, the pool is replaced and its renders
+    are retried one at a time; a file that kills its worker again counts as failed.
+    """
+    spec_options = dict(spec_options or {})
+    roots = [os.path.abspath(root) for root in roots]
+    output_dir = os.path.abspath(output_dir)
+    if any(is_within(root, output_dir) for root in roots):
+        # Every output would land in a watched folder and be rendered again
+        raise ValueError(f"output directory {output_dir} must not be a watched folder or contain one")
+    os.makedirs(output_dir, exist_ok=True)
+    # Outputs mirror the folders below the watched roots, so same-named files do not collide
+    source_root = os.path.commonpath(roots)
+    # The settings key covers everything that changes the output
+    settings = dict(spec_options, preset=preset, output_dir=output_dir)
+    if memory_budget:
+        # Low-memory renders reduce differently, so they do not count as the normal ones
+        settings['memory_budget'] = memory_budget
+    settings = json.dumps(settings, sort_keys=True)
+    ledger = ledger or RenderLedger()
+
+    # Our own outputs must never trigger renders: the output folder is not watched when it
+    # lies inside a root, and compositions found anywhere else are skipped below
+    watcher = open_watcher(roots, ignore={output_dir}, poll=poll, interval=interval)
+    settling = {}          # path -> (size, mtime_ns, time the file was last seen changing)
+    queue = OrderedDict()  # settled paths waiting for a worker, oldest first
+    running = {}           # future -> (path, digest, output path)
+    suspects = set()       # paths whose render was cut short by a dying worker
+    last_activity = time.monotonic()
+    counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+
+    # Images already in the folders are checked once at startup like new arrivals
+    changed = set()
+    for root in roots:
+        changed.update(scan_images(root, ignore={output_dir}))
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    try:
+        while True:
+            now = time.monotonic()
+            for path in changed:
+                if is_output_name(path) or is_within(os.path.abspath(path), output_dir):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    settling.pop(path, None)
+                    continue
+                settling[path] = (st.st_size, st.st_mtime_ns, now)
+                last_activity = now
+
+            # Debounce: a file is queued once it stopped changing for `settle` seconds
+            for path, (size, mtime_ns, since) in list(settling.items()):
+                if now - since < settle:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del settling[path]
+                    continue
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    settling[path] = (st.st_size, st.st_mtime_ns, now)
+                elif path not in queue:
+                    del settling[path]
+                    queue[path] = None
+
+            # Keep at most `workers` renders in flight; a file still rendering waits its turn.
+            # Suspects render alone, so a file that kills its worker takes no other render with it
+            in_flight = {path for path, _, _ in running.values()}
+            for path in list(queue):
+                if len(running) >= workers or suspects & in_flight:
+                    break
+                if path in in_flight or (path in suspects and running):
+                    continue
+                del queue[path]
+                try:
+                    digest = file_digest(path)
+                except OSError:
+                    continue
+                if ledger.is_rendered(digest, settings):
+                    counts['skipped'] += 1
+                    continue
+                spec = make_spec(path, **spec_options)
+                output_path = output_path_for(path, output_dir, source_root=source_root,
+                                              qualify=has_stem_sibling(path))
+                future = pool.submit(render_file, spec, output_path, use_cache, preset, memory_budget)
+                running[future] = (path, digest, output_path)
+                in_flight.add(path)
+
+            if running:
+                done, _ = wait(running, timeout=0)
+                broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+                if broken:
+                    # Every render still in flight fails with the pool; collect them all before replacing it
+                    done, _ = wait(running)
+                for future in done:
+                    path, digest, output_path = running.pop(future)
+                    try:
+                        report = future.result()
+                    except BrokenProcessPool as e:
+                        # A worker died (crash or OOM kill) and took every render in flight with it
+                        if path not in suspects:
+                            suspects.add(path)
+                            queue[path] = None
+                            continue
+                        report = crash_report(path, output_path, e)
+                    suspects.discard(path)
+                    if report['error']:
+                        counts['failed'] += 1
+                    else:
+                        counts['rendered'] += 1
+                        ledger.mark_rendered(digest, settings, report['outputs'])
+                    if on_result:
+                        on_result(report)
+                    last_activity = time.monotonic()
+                if broken:
+                    print("A worker process died; restarting the render pool", file=sys.stderr)
+                    pool.shutdown()
+                    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+            if max_idle is not None and not (settling or queue or running) \
+                    and time.monotonic() - last_activity >= max_idle:
+                return counts
+
+            # Wake up for file events, the next settle deadline or finished renders
+            timeout = 0.1 if running else (settle / 4 if settling or queue else 1.0)
+            changed = watcher.changes(timeout)
+    finally:
+        pool.shutdown()
+        watcher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folders", nargs="+", help="Folders to watch (including subfolders)")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory for the compositions")
+    parser.add_argument("-j", "--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Maximum number of images rendered at once")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="Seconds a file must stay unchanged before it is rendered")
+    parser.add_argument("--poll", action="store_true", help="Rescan the folders instead of using inotify")
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between rescans when polling")
+    parser.add_argument("--font", help="Path, file name or family of a TrueType/OpenType font (default: Pillow's built-in font)")
+    parser.add_argument("--font-size", type=int, default=24, help="Font size for the metadata text")
+    parser.add_argument("--no-shadow", action="store_true", help="Disable the drop shadow")
+    parser.add_argument("--colors", type=int, default=10, help="Number of palette colors to extract")
+    parser.add_argument("--backend", choices=sorted(PALETTE_BACKENDS), default=DEFAULT_BACKEND,
+                        help="Palette extraction backend (see stampcore/palette.py for the speed/quality trade-offs)")
+    parser.add_argument("--preset", choices=list(EXPORT_PRESETS), default=DEFAULT_PRESET,
+                        help="Export preset: formats and encoder settings written per image (see stampcore/export.py)")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Low-memory mode: hold at most this many MB of decoded pixels per image "
+                             "(uncompressed TIFFs are streamed, other sources that do not fit fail)")
+    parser.add_argument("--ledger", help="Database of rendered contents (default: ~/.cache/colorstamp/watch.sqlite3)")
+    args = parser.parse_args(argv)
+
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            print(f"Not a directory: {folder}", file=sys.stderr)
+            return 1
+
+    font_path = args.font
+    if font_path and not os.path.isfile(font_path):
+        font_index = FontIndex()
+        font_index.refresh()
+        font_path = font_index.lookup(font_path)
+        if not font_path:
+            print(f"Font not found: {args.font}", file=sys.stderr)
+            return 1
+
+    spec_options = {
+        'font_path': font_path, 'font_size': args.font_size, 'shadow': not args.no_shadow,
+        'num_colors': args.colors, 'backend': args.backend,
+    }
+    print(f"Watching {', '.join(args.folders)} -> {args.output_dir} with up to {args.workers} renders at once")
+    try:
+        watch(args.folders, args.output_dir, workers=args.workers, settle=args.settle, poll=args.poll,
+              interval=args.interval, ledger=RenderLedger(args.ledger) if args.ledger else None,
+              spec_options=spec_options, preset=args.preset,
+              memory_budget=args.memory_budget * 2**20 if args.memory_budget else None)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        print("Stopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())